@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: article HTML-to-text extraction in kiwix_tool.py.
+
+Compares the original BeautifulSoup path (parse whole page, decompose boilerplate,
+get_text, slice) against the streaming _TextExtractor that stops at the text budget.
+
+Usage:
+    python3 benchmarks/bench_extractor.py                   # synthetic ~2 MB article
+    python3 benchmarks/bench_extractor.py --html page.html  # saved kiwix-serve article
+"""
+import argparse
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+import kiwix_tool  # noqa: E402
+
+def make_article(paragraphs):
+    # Roughly the shape of a Wikipedia/StackOverflow page: heavy head, nav, long body, footer
+    head = "<html><head><title>Bench</title>" + "<style>.a{color:red}</style>" * 50 + \
+           "<script>var x = '<p>not text</p>';</script>" * 50 + "</head><body>"
+    nav = "<nav>" + "".join(f"<a href='/l{i}'>Link {i}</a>" for i in range(500)) + "</nav>"
+    infobox = "<table class='infobox vcard'><tr><th>Formula</th><td>H<sub>2</sub>O</td></tr>" \
+              "<tr><td><table class='infobox'><tr><td>nested</td></tr></table></td></tr></table>"
+    navbox = "<div class='navbox'><div>" + " | ".join(f"<a href='/n{i}'>Topic {i}</a>" for i in range(200)) + "</div></div>"
+    body = "".join(
+        f"<h2>Section {i}</h2><p>Paragraph {i} on water purification: boil for one minute, "
+        f"then filter through <b>ceramic</b> &amp; charcoal.<sup class='reference'><a href='#c{i}'>[{i}]</a></sup> "
+        f"<a href='/x{i}'>See also</a><br class='noprint'></p>"
+        f"<table><tr><td>row {i}</td><td>{i * 3.14:.2f}</td></tr></table>"
+        for i in range(paragraphs)
+    )
+    return (head + nav + infobox + body + navbox + "<footer>Footer text</footer></body></html>").encode()
+
+def bs4_extract(html, limit):
+    soup = BeautifulSoup(html, 'html.parser')
+    for script in soup(["script", "style", "nav", "footer", "header", "form"]):
+        script.decompose()
+    for element in soup.select(", ".join("." + c for c in sorted(kiwix_tool._TextExtractor.SKIP_CLASSES))):
+        element.decompose()
+    return soup.get_text(separator=' ', strip=True)[:limit]
+
+def stream_extract(html, limit):
+    return kiwix_tool._html_to_text(html, limit)
+
+def bench(fn, html, limit, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(html, limit)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML extraction microbenchmark")
+    parser.add_argument("--html", help="Path to a saved article HTML file")
+    parser.add_argument("--paragraphs", type=int, default=8000, help="Size of the synthetic article")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.html:
+        with open(args.html, "rb") as f:
+            html = f.read()
+    else:
+        html = make_article(args.paragraphs)
+
+    print(f"=== Extractor Benchmark ({len(html) / 1024:.0f} KB of HTML) ===")
+
+    # Both paths must agree on the text they produce
+    full = len(html)
+    if bs4_extract(html, full) != stream_extract(html, full):
+        print("[!] Output mismatch between BeautifulSoup and streaming extractor.")
+        sys.exit(1)
+    print("[OK] Outputs identical on the full document.")
+
+    print(f"{'LIMIT':>10} | {'BS4 (ms)':>10} | {'STREAM (ms)':>12} | {'SPEEDUP':>8}")
+    print("-" * 50)
+    for limit in (6000, kiwix_tool.ARTICLE_TEXT_CHARS, full):
+        t_bs4 = bench(bs4_extract, html, limit, args.repeat)
+        t_stream = bench(stream_extract, html, limit, args.repeat)
+        label = "full" if limit == full else str(limit)
+        print(f"{label:>10} | {t_bs4 * 1000:>10.1f} | {t_stream * 1000:>12.1f} | {t_bs4 / t_stream:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
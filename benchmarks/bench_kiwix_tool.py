@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for kiwix_tool.py against the local fake kiwix-serve (fake_kiwix.py).
+
+Stages (each runs in its own process so peak RSS is per stage):
+    cold    every call starts with an empty catalog index and article cache
+    warm    same queries again after one priming pass (catalog + caches hot)
+    multi   4-part ';' queries, catalog warm, article cache off (sub-query fan-out)
+    titles  article-name queries, article cache off, title fast path on (/suggest first)
+    fulltext  the same queries with the fast path off (full-text /search only)
+
+Usage:
+    python3 benchmarks/bench_kiwix_tool.py --latency 0.01 --output bench.json
+    python3 benchmarks/bench_kiwix_tool.py --compare bench.json --fail-threshold 0.25
+    python3 benchmarks/bench_kiwix_tool.py --stages multi --stall 0.03 --stall-seconds 3   # tail under stalls
+    python3 benchmarks/bench_kiwix_tool.py --stages titles,fulltext --search-latency 0.2  # title fast path
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_kiwix  # noqa: E402
+
+QUERIES = [
+    ("water purification boiling", "general"),
+    ("python list comprehension", "code"),
+    ("generator voltage regulator", "repair"),
+    ("wound infection", "medical"),
+    ("solar battery", "engineering"),
+]
+# Mostly article names; the last two have no confident title (ambiguous / not a title)
+TITLE_QUERIES = [
+    ("Ohm's law", "general"),
+    ("water purification", "general"),
+    ("List comprehension", "code"),
+    ("raspberry pi", "general"),
+    ("battery", "repair"),
+    ("Mercury", "general"),
+    ("how to purify river water", "survival"),
+]
+MULTI_QUERIES = [
+    ("radio frequency; antenna; battery voltage; solar", "general"),
+    ("python list; filter; boiling water; generator", "code"),
+]
+
+def percentile(values, pct):
+    # Nearest-rank percentile
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+def summarize(latencies, wall, calls):
+    return {
+        "calls": calls,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": (sum(latencies) / len(latencies) * 1000) if latencies else 0.0,
+        "throughput_rps": calls / wall if wall else 0.0,
+    }
+
+def reset_tool_state(kiwix_tool):
+    kiwix_tool._CATALOGS.clear()
+    kiwix_tool._CACHES.clear()
+    kiwix_tool._BACKEND.reset()
+
+async def drive(kiwix_tool, base_url, stage, iterations, concurrency, cache_dir):
+    tools = kiwix_tool.Tools()
+    tools.kiwix_host = base_url
+    tools.valves.cache_dir = cache_dir
+    workload = {"multi": MULTI_QUERIES, "titles": TITLE_QUERIES, "fulltext": TITLE_QUERIES}.get(stage, QUERIES)
+    if stage in ("multi", "titles", "fulltext"):
+        tools.valves.cache_enabled = False
+    tools.valves.title_fast_path = stage != "fulltext"
+
+    if stage in ("warm", "multi", "titles", "fulltext"):
+        # Priming pass, not measured
+        for query, context in workload:
+            await tools.search_knowledge_base(query, context)
+
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one_call(i):
+        query, context = workload[i % len(workload)]
+        async with sem:
+            if stage == "cold":
+                reset_tool_state(kiwix_tool)
+                tools.valves.cache_dir = os.path.join(cache_dir, f"cold_{i}")
+            start = time.perf_counter()
+            result = await tools.search_knowledge_base(query, context)
+            latencies.append(time.perf_counter() - start)
+            return result
+
+    wall_start = time.perf_counter()
+    results = await asyncio.gather(*[one_call(i) for i in range(iterations)])
+    wall = time.perf_counter() - wall_start
+    await kiwix_tool._close_sessions()
+
+    errors = sum(1 for r in results if "System Error" in r or "Timed out" in r)
+    summary = summarize(latencies, wall, iterations)
+    summary["errors"] = errors
+    summary["output_chars"] = sum(len(r) for r in results) // max(iterations, 1)
+    summary["title_fast_path"] = kiwix_tool.title_stats()
+    return summary
+
+def stage_worker(stage, base_url, iterations, concurrency, queue):
+    # Runs in a fresh process: cold imports, and ru_maxrss covers only this stage
+    import kiwix_tool
+    with tempfile.TemporaryDirectory() as cache_dir:
+        summary = asyncio.run(drive(kiwix_tool, base_url, stage, iterations, concurrency, cache_dir))
+    summary["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    queue.put(summary)
+
+def run_stage(stage, base_url, iterations, concurrency):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=stage_worker, args=(stage, base_url, iterations, concurrency, queue))
+    proc.start()
+    summary = queue.get()
+    proc.join()
+    return summary
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"],
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(current, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\n=== Compared to {baseline_path} ({baseline['meta'].get('revision')}) ===")
+    print(f"{'STAGE':<8} | {'METRIC':<11} | {'BEFORE':>10} | {'AFTER':>10} | {'CHANGE':>8}")
+    print("-" * 59)
+    regressions = []
+    for stage, after in current["stages"].items():
+        before = baseline["stages"].get(stage)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"):
+            b, a = before[metric], after[metric]
+            change = (a - b) / b if b else 0.0
+            print(f"{stage:<8} | {metric:<11} | {b:>10.1f} | {a:>10.1f} | {change:>+7.1%}")
+            if metric == "p95_ms" and threshold is not None and change > threshold:
+                regressions.append(f"{stage} p95 {change:+.1%}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="kiwix_tool latency benchmark")
+    parser.add_argument("--stages", default="cold,warm,multi")
+    parser.add_argument("--iterations", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=1, help="Tool calls in flight at once")
+    parser.add_argument("--latency", type=float, default=0.005, help="Injected server latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--stall", type=float, default=0.0, help="Fraction of server responses that stall")
+    parser.add_argument("--stall-seconds", type=float, default=3.0)
+    parser.add_argument("--search-latency", type=float, default=0.0, help="Extra server time for full-text /search (s)")
+    parser.add_argument("--article-kb", type=int, default=512)
+    parser.add_argument("--fixtures", help="Recorded fixtures directory (see fake_kiwix.py)")
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--compare", help="Baseline JSON from a previous run")
+    parser.add_argument("--fail-threshold", type=float, help="Exit 1 if any p95 regresses by more than this fraction")
+    args = parser.parse_args()
+
+    server, base_url, server_stats = fake_kiwix.start_server(0, args.latency, args.jitter, args.fixtures,
+                                                             args.article_kb, args.stall, args.stall_seconds,
+                                                             args.search_latency)
+    print(f"=== kiwix_tool Benchmark (server {base_url}, latency {args.latency}s) ===")
+    print(f"{'STAGE':<8} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'req/s':>7} | {'RSS MB':>7} | {'ERR':>4}")
+    print("-" * 66)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "stall": args.stall,
+            "stall_seconds": args.stall_seconds,
+            "search_latency": args.search_latency,
+            "article_kb": args.article_kb,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "fixtures": args.fixtures,
+        },
+        "stages": {},
+    }
+    for stage in [s.strip() for s in args.stages.split(",") if s.strip()]:
+        before = server_stats["requests"]
+        summary = run_stage(stage, base_url, args.iterations, args.concurrency)
+        summary["server_requests"] = server_stats["requests"] - before
+        results["stages"][stage] = summary
+        print(f"{stage:<8} | {summary['p50_ms']:>8.1f} | {summary['p95_ms']:>8.1f} | {summary['p99_ms']:>8.1f} | "
+              f"{summary['throughput_rps']:>7.1f} | {summary['peak_rss_mb']:>7.1f} | {summary['errors']:>4}")
+        titles = summary["title_fast_path"]
+        if stage == "titles":
+            print(f"         title fast path: {titles['hits']} hits / {titles['misses']} misses / "
+                  f"{titles['errors']} errors, suggest {titles['suggest_mean_ms']:.1f} ms vs full-text "
+                  f"{titles['fulltext_mean_ms']:.1f} ms, {titles['saved_ms']:.0f} ms saved")
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[OK] Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.fail_threshold)
+        if regressions:
+            print(f"\n[FAIL] Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
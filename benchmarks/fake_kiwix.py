@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for kiwix-serve, used by the kiwix_tool benchmarks.
+
+Serves the endpoints the tool calls (/catalog/v2/entries, /suggest, /search, /content/...)
+from recorded fixtures or synthetic pages, with configurable injected latency. /suggest
+answers from a fixed list of article titles; --search-latency makes full-text /search
+slower than the title lookup, as Xapian is on a real archive.
+
+Fixture directory layout (all optional, synthetic data fills the gaps):
+    catalog.xml          OPDS feed returned by /catalog/v2/entries
+    search.html          result page for every /search (links are rewritten to the requested book)
+    articles/*.html      article bodies, served round-robin for every /content/ path
+
+Usage:
+    python3 benchmarks/fake_kiwix.py --port 8099 --latency 0.02
+    python3 benchmarks/fake_kiwix.py --port 8099 --latency 0.02 --stall 0.02 --stall-seconds 3
+    python3 benchmarks/fake_kiwix.py --port 8099 --latency 0.01 --search-latency 0.2
+    python3 benchmarks/fake_kiwix.py --record http://localhost:8080 --book wikipedia_en_all_nopic_2025-12 \
+        --query "water purification" --fixtures benchmarks/fixtures
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# Mirrors a slice of MANIFEST (maintenance/download_manifest.py)
+BOOKS = [
+    ("wikipedia_en_all_nopic_2025-12", "wikipedia_en_all_nopic", "Wikipedia English"),
+    ("wikipedia_en_medicine_maxi_2025-11", "wikipedia_en_medicine_maxi", "WikiMed Medical Encyclopedia"),
+    ("stackoverflow.com_en_all_2025-10", "stackoverflow.com_en_all", "Stack Overflow"),
+    ("ifixit_en_all_2025-06", "ifixit_en_all", "iFixit"),
+    ("appropedia_en_all_maxi_2025-09", "appropedia_en_all_maxi", "Appropedia"),
+    ("electronics.stackexchange.com_en_all_2025-10", "electronics.stackexchange.com_en_all", "Electronics Stack Exchange"),
+    ("archlinux_en_all_maxi_2025-08", "archlinux_en_all_maxi", "ArchWiki"),
+    ("gutenberg_en_all_2023-08", "gutenberg_en_all", "Project Gutenberg"),
+]
+
+TOPICS = ["water", "purification", "boiling", "filter", "generator", "voltage", "python", "list",
+          "antenna", "radio", "frequency", "battery", "solar", "wound", "infection", "bread"]
+
+# Article titles every book "contains", for /suggest
+TITLES = ["Ohm's law", "Water purification", "Boiling", "Water filter", "Electric generator",
+          "Voltage regulator", "Voltage", "Python (programming language)", "Python (genus)",
+          "List comprehension", "Antenna (radio)", "Radio frequency", "Battery (electricity)",
+          "Solar panel", "Solar energy", "Wound", "Wound healing", "Infection", "Bread",
+          "Raspberry Pi", "Mercury (planet)", "Mercury (element)"]
+
+def synthetic_catalog():
+    entries = "".join(
+        f"<entry><id>urn:uuid:{hashlib.md5(book_id.encode()).hexdigest()}</id>"
+        f"<title>{title}</title><name>{name}</name><language>eng</language>"
+        f"<updated>2025-12-01T00:00:00Z</updated>"
+        f"<link rel=\"http://opds-spec.org/acquisition/open-access\" type=\"application/x-zim\" href=\"/{book_id}.zim\"/>"
+        f"<link type=\"text/html\" href=\"/content/{book_id}\"/></entry>"
+        for book_id, name, title in BOOKS
+    )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opds="http://opds-spec.org/2010/catalog">'
+            f'<title>All zims</title><updated>2025-12-01T00:00:00Z</updated>{entries}</feed>').encode()
+
+def synthetic_search(book_id, pattern, hits=20):
+    slug = "_".join(w.capitalize() for w in pattern.split()) or "Main_Page"
+    items = "".join(
+        f"<li><a href=\"/content/{book_id}/A/{slug}{'' if i == 0 else f'_({i})'}\">{pattern} {i}</a>"
+        f"<cite>...{pattern} appears in this article...</cite><div class=\"book-title\">from {book_id}</div></li>"
+        for i in range(hits)
+    )
+    return (f"<!DOCTYPE html><html><head><link type=\"text/css\" href=\"/skin/search_results.css\"/></head>"
+            f"<body><div class=\"header\"><a href=\"/search?content={book_id}&pattern={urllib.parse.quote(pattern)}&start=0\">"
+            f"Results 1-{hits}</a></div><div class=\"results\"><ul>{items}</ul></div></body></html>").encode()
+
+def synthetic_article(seed, size_kb):
+    # Wikipedia-shaped page: heavy head, big nav, long body with the topic words sprinkled in
+    rng = random.Random(seed)
+    head = ("<!DOCTYPE html><html><head><title>Article</title>" + "<style>.mw{margin:0}</style>" * 40 +
+            "<script>window.RLQ=window.RLQ||[];</script>" * 40 + "</head><body>")
+    nav = "<nav>" + "".join(f"<a href='/A/Link_{i}'>Link {i}</a>" for i in range(400)) + "</nav>"
+    parts = [head, nav]
+    size = sum(len(p) for p in parts)
+    i = 0
+    while size < size_kb * 1024:
+        words = " ".join(rng.choice(TOPICS + ["the", "of", "and", "a", "to", "is"] * 4) for _ in range(90))
+        para = f"<h2>Section {i}</h2><p>{words.capitalize()}.</p><table><tr><td>{i}</td><td>{rng.random():.3f}</td></tr></table>"
+        parts.append(para)
+        size += len(para)
+        i += 1
+    parts.append("<footer>Content is available under CC BY-SA.</footer></body></html>")
+    return "".join(parts).encode()
+
+def synthetic_suggest(book_id, term, count=10):
+    # Titles with a word starting with every term word, in kiwix-serve's JSON shape
+    words = re.findall(r"\w+", term.lower())
+    matches = [t for t in TITLES
+               if words and all(any(w.startswith(q) for w in re.findall(r"\w+", t.lower())) for q in words)]
+    items = [{"value": t, "label": t, "kind": "path", "path": f"A/{t.replace(' ', '_')}"} for t in matches[:count]]
+    items.append({"value": f"{term} ", "label": f"containing '{term}'...", "kind": "pattern", "first": not items})
+    return json.dumps(items).encode()
+
+class Fixtures:
+    def __init__(self, fixtures_dir=None, article_kb=512):
+        self.catalog = synthetic_catalog()
+        self.search_template = None
+        self.articles = [synthetic_article(seed, article_kb) for seed in range(4)]
+        if fixtures_dir:
+            self._load(fixtures_dir)
+        self.catalog_etag = '"%s"' % hashlib.md5(self.catalog).hexdigest()
+
+    def _load(self, fixtures_dir):
+        path = os.path.join(fixtures_dir, "catalog.xml")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.catalog = f.read()
+        path = os.path.join(fixtures_dir, "search.html")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.search_template = f.read()
+        art_dir = os.path.join(fixtures_dir, "articles")
+        if os.path.isdir(art_dir):
+            recorded = []
+            for name in sorted(os.listdir(art_dir)):
+                with open(os.path.join(art_dir, name), "rb") as f:
+                    recorded.append(f.read())
+            if recorded:
+                self.articles = recorded
+
+    def search(self, book_id, pattern):
+        if self.search_template is None:
+            return synthetic_search(book_id, pattern)
+        # Point the recorded links at whichever book was asked for
+        return re.sub(rb'/content/[^/"]+/', f"/content/{book_id}/".encode(), self.search_template)
+
+    def article(self, path):
+        return self.articles[int(hashlib.md5(path.encode()).hexdigest(), 16) % len(self.articles)]
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive or half-read connections is normal here
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+def make_handler(fixtures, latency, jitter, stats, stall=0.0, stall_seconds=0.0, search_latency=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, ctype="text/html; charset=utf-8", code=200, headers=None):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # Client stopped reading early (streaming extractor hit its budget)
+                self.close_connection = True
+
+        def do_GET(self):
+            if latency or jitter:
+                time.sleep(latency + random.uniform(0, jitter))
+            if stall and random.random() < stall:
+                # A stuck request (cold disk, busy worker): the tail the tool has to hedge around
+                with stats["lock"]:
+                    stats["stalls"] += 1
+                time.sleep(stall_seconds)
+            url = urllib.parse.urlparse(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            with stats["lock"]:
+                stats["requests"] += 1
+
+            if url.path == "/catalog/v2/entries":
+                if self.headers.get("If-None-Match") == fixtures.catalog_etag:
+                    return self._send(b"", code=304)
+                return self._send(fixtures.catalog, "application/atom+xml;profile=opds-catalog;kind=acquisition",
+                                  headers={"ETag": fixtures.catalog_etag})
+            if url.path == "/suggest":
+                with stats["lock"]:
+                    stats["suggests"] += 1
+                book_id = (query.get("content") or query.get("books.name") or [""])[0]
+                return self._send(synthetic_suggest(book_id, (query.get("term") or [""])[0],
+                                                    int((query.get("count") or ["10"])[0])),
+                                  "application/json; charset=utf-8")
+            if url.path == "/search":
+                with stats["lock"]:
+                    stats["searches"] += 1
+                if search_latency:
+                    time.sleep(search_latency)
+                book_id = (query.get("content") or query.get("books.name") or [""])[0]
+                pattern = (query.get("pattern") or [""])[0]
+                return self._send(fixtures.search(book_id, pattern))
+            if url.path.startswith("/content/"):
+                return self._send(fixtures.article(url.path))
+            self._send(b"Not Found", code=404)
+
+    return Handler
+
+def start_server(port=0, latency=0.0, jitter=0.0, fixtures_dir=None, article_kb=512, stall=0.0, stall_seconds=0.0,
+                 search_latency=0.0):
+    """Starts the fake server on a background thread; returns (server, base_url, stats)."""
+    stats = {"requests": 0, "stalls": 0, "suggests": 0, "searches": 0, "lock": threading.Lock()}
+    fixtures = Fixtures(fixtures_dir, article_kb)
+    server = QuietServer(("127.0.0.1", port), make_handler(fixtures, latency, jitter, stats, stall, stall_seconds,
+                                                          search_latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", stats
+
+def record(host, book_id, query, fixtures_dir, articles=3):
+    # Capture real kiwix-serve responses as fixtures
+    os.makedirs(os.path.join(fixtures_dir, "articles"), exist_ok=True)
+    print(f"[*] Recording catalog from {host}...")
+    r = requests.get(f"{host}/catalog/v2/entries", timeout=30)
+    r.raise_for_status()
+    with open(os.path.join(fixtures_dir, "catalog.xml"), "wb") as f:
+        f.write(r.content)
+
+    print(f"[*] Recording search '{query}' in {book_id}...")
+    r = requests.get(f"{host}/search", params={"content": book_id, "pattern": query}, timeout=60)
+    r.raise_for_status()
+    with open(os.path.join(fixtures_dir, "search.html"), "wb") as f:
+        f.write(r.content)
+
+    links = []
+    for href in re.findall(r'href="(/content/[^"]+)"', r.text):
+        if href not in links and "search?" not in href:
+            links.append(href)
+    for i, href in enumerate(links[:articles]):
+        print(f"    [+] {href}")
+        a = requests.get(host + href, timeout=60)
+        with open(os.path.join(fixtures_dir, "articles", f"article_{i}.html"), "wb") as f:
+            f.write(a.content)
+    print(f"[OK] Fixtures written to {fixtures_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake kiwix-serve for benchmarks")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, 0..N seconds")
+    parser.add_argument("--fixtures", help="Directory with recorded fixtures")
+    parser.add_argument("--article-kb", type=int, default=512, help="Size of synthetic articles")
+    parser.add_argument("--stall", type=float, default=0.0, help="Fraction of responses that stall")
+    parser.add_argument("--stall-seconds", type=float, default=3.0, help="How long a stalled response takes")
+    parser.add_argument("--search-latency", type=float, default=0.0, help="Extra seconds for full-text /search")
+    parser.add_argument("--record", metavar="HOST", help="Record fixtures from a real kiwix-serve instead")
+    parser.add_argument("--book", help="Book ID to record a search from")
+    parser.add_argument("--query", default="water purification")
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.book or not args.fixtures:
+            print("[!] --record needs --book and --fixtures")
+            sys.exit(1)
+        record(args.record, args.book, args.query, args.fixtures)
+        return
+
+    server, url, _ = start_server(args.port, args.latency, args.jitter, args.fixtures, args.article_kb,
+                                  args.stall, args.stall_seconds, args.search_latency)
+    print(f"=== Fake kiwix-serve on {url} (latency {args.latency}s) ===")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
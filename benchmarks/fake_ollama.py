@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Ollama's embedding API, used to test maintenance/semantic_index.py and
+the tool's semantic retrieval without a model.
+
+POST /api/embed returns deterministic unit vectors built by hashing words and character
+trigrams, so texts sharing vocabulary (or word stems) land close together. GET /stats
+reports how many requests and inputs were embedded; --fail-after makes every embed
+request after the first N fail, to exercise resuming an interrupted build, and
+--malformed answers 200 with no embeddings, to exercise bad responses.
+
+Usage:
+    python3 benchmarks/fake_ollama.py --port 11499
+    python3 benchmarks/fake_ollama.py --port 11499 --fail-after 3
+    python3 benchmarks/fake_ollama.py --port 11499 --malformed
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+DIM = 768
+PREFIX_RE = re.compile(r'^(search_query|search_document|clustering|classification): ')
+
+def _features(text):
+    words = re.findall(r'\w+', PREFIX_RE.sub('', text).lower())
+    for word in words:
+        yield word, 1.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3], 0.3
+
+def embed_text(text, dim=DIM):
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in _features(text):
+        h = int.from_bytes(hashlib.md5(feature.encode()).digest()[:8], "little")
+        vector[h % dim] += weight if (h >> 63) else -weight
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm if norm else vector).tolist()
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+def make_handler(dim, latency, fail_after, stats, malformed=False):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with stats["lock"]:
+                    self._send(200, {k: v for k, v in stats.items() if k != "lock"})
+            elif self.path == "/api/tags":
+                self._send(200, {"models": [{"name": "nomic-embed-text:latest"}]})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/api/embed":
+                self._send(404, {"error": "not found"})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            with stats["lock"]:
+                stats["requests"] += 1
+                failing = fail_after is not None and stats["requests"] > fail_after
+                if not failing:
+                    stats["inputs"] += len(inputs)
+                    stats["largest_batch"] = max(stats["largest_batch"], len(inputs))
+            if latency:
+                time.sleep(latency)
+            if failing:
+                self._send(500, {"error": "injected failure"})
+                return
+            if malformed:
+                self._send(200, {})
+                return
+            self._send(200, {"model": request.get("model"), "embeddings": [embed_text(t, dim) for t in inputs]})
+
+    return Handler
+
+def start_server(port=0, dim=DIM, latency=0.0, fail_after=None, malformed=False):
+    """Starts the fake embedder on a background thread; returns (server, base_url, stats)."""
+    stats = {"requests": 0, "inputs": 0, "largest_batch": 0, "lock": threading.Lock()}
+    server = QuietServer(("127.0.0.1", port), make_handler(dim, latency, fail_after, stats, malformed))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama embedding endpoint")
+    parser.add_argument("--port", type=int, default=11499)
+    parser.add_argument("--dim", type=int, default=DIM)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every embed request")
+    parser.add_argument("--fail-after", type=int, help="Fail every embed request after the first N")
+    parser.add_argument("--malformed", action="store_true", help="Answer embed requests with 200 and no embeddings")
+    args = parser.parse_args()
+
+    server, url, _ = start_server(args.port, args.dim, args.latency, args.fail_after, args.malformed)
+    print(f"=== Fake Ollama embedder on {url} (dim {args.dim}) ===", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,18 @@ CIV_ROOT="${CIV_ROOT:-/opt/civilization}"
 INCOMING_DIR="${CIV_ROOT}/incoming"
 LIBRARY_DIR="${CIV_ROOT}/library"
 
+# Non-interactive mode: file every ZIM in incoming/ from its own metadata
+# (./civ_ingest.sh --auto [--watch] [zim_ingest.py options])
+if [ "$1" == "--auto" ]; then
+    shift
+    MODE="batch"
+    if [ "$1" == "--watch" ]; then
+        MODE="watch"
+        shift
+    fi
+    exec python3 "$(dirname "$0")/maintenance/zim_ingest.py" "$MODE" --incoming "$INCOMING_DIR" --library "$LIBRARY_DIR/zims" "$@"
+fi
+
 echo "=== Civilization Node Content Ingestion ==="
 echo "Scanning $INCOMING_DIR..."
 
@@ -16,7 +16,7 @@ echo ""
 echo "[*] Checking Incoming Queue..."
 FILE_COUNT=$(find "$INCOMING_DIR" -type f | wc -l)
 if [ "$FILE_COUNT" -gt 0 ]; then
-    echo "    [WARN] $FILE_COUNT file(s) waiting in incoming. Run civ_ingest.sh."
+    echo "    [WARN] $FILE_COUNT file(s) waiting in incoming. Run civ_ingest.sh (or civ_ingest.sh --auto for ZIMs)."
 else
     echo "    [OK] Incoming queue empty."
 fi
@@ -15,23 +15,52 @@ INCOMING_DIR = os.path.join(CIV_ROOT, "incoming")
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 INGEST_SCRIPT = os.path.join(SCRIPT_DIR, "civ_ingest.sh")
 
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "maintenance"))
+import download_scheduler  # noqa: E402
+import mirror_catalog  # noqa: E402
+import range_download  # noqa: E402
+
+CONNECTIONS = int(os.getenv("CIV_DOWNLOAD_CONNECTIONS", range_download.DEFAULT_CONNECTIONS))
+
 # Safety Thresholds
 WARN_SIZE_GB = 20.0
 WARN_PERCENT_FREE = 0.10  # Warn if file takes > 10% of remaining space
 
+BROWSE_LIMIT = 60  # entries printed per listing
+
+# Local mirror catalog (set in main); None falls back to live listings
+CATALOG = None
+
 def check_requirements():
     if not os.path.exists(INCOMING_DIR):
         print(f"[!] Incoming directory not found: {INCOMING_DIR}")
         sys.exit(1)
-    if subprocess.call(["which", "wget"], stdout=subprocess.DEVNULL) != 0:
-        print("[!] wget is not installed. Please install it.")
-        sys.exit(1)
 
 def transform_size_str(size_str):
     # Just for display, keep original
     return size_str.strip()
 
+def catalog_category(url):
+    # "" for the mirror root, "wikipedia/" for a category, None if the catalog can't answer
+    if CATALOG is None or not url.startswith(BASE_URL):
+        return None
+    rel = url[len(BASE_URL):]
+    if rel == "":
+        return rel
+    if rel.count("/") == 1 and rel.endswith("/") and mirror_catalog.browse(CATALOG, rel):
+        return rel
+    return None
+
 def get_items(url):
+    category = catalog_category(url)
+    if category == "":
+        dirs = [{'name': row['category'], 'type': 'dir'} for row in mirror_catalog.categories(CATALOG)]
+        return dirs, []
+    if category:
+        files = [{'name': row['name'], 'size_str': row['size_str'], 'type': 'file'}
+                 for row in mirror_catalog.browse(CATALOG, category)]
+        return [], files
+
     try:
         r = requests.get(url, timeout=10)
         r.raise_for_status()
@@ -79,10 +108,6 @@ def get_remote_file_size(url):
         pass
     return -1
 
-def get_free_space_bytes(folder):
-    s = os.statvfs(folder)
-    return s.f_bavail * s.f_frsize
-
 def browse_directory(current_url, path_history):
     print(f"\n=== Browsing: {current_url} ===")
     dirs, files = get_items(current_url)
@@ -100,12 +125,12 @@ def browse_directory(current_url, path_history):
         # Add size to display label
         options.append({'text': f"FILE: {f['name']} ({f['size_str']})", 'action': 'file', 'val': f['name']})
         
-    # Pagination? For now list all, assuming terminal scrolls.
-    # Wikipedia folder is huge, so we might want to filter eventually.
-    
-    for idx, opt in enumerate(options):
+    # Huge folders (wikipedia/ has thousands of files): show the head, filter for the rest
+    for idx, opt in enumerate(options[:BROWSE_LIMIT]):
         print(f"{idx + 1}) {opt['text']}")
-        
+    if len(options) > BROWSE_LIMIT:
+        print(f"... {len(options) - BROWSE_LIMIT} more (type text to filter)")
+
     print("0) Exit")
     
     try:
@@ -113,18 +138,24 @@ def browse_directory(current_url, path_history):
         if choice_input.isdigit():
             choice = int(choice_input)
         else:
-            # Simple filter
             print(f"\n--- Filtering for '{choice_input}' ---")
-            filtered_indices = []
-            for idx, opt in enumerate(options):
-                if choice_input.lower() in opt['text'].lower():
-                    print(f"{idx + 1}) {opt['text']}")
-                    filtered_indices.append(idx + 1)
-            
-            if not filtered_indices:
+            category = catalog_category(current_url)
+            if category is not None:
+                # Fuzzy search in the local catalog (whole mirror when at the root)
+                options = [
+                    {'text': f"FILE: {row['category'] + row['name']} ({row['size_str']})", 'action': 'file',
+                     'val': row['name'], 'url': mirror_catalog.file_url(row, BASE_URL)}
+                    for row in mirror_catalog.search(CATALOG, choice_input, category or None)
+                ]
+            else:
+                options = [opt for opt in options if choice_input.lower() in opt['text'].lower()]
+
+            if not options:
                 print("No matches.")
                 return current_url
-                
+
+            for idx, opt in enumerate(options):
+                print(f"{idx + 1}) {opt['text']}")
             choice = int(input("\nSelect filtered option: "))
             
     except ValueError:
@@ -149,7 +180,7 @@ def browse_directory(current_url, path_history):
         
     if opt['action'] == 'file':
         filename = opt['val']
-        download_url = urljoin(current_url, filename)
+        download_url = opt.get('url') or urljoin(current_url, filename)
         process_download(download_url, filename)
         return current_url
         
@@ -161,7 +192,9 @@ def process_download(url, filename):
     size_bytes = get_remote_file_size(url)
     size_gb = size_bytes / (1024**3)
     
-    free_bytes = get_free_space_bytes(INCOMING_DIR)
+    # Free space minus what running downloads (this or other scripts) have reserved
+    reservations = download_scheduler.DiskReservations(INCOMING_DIR, margin=0)
+    free_bytes = reservations.available()
     free_gb = free_bytes / (1024**3)
     
     print(f"    File Size:  {size_gb:.2f} GB")
@@ -198,9 +231,15 @@ def process_download(url, filename):
 
     # Proceed
     dest_path = os.path.join(INCOMING_DIR, filename)
+    if not reservations.reserve(dest_path, max(size_bytes, 0)):
+        print("\n[!!!] ERROR: Disk space was claimed by another download in the meantime.")
+        return
     print("\n[*] Starting Download...")
     try:
-        subprocess.run(["wget", "-c", "--show-progress", "-O", dest_path, url], check=True)
+        try:
+            range_download.download(url, dest_path, connections=CONNECTIONS)
+        finally:
+            reservations.release(dest_path)
         print("\n[OK] Download complete.")
         
         # Integration
@@ -218,7 +257,16 @@ def main():
     args = parser.parse_args()
 
     check_requirements()
-    
+
+    global CATALOG
+    print("[*] Refreshing mirror catalog...")
+    CATALOG = mirror_catalog.connect()
+    changed, unchanged, failed = mirror_catalog.refresh(CATALOG, BASE_URL)
+    if failed and not (changed or unchanged):
+        print("[!] Mirror unreachable, browsing the cached catalog (offline).")
+    if not mirror_catalog.categories(CATALOG):
+        CATALOG = None
+
     # Construct start URL
     if args.path:
         # Ensure path ends with slash if it's a dir, or handle logic
@@ -2,12 +2,150 @@
 title: Kiwix Knowledge Retrieval
 author: Civilization Node Operator
 description: Search offline ZIM archives (Wikipedia, StackOverflow, iFixit) and return ACTUAL CONTENT to the LLM.
+requirements: aiohttp
 """
 
-import requests
+import asyncio
+import aiohttp
 from bs4 import BeautifulSoup
 import urllib.parse
 import re
+import math
+import codecs
+import html
+import json
+import os
+import sqlite3
+import threading
+import logging
+import bisect
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+from html.parser import HTMLParser
+import time
+import unicodedata
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger("kiwix_tool")
+
+# Optional: direct ZIM access for Valves.backend = "zim" (pip install libzim)
+try:
+    from libzim.reader import Archive
+    from libzim.search import Query, Searcher
+    from libzim.suggestion import SuggestionSearcher
+except ImportError:
+    Archive = None
+
+# Seconds before the cached OPDS catalog is re-validated against kiwix-serve
+CATALOG_TTL = 300
+
+# Cold-start request timeouts (seconds), used until an endpoint has LATENCY_MIN_SAMPLES observations.
+# Generous on purpose: the first /search on a 100 GB Wikipedia can take several seconds.
+CATALOG_TIMEOUT = 5
+SEARCH_TIMEOUT = 15
+ARTICLE_TIMEOUT = 15
+SUGGEST_TIMEOUT = 3
+# Then: timeout = p99 x TIMEOUT_MULTIPLIER of the recent latencies of that endpoint for that book
+# (or of the endpoint overall while the book has too little history), within the floor/ceiling
+LATENCY_WINDOW = 256
+LATENCY_MIN_SAMPLES = 20
+TIMEOUT_MULTIPLIER = 3.0
+TIMEOUT_FLOOR = 0.5
+TIMEOUT_CEILING = 30.0
+# A request still running at the p95 gets a duplicate; at most HEDGE_BUDGET of requests are hedged
+HEDGE_PERCENTILE = 0.95
+HEDGE_BUDGET = 0.1
+# A book is skipped for BREAKER_COOLDOWN seconds once BREAKER_FAILURES requests in a row have timed
+# out and none has succeeded for BREAKER_QUIET seconds (stray timeouts under load do not trip it)
+BREAKER_FAILURES = 3
+BREAKER_QUIET = 10.0
+BREAKER_COOLDOWN = 30.0
+
+# Title fast path: a query that names an article ("Ohm's law") is looked up in the title
+# index (/suggest) and goes straight to that article; full-text /search runs only without a match
+SUGGEST_RESULTS = 10
+TITLE_MAX_WORDS = 8  # longer queries are questions, not article names
+
+# Global budget for one tool call; sub-queries still running after this are reported as timed out
+DEADLINE = 20.0
+
+# Direct ZIM backend: archive folder as mounted into the Open WebUI container
+ZIM_DIR = "/data/zims"
+ZIM_SEARCH_RESULTS = 25
+
+# Semantic retrieval (Valves.retrieval "semantic"/"hybrid"): per-book passage index built by
+# maintenance/semantic_index.py, queries embedded by the same nomic-embed-text model in Ollama
+INDEX_DIR = "/data/index/semantic"
+EMBED_URL = "http://host.docker.internal:11434"
+EMBED_MODEL = "nomic-embed-text"
+EMBED_TIMEOUT = 5
+EMBED_QUERY_PREFIX = "search_query: "        # nomic-embed-text task prefixes
+EMBED_DOCUMENT_PREFIX = "search_document: "
+SEMANTIC_PASSAGES = 12
+SEMANTIC_NPROBE = 16
+# Index of the operator's PDF library (maintenance/pdf_ingest.py), searched with context "pdfs"
+PDF_INDEX = "pdf_library"
+
+# Context groups search several books at once and merge the results. Keywords are the
+# archive names from MANIFEST (maintenance/download_manifest.py); missing books are skipped.
+CONTEXT_GROUPS = {
+    "engineering": [
+        "ifixit_en_all", "appropedia_en_all", "electronics.stackexchange.com_en_all",
+        "raspberrypi.stackexchange.com_en_all", "arduino_en_all",
+    ],
+    "dev": [
+        "stackoverflow.com_en_all", "superuser.com_en_all", "askubuntu.com_en_all", "mdn_en_all",
+        "archlinux_en_all", "python_en_docs", "rust_en_all", "devops.stackexchange.com_en_all",
+        "bash_en_all", "git_en_all", "postgresql_en_all",
+    ],
+    "survival": [
+        "wikipedia_en_all_nopic", "wikipedia_en_medicine", "appropedia_en_all", "wikivoyage_en_all",
+        "openstreetmap-wiki_en_all", "wikispecies_en_all",
+    ],
+    "education": [
+        "wikibooks_en_all", "wikisource_en_all", "gutenberg_en_all", "phet_en_all", "ted_en_playlists",
+    ],
+}
+FEDERATED_DEADLINE = 8.0
+
+# Retrieval: how many search hits to fetch, and how much text to return per sub-query
+CANDIDATES = 3
+CHAR_BUDGET = 4000
+PASSAGE_CHARS = 600
+# Context assembly: all sub-queries together must fit TOKEN_BUDGET. Keep it well below num_ctx in
+# Modelfile.survival, which also has to hold the system prompt, the conversation and the answer.
+TOKEN_BUDGET = 3000
+CHARS_PER_TOKEN = 4.0     # rough average for English prose under the Llama 3 tokenizer
+MIN_SHARE_CHARS = 400     # floor per answered sub-query, so a weak match still gets a passage
+MIN_PASSAGE_CHARS = 40    # passages shorter than this after de-duplication are dropped
+BOILERPLATE_ARTICLES = 3  # a sentence found in this many different articles is site chrome
+# Article extraction: stop parsing after this much text, never read more than this many bytes
+ARTICLE_TEXT_CHARS = 60000
+ARTICLE_MAX_BYTES = 4 * 1024 * 1024
+STREAM_CHUNK = 64 * 1024
+MAX_CACHED_CANDIDATES = 20
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Extracted-article / search-result cache (memory LRU + SQLite under the Open WebUI data volume)
+CACHE_DIR = "/app/backend/data/cache/kiwix_tool"
+CACHE_MEMORY_ENTRIES = 512
+CACHE_DISK_ENTRIES = 50000
+CACHE_PRUNE_EVERY = 500
+CACHE_NEGATIVE_TTL = 3600
+
+# Shared keep-alive connection pool to kiwix-serve
+POOL_SIZE = 16
+KEEPALIVE = 30
+
+# Metrics: latency histogram buckets (seconds), recent spans kept for metrics_snapshot()
+METRICS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+SPAN_HISTORY = 256
+METRICS_TEXTFILE_INTERVAL = 15
 
 class Tools:
     def __init__(self):
@@ -16,6 +154,29 @@ class Tools:
 
     class Valves:
         default_zim: str = "wikipedia"
+        backend: str = "http"  # "http" (kiwix-serve) or "zim" (read ZIM files directly, needs libzim)
+        zim_dir: str = ZIM_DIR
+        retrieval: str = "keyword"  # "keyword" (kiwix search), "semantic" (passage index) or "hybrid" (both)
+        index_dir: str = INDEX_DIR
+        embed_url: str = EMBED_URL
+        embed_model: str = EMBED_MODEL
+        semantic_passages: int = SEMANTIC_PASSAGES
+        semantic_nprobe: int = SEMANTIC_NPROBE
+        title_fast_path: bool = True  # try the title index before full-text search
+        catalog_ttl: int = CATALOG_TTL
+        deadline: float = DEADLINE
+        federated_deadline: float = FEDERATED_DEADLINE
+        candidates: int = CANDIDATES
+        char_budget: int = CHAR_BUDGET  # per sub-query cap
+        token_budget: int = TOKEN_BUDGET  # all sub-queries together
+        chars_per_token: float = CHARS_PER_TOKEN
+        passage_chars: int = PASSAGE_CHARS
+        article_text_chars: int = ARTICLE_TEXT_CHARS
+        article_max_bytes: int = ARTICLE_MAX_BYTES
+        cache_enabled: bool = True
+        cache_dir: str = CACHE_DIR
+        metrics_enabled: bool = True
+        metrics_textfile: str = ""  # e.g. a node-exporter textfile collector path; empty = off
 
     """
     title: Kiwix Knowledge Retrieval
@@ -23,27 +184,64 @@ class Tools:
     description: Search offline ZIM archives. You MUST provide a 'query'.
     """
 
-    def search_knowledge_base(self, query: str, context: str = "general") -> str:
+    async def search_knowledge_base(self, query: str, context: str = "general") -> str:
         """
         Search for a topic in the offline library.
         :param query: The specific search terms (e.g. "Python list comprehension"). 
                       Supports multiple queries separated by semicolons (e.g. "radio freq; antenna types").
         :param context: Choose one of: "general" (Wikipedia), "code" (StackOverflow), "repair" (iFixit), "medical" (WikiMed), "chemistry", "books".
+                        To search several libraries at once use a group: "engineering", "dev", "survival", "education", or "all".
+                        "pdfs" searches the local PDF library (manuals, papers, books).
         :return: The content of the article(s) or an error message.
         """
-        if not query or not query.strip():
+        # Handle multiple queries separated by ';' - all of them run concurrently
+        sub_queries = [q.strip() for q in (query or "").split(';') if q.strip()]
+        if not sub_queries:
             return "Error: Empty query."
 
-        # Handle multiple queries separated by ';'
-        sub_queries = [q.strip() for q in query.split(';') if q.strip()]
-        results = []
+        _METRICS.enabled = self.valves.metrics_enabled
+
+        progress = [{'stage': 'queued', 'book': None, 'article': None} for _ in sub_queries]
+        with _span("tool_call", context=context, sub_queries=len(sub_queries)) as span:
+            tasks = [
+                asyncio.ensure_future(self._perform_single_search(sub_q, context, progress[i]))
+                for i, sub_q in enumerate(sub_queries)
+            ]
 
-        for sub_q in sub_queries:
-            results.append(self._perform_single_search(sub_q, context))
+            deadline = self.valves.deadline
+            done, pending = await asyncio.wait(tasks, timeout=deadline)
+            for task in pending:
+                task.cancel()
+            span['timed_out'] = len(pending)
 
+            # Keep the output in the order the sub-queries were given
+            results = []
+            for i, task in enumerate(tasks):
+                if task in done and not task.cancelled():
+                    results.append(task.result())
+                else:
+                    results.append(_format_timeout(sub_queries[i], progress[i], deadline))
+
+        # Share one context budget across the sub-queries instead of char_budget each
+        budget = int(self.valves.token_budget * self.valves.chars_per_token)
+        with _span("rank", sub_queries=len(results)) as span:
+            results = _assemble_context(results, budget, self.valves.char_budget)
+            span['chars'] = sum(len(r) for r in results)
+
+        if self.valves.metrics_textfile:
+            _METRICS.write_textfile(self.valves.metrics_textfile)
         return "\n\n" + ("="*20) + "\n\n".join(results)
 
-    def _perform_single_search(self, query: str, context: str) -> str:
+    async def _perform_single_search(self, query: str, context: str, progress: dict = None):
+        # Returns a _Retrieved for the context assembler, or a message string
+        if progress is None:
+            progress = {}
+
+        if context == "all" or context in CONTEXT_GROUPS:
+            return await self._perform_federated_search(query, context, progress)
+        if context == "pdfs":
+            return await self._perform_pdf_search(query, progress)
+
         # Map context to partial names/keywords in Title
         zim_map = {
             "general": "wikipedia",
@@ -59,114 +257,1574 @@ class Tools:
         search_keyword = zim_map.get(context, context)
         
         # 2. Resolve to the EXACT Book ID from the Server
-        target_id = _resolve_book_id(self.kiwix_host, search_keyword)
+        progress['stage'] = 'catalog'
+        if self.valves.backend == "zim" and Archive is None:
+            return "Error: Valves.backend is 'zim' but the libzim package is not installed."
+        library = self._library()
+        target_id = await _resolve_book_id(library, search_keyword, self.valves.catalog_ttl)
         
         # 3. Fallback: If specific library not found, default to Wikipedia main
         if not target_id and search_keyword != "wikipedia":
-             print(f"DEBUG: Library for '{search_keyword}' not found, falling back to Wikipedia.")
-             target_id = _resolve_book_id(self.kiwix_host, "wikipedia")
+             log.info("Library for '%s' not found, falling back to Wikipedia.", search_keyword)
+             target_id = await _resolve_book_id(library, "wikipedia", self.valves.catalog_ttl)
 
         if not target_id:
-            available = _get_available_books(self.kiwix_host)
+            available = await _get_available_books(library, self.valves.catalog_ttl)
             return f"Error: No matching ZIM found for '{context}'. Available: {available}"
 
+        progress['book'] = target_id
+
         try:
-            # 2. Search
-            print(f"DEBUG: Searching for '{query}' in {target_id}")
-            search_url = f"{self.kiwix_host}/search?content={target_id}&pattern={urllib.parse.quote(query)}"
-            search_resp = requests.get(search_url, timeout=5)
-            
-            # 3. Parse and Re-Rank Links
-            soup = BeautifulSoup(search_resp.content, 'html.parser')
-            candidates = []
-            
-            query_terms = query.lower().split()
-
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                # Basic validity check
-                if target_id not in href or "search?" in href or "skin/" in href or ".css" in href:
-                    continue
-                
-                # Scoring Logic
-                score = 0
-                href_lower = href.lower()
-                
-                # Criterion A: Query Term Match
-                matches = sum(1 for term in query_terms if term in href_lower)
-                score += (matches * 10) 
-                
-                # Criterion B: Content Type Preference
-                if context == "repair":
-                    if "/Guide/" in href: score += 50
-                    if "Replacement" in href: score += 20
-                    if "/Device/" in href: score -= 5
-                
-                # Criterion C: Exact Match / Shortness
-                score -= len(href) * 0.1 
-
-                candidates.append((score, href))
-
-            if not candidates:
-                 return f"No articles found for '{query}' in {target_id}."
-
-            # Sort by score descending
-            candidates.sort(key=lambda x: x[0], reverse=True)
-            first_result = candidates[0][1]
-            
-            if not first_result:
+            passages = await self._retrieve_passages(query, context, target_id, progress)
+            if not passages:
                 return f"No articles found for '{query}' in {target_id}."
 
-            # 4. Fetch Content
-            article_url = f"{self.kiwix_host}{first_result}" if first_result.startswith("/") else f"{self.kiwix_host}/{first_result}"
-            article_resp = requests.get(article_url, timeout=10)
-            article_soup = BeautifulSoup(article_resp.content, 'html.parser')
+            # 6. Ranking and formatting happen in _assemble_context, once every sub-query is in
+            return _Retrieved(query, [target_id], [(0,) + passage for passage in passages])
 
-            # 5. Clean Content
-            for script in article_soup(["script", "style", "nav", "footer", "header", "form"]):
-                script.decompose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return f"System Error processing '{query}': {e}"
 
-            text = article_soup.get_text(separator=' ', strip=True)
-            
-            # 6. Format
-            return f"### QUERY: {query}\n<source id=\"{target_id}\">\n{text[:6000]}...\n</source>"
+    async def _perform_federated_search(self, query: str, context: str, progress: dict):
+        # Query several books at once and merge their passages into one ranked answer
+        progress['stage'] = 'catalog'
+        if self.valves.backend == "zim" and Archive is None:
+            return "Error: Valves.backend is 'zim' but the libzim package is not installed."
+        library = self._library()
+        try:
+            with _span("catalog", keyword=context) as span:
+                await library.ensure_fresh(self.valves.catalog_ttl, span=span)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return f"System Error processing '{query}': {e}"
+
+        if context == "all":
+            book_ids = [b['id'] for b in library.books if b['id']]
+        else:
+            book_ids = [library.resolve(keyword) for keyword in CONTEXT_GROUPS[context]]
+            book_ids = [b for b in dict.fromkeys(book_ids) if b]
+        if not book_ids:
+            return f"Error: No matching ZIM found for '{context}'. Available: {library.titles()}"
+
+        progress['stage'] = 'federated'
+        progress['book'] = ', '.join(book_ids)
+        tasks = [
+            asyncio.ensure_future(self._retrieve_passages(query, context, book_id, {}))
+            for book_id in book_ids
+        ]
+        # A slow book only loses its own contribution; everything that answered in time is merged
+        done, pending = await asyncio.wait(tasks, timeout=self.valves.federated_deadline)
+        for task in pending:
+            task.cancel()
 
+        slow = [book_ids[i] for i, task in enumerate(tasks) if task in pending]
+        note = f"\n[No answer within {self.valves.federated_deadline:g}s from: {', '.join(slow)}]" if slow else ""
+
+        merged = []
+        for idx, task in enumerate(tasks):
+            if task not in done or task.cancelled() or task.exception() is not None:
+                continue
+            merged.extend((idx,) + passage for passage in task.result())
+        if not merged:
+            return f"No articles found for '{query}' in {', '.join(book_ids)}.{note}"
+        return _Retrieved(query, book_ids, merged, note)
+
+    async def _perform_pdf_search(self, query: str, progress: dict):
+        # PDFs are not a kiwix book: their passages only exist in the index pdf_ingest.py builds
+        progress['book'] = PDF_INDEX
+        try:
+            passages = await self._semantic_passages(query, PDF_INDEX, progress)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             return f"System Error processing '{query}': {e}"
+        if passages is None:
+            return ("Error: The PDF library is not indexed or the embedder is unreachable "
+                    "(run maintenance/pdf_ingest.py on the host).")
+        if not passages:
+            return f"No passages found for '{query}' in the PDF library."
+        return _Retrieved(query, [PDF_INDEX], [(0,) + passage for passage in passages])
 
-def _resolve_book_id(host: str, partial_name: str) -> str:
-    print(f"DEBUG: Resolving book ID for '{partial_name}'")
-    try:
-        # Kiwix-serve returns an OPDS Atom feed (XML), not JSON
-        r = requests.get(f"{host}/catalog/v2/entries", timeout=2)
-        if r.status_code != 200:
+    async def _retrieve_passages(self, query: str, context: str, target_id: str, progress: dict) -> list:
+        # Passages of one book for the query: [(rank, position, text)]
+        if self.valves.retrieval in ("semantic", "hybrid"):
+            semantic = await self._semantic_passages(query, target_id, progress)
+            # No index for this book (or the embedder is down): keyword search as before
+            if semantic is not None:
+                if self.valves.retrieval == "semantic":
+                    return semantic
+                keyword = await self._keyword_passages(query, context, target_id, progress)
+                offset = 1 + max((p[0] for p in keyword), default=-1)
+                return keyword + [(offset + rank, pos, text) for rank, pos, text in semantic]
+        return await self._keyword_passages(query, context, target_id, progress)
+
+    async def _semantic_passages(self, query: str, target_id: str, progress: dict):
+        index = _get_semantic_index(self.valves.index_dir, target_id)
+        if index is None:
+            return None
+        if index.meta["model"] != self.valves.embed_model:
+            log.warning("Index for %s was built with %s, not %s; using keyword search.",
+                        target_id, index.meta["model"], self.valves.embed_model)
             return None
+        progress['stage'] = 'embed'
+        with _span("embed", book=target_id) as span:
+            try:
+                vector = await _embed_query(self.valves.embed_url, self.valves.embed_model, query)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError, KeyError, IndexError, ValueError) as e:
+                span['error'] = type(e).__name__
+                log.warning("Query embedding failed (%s); using keyword search.", e)
+                return None
+        progress['stage'] = 'semantic'
+        with _span("semantic", book=target_id) as span:
+            hits = await asyncio.to_thread(index.search, vector, self.valves.semantic_passages,
+                                           self.valves.semantic_nprobe)
+            span['results'] = len(hits)
+        if hits:
+            progress['article'] = hits[0][1]
+        # Each hit is its own "article", ranked by similarity
+        return [(rank, 0, text) for rank, (_, _, _, text) in enumerate(hits)]
+
+    async def _keyword_passages(self, query: str, context: str, target_id: str, progress: dict) -> list:
+        # Search one book, fetch its top candidates and split them: [(candidate_rank, position, text)]
+        # 2. Search (served from the query cache when this book was asked the same thing before)
+        progress['stage'] = 'search'
+        cache = _get_cache(self.valves.cache_dir) if self.valves.cache_enabled else None
+        norm_query = _normalize_query(query)
+        with _span("search", book=target_id) as span:
+            ranked = await cache.get_candidates(target_id, context, norm_query) if cache else None
+            span['cache'] = 'miss' if ranked is None else 'hit'
+            if ranked is None:
+                ranked = await self._search_candidates(query, context, target_id, span)
+                if cache:
+                    await cache.put_candidates(target_id, context, norm_query, ranked)
+            span['results'] = len(ranked)
+
+        top_links = ranked[:self.valves.candidates]
+        if not top_links:
+            return []
+
+        # 4. Fetch Content (top N candidates in parallel)
+        progress['stage'] = 'article'
+        progress['article'] = top_links[0]
+        texts = await asyncio.gather(
+            *[self._fetch_article_text(target_id, href, cache) for href in top_links],
+            return_exceptions=True
+        )
+
+        # 5. Split the cleaned text into passages
+        passages = []
+        for rank, text in enumerate(texts):
+            if isinstance(text, BaseException):
+                continue
+            for pos, passage in enumerate(_split_passages(text, self.valves.passage_chars)):
+                passages.append((rank, pos, passage))
+
+        if not passages and isinstance(texts[0], BaseException):
+            raise texts[0]
+        return passages
+
+    async def _search_candidates(self, query: str, context: str, target_id: str, span=None) -> list:
+        # Returns candidate article links, best first ([] when nothing matched)
+        span = span if span is not None else _NULL_SPAN
+        attempted = self.valves.title_fast_path and len(query.split()) <= TITLE_MAX_WORDS
+        if attempted:
+            href = await self._title_candidate(query, target_id)
+            if href:
+                span['path'] = 'title'
+                return [href]
+        span['path'] = 'fulltext'
+        started = time.perf_counter()
+        ranked = await self._fulltext_candidates(query, context, target_id, span)
+        if attempted:
+            # Only searches a title hit could have saved go into the savings estimate
+            _TITLE_STATS['fulltext_searches'] += 1
+            _TITLE_STATS['fulltext_seconds'] += time.perf_counter() - started
+        return ranked
+
+    async def _title_candidate(self, query: str, target_id: str):
+        # Link of the article whose title is the query, or None to fall back to full-text search
+        with _span("suggest", book=target_id) as span:
+            started = time.perf_counter()
+            try:
+                if self.valves.backend == "zim":
+                    library = _get_zim_library(self.valves.zim_dir)
+                    suggestions = await asyncio.to_thread(library.suggest, target_id, query, SUGGEST_RESULTS)
+                else:
+                    suggestions = await self._suggest(query, target_id, span)
+            except _CircuitOpen:
+                # The book's kiwix-serve is failing: full-text search would hit the same open breaker
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError, KeyError, ValueError) as e:
+                # No title index, an old kiwix-serve or a slow answer: full-text search still works
+                span['error'] = type(e).__name__
+                _TITLE_STATS['errors'] += 1
+                _TITLE_STATS['suggest_seconds'] += time.perf_counter() - started
+                return None
+            path = _match_title(query, suggestions)
+            _TITLE_STATS['hits' if path else 'misses'] += 1
+            _TITLE_STATS['suggest_seconds'] += time.perf_counter() - started
+            span['results'] = len(suggestions)
+            span['match'] = path is not None
+        if path is None:
+            return None
+        return f"/content/{target_id}/{urllib.parse.quote(urllib.parse.unquote(path), safe='/')}"
+
+    async def _suggest(self, query: str, target_id: str, span) -> list:
+        # kiwix-serve's title suggestions as [(title, path)]; the trailing "containing '...'" entry is dropped
+        suggest_url = (f"{self.kiwix_host}/suggest?content={target_id}"
+                       f"&term={urllib.parse.quote(query)}&count={SUGGEST_RESULTS}")
+        status, _, body = await _request("suggest", target_id, SUGGEST_TIMEOUT,
+                                         lambda timeout, _: _http_get(suggest_url, timeout), span)
+        span['bytes'] = len(body)
+        if status != 200:
+            raise RuntimeError(f"kiwix-serve returned HTTP {status} for suggest")
+        return [(html.unescape(s.get('value', '')), s['path'])
+                for s in json.loads(body) if s.get('kind') == 'path' and s.get('path')]
+
+    async def _fulltext_candidates(self, query: str, context: str, target_id: str, span) -> list:
+        if self.valves.backend == "zim":
+            library = _get_zim_library(self.valves.zim_dir)
+            hrefs = await asyncio.to_thread(library.search, target_id, query, ZIM_SEARCH_RESULTS)
+            return _rank_links(hrefs, query, context, target_id)
+
+        search_url = f"{self.kiwix_host}/search?content={target_id}&pattern={urllib.parse.quote(query)}"
+        status, _, search_body = await _request("search", target_id, SEARCH_TIMEOUT,
+                                                lambda timeout, _: _http_get(search_url, timeout), span)
+        span['bytes'] = len(search_body)
+        if status == 404:
+            # Book was removed/replaced since the catalog was cached
+            _get_catalog(self.kiwix_host).invalidate()
+        if status != 200:
+            raise RuntimeError(f"kiwix-serve returned HTTP {status} for search")
         
-        # Parse XML
-        soup = BeautifulSoup(r.content, 'xml')
+        soup = BeautifulSoup(search_body, 'html.parser')
+        return _rank_links([link['href'] for link in soup.find_all('a', href=True)], query, context, target_id)
+
+    async def _fetch_article_text(self, target_id: str, href: str, cache=None) -> str:
+        limit = self.valves.article_text_chars
+        path = _article_path(target_id, href)
+        with _span("article", book=target_id) as span:
+            if cache:
+                text = await cache.get_article(target_id, path, limit)
+                if text is not None:
+                    span['cache'] = 'hit'
+                    return text
+            span['cache'] = 'miss'
+            if self.valves.backend == "zim":
+                library = _get_zim_library(self.valves.zim_dir)
+                text = await asyncio.to_thread(library.read_text, target_id, path, limit,
+                                               self.valves.article_max_bytes, span)
+            else:
+                url = self._article_url(href)
+                text = await _request("article", target_id, ARTICLE_TIMEOUT,
+                                      lambda timeout, attrs: _http_get_text(url, timeout, limit,
+                                                                            self.valves.article_max_bytes, attrs),
+                                      span)
+            if cache:
+                await cache.put_article(target_id, path, limit, text)
+            return text
+
+    def _article_url(self, href: str) -> str:
+        return f"{self.kiwix_host}{href}" if href.startswith("/") else f"{self.kiwix_host}/{href}"
+
+    def _library(self) -> "_CatalogIndex":
+        # Book index for the configured backend
+        if self.valves.backend == "zim":
+            return _get_zim_library(self.valves.zim_dir)
+        return _get_catalog(self.kiwix_host)
+
+def _rank_links(hrefs: list, query: str, context: str, target_id: str) -> list:
+    # 3. Parse and Re-Rank Links
+    candidates = []
+    
+    query_terms = query.lower().split()
+
+    for href in hrefs:
+        # Basic validity check
+        if not href or target_id not in href or "search?" in href or "skin/" in href or ".css" in href:
+            continue
+        
+        # Scoring Logic
+        score = 0
+        href_lower = href.lower()
+        
+        # Criterion A: Query Term Match
+        matches = sum(1 for term in query_terms if term in href_lower)
+        score += (matches * 10) 
         
+        # Criterion B: Content Type Preference
+        if context == "repair":
+            if "/Guide/" in href: score += 50
+            if "Replacement" in href: score += 20
+            if "/Device/" in href: score -= 5
+        
+        # Criterion C: Exact Match / Shortness
+        score -= len(href) * 0.1 
+
+        candidates.append((score, href))
+
+    # Sort by score descending
+    candidates.sort(key=lambda x: x[0], reverse=True)
+    return [href for _, href in candidates[:MAX_CACHED_CANDIDATES]]
+
+class _TextExtractor(HTMLParser):
+    """
+    Incremental HTML-to-text converter. Boilerplate elements are skipped as they stream past
+    and `done` flips once `limit` characters of text have been collected, so callers can stop
+    reading the response. Output matches BeautifulSoup's get_text(separator=' ', strip=True)
+    on the same document with those elements (and elements of SKIP_CLASSES) decomposed.
+    """
+
+    SKIP_TAGS = frozenset(["script", "style", "nav", "footer", "header", "form"])
+    # MediaWiki page furniture: infoboxes, navboxes, edit links, footnote marks, reference lists
+    SKIP_CLASSES = frozenset(["infobox", "navbox", "vertical-navbox", "sidebar", "toc", "hatnote",
+                              "mw-editsection", "reference", "reflist", "catlinks", "noprint"])
+    VOID_TAGS = frozenset(["area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+                           "meta", "source", "track", "wbr"])
+
+    def __init__(self, limit: int):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.parts = []
+        self.pending = []   # text node split across feed() chunks, flushed at the next tag
+        self.size = 0
+        self.skip_depth = 0
+        self.skip_tag = None  # element (by tag name) skipped for its class, and its nesting depth
+        self.skip_nested = 0
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_nested += 1
+        elif tag not in self.VOID_TAGS:
+            classes = next((v for k, v in attrs if k == 'class' and v), None)
+            if classes and not self.SKIP_CLASSES.isdisjoint(classes.split()):
+                self.skip_tag, self.skip_nested = tag, 1
+
+    def handle_startendtag(self, tag, attrs):
+        # Self-closed (<nav/>) elements have no content to skip
+        self._flush()
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in self.SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag == self.skip_tag:
+            self.skip_nested -= 1
+            if not self.skip_nested:
+                self.skip_tag = None
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_data(self, data):
+        if not self.skip_depth and not self.skip_tag and not self.done:
+            self.pending.append(data)
+
+    def _flush(self):
+        if not self.pending:
+            return
+        data = ''.join(self.pending).strip()
+        self.pending = []
+        if data:
+            self.parts.append(data)
+            self.size += len(data) + 1
+            if self.size >= self.limit:
+                self.done = True
+
+    def text(self) -> str:
+        self._flush()
+        return ' '.join(self.parts)[:self.limit]
+
+def _html_to_text(body: bytes, limit: int = ARTICLE_TEXT_CHARS, encoding: str = 'utf-8') -> str:
+    extractor = _TextExtractor(limit)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for start in range(0, len(body), STREAM_CHUNK):
+        extractor.feed(decoder.decode(body[start:start + STREAM_CHUNK]))
+        if extractor.done:
+            break
+    return extractor.text()
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+_TOKEN_RE = re.compile(r'\w+')
+
+def _split_passages(text: str, size: int) -> list:
+    # Pack whole sentences into passages of roughly `size` characters
+    passages = []
+    current = []
+    length = 0
+    for sentence in _SENTENCE_RE.split(text):
+        if length and length + len(sentence) > size:
+            passages.append(' '.join(current))
+            current, length = [], 0
+        # Hard-wrap run-on "sentences" (tables, code) so one passage never dwarfs the budget
+        while len(sentence) > size:
+            passages.append(sentence[:size])
+            sentence = sentence[size:]
+        current.append(sentence)
+        length += len(sentence) + 1
+    if current:
+        passages.append(' '.join(current))
+    return [p for p in passages if p.strip()]
+
+def _bm25_scores(query_terms: list, docs: list, k1: float = BM25_K1, b: float = BM25_B) -> list:
+    """
+    Okapi BM25 of every passage against the query, scored as one batch.
+    Only query terms contribute to BM25, so the term-frequency matrix is (passages x query terms).
+    """
+    terms = list(dict.fromkeys(query_terms))
+    if not terms or not docs:
+        return [0.0] * len(docs)
+    col = {t: j for j, t in enumerate(terms)}
+    tf = [[0] * len(terms) for _ in docs]
+    lengths = []
+    for i, tokens in enumerate(docs):
+        row = tf[i]
+        for tok in tokens:
+            j = col.get(tok)
+            if j is not None:
+                row[j] += 1
+        lengths.append(len(tokens))
+
+    n = len(docs)
+    if np is not None:
+        tf_m = np.asarray(tf, dtype=np.float32)
+        dl = np.asarray(lengths, dtype=np.float32)
+        df = (tf_m > 0).sum(axis=0)
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        norm = k1 * (1.0 - b + b * dl / max(float(dl.mean()), 1.0))
+        scores = (idf * (tf_m * (k1 + 1.0)) / (tf_m + norm[:, None])).sum(axis=1)
+        return scores.tolist()
+
+    # Pure-Python fallback when numpy is not installed
+    avgdl = max(sum(lengths) / n, 1.0)
+    df = [sum(1 for row in tf if row[j]) for j in range(len(terms))]
+    idf = [math.log(1.0 + (n - d + 0.5) / (d + 0.5)) for d in df]
+    scores = []
+    for row, dl in zip(tf, lengths):
+        norm = k1 * (1.0 - b + b * dl / avgdl)
+        scores.append(sum(idf[j] * f * (k1 + 1.0) / (f + norm) for j, f in enumerate(row) if f))
+    return scores
+
+def _score_passages(query: str, passages: list) -> list:
+    tokens = [_TOKEN_RE.findall(p[-1].lower()) for p in passages]
+    return _bm25_scores(_TOKEN_RE.findall(query.lower()), tokens)
+
+def _choose_passages(passages: list, scores: list, budget: int) -> list:
+    """
+    passages: [(*order_key, text)]. Returns indices of the highest-scoring passages that
+    fit in `budget` characters, re-ordered by their key (source, article rank, position).
+    """
+    # Ties (e.g. no term matched anywhere) fall back to the old "top article, from the start" order
+    order = sorted(range(len(passages)), key=lambda i: (-scores[i], passages[i][:-1]))
+    chosen = []
+    seen = set()
+    used = 0
+    for i in order:
+        # Mirrors/redirects often return the same article twice
+        if passages[i][-1] in seen:
+            continue
+        seen.add(passages[i][-1])
+        length = len(passages[i][-1])
+        if used + length > budget:
+            if not chosen:
+                chosen.append(i)
+                break
+            continue
+        chosen.append(i)
+        used += length + 5
+    chosen.sort(key=lambda i: passages[i][:-1])
+    return chosen
+
+class _Retrieved:
+    """Passages found for one sub-query: [(book index, article rank, position, text)]."""
+
+    def __init__(self, query: str, book_ids: list, passages: list, note: str = ""):
+        self.query = query
+        self.book_ids = book_ids
+        self.passages = passages
+        self.note = note
+
+# Wiki chrome that survives HTML extraction (edit links, footnote marks, page furniture)
+_BOILERPLATE_RE = re.compile(
+    r'\[\s*(?:edit|citation needed|clarification needed|\d+|[a-z])\s*\]'
+    r'|Jump to (?:navigation|search)'
+    r'|From Wikipedia, the free encyclopedia'
+    r'|Retrieved from "[^"]*"'
+    r'|This page was last edited on [^.]*\.',
+    re.IGNORECASE)
+_SPACES_RE = re.compile(r'\s{2,}')
+
+def _sentences(text: str) -> list:
+    # [(key, sentence)]: the key ignores case, punctuation and spacing
+    text = _SPACES_RE.sub(' ', _BOILERPLATE_RE.sub('', text))
+    return [(' '.join(_TOKEN_RE.findall(s.lower())), s) for s in _SENTENCE_RE.split(text) if s.strip()]
+
+def _share_budget(weights: list, demands: list, budget: int, floor: int) -> list:
+    """
+    Split `budget` in proportion to `weights`, never giving more than a sub-query can use
+    (its demand): what a short result leaves over goes to the others. Every sub-query with
+    any demand gets at least `floor`.
+    """
+    shares = [0] * len(weights)
+    active = [i for i, d in enumerate(demands) if d > 0]
+    while active:
+        total = sum(weights[i] for i in active)
+        satisfied = [i for i in active if demands[i] <= budget * weights[i] / total]
+        if not satisfied:
+            for i in active:
+                shares[i] = max(int(budget * weights[i] / total), min(floor, demands[i]))
+            break
+        for i in satisfied:
+            shares[i] = demands[i]
+            budget -= demands[i]
+            active.remove(i)
+    return shares
+
+def _assemble_context(results: list, budget: int, cap: int) -> list:
+    """
+    results: one entry per sub-query, a message string or a _Retrieved.
+    Renders every result so that together they fit in `budget` characters: page chrome and
+    sentences repeated across articles are stripped, a sentence already given for another
+    sub-query is not repeated, and the space left after headers and messages is shared out
+    by relevance (how many of its query terms a sub-query's best passage covers), never more
+    than `cap` per sub-query.
+    """
+    retrieved = [n for n, r in enumerate(results) if isinstance(r, _Retrieved)]
+    budget -= sum(len(r) for r in results if isinstance(r, str)) + 2 * len(results) + 20
+
+    # Sentences shared by several different articles are navigation/infobox residue
+    split = {}
+    articles = {}
+    for n in retrieved:
+        r = results[n]
+        heads = {(p[0], p[1]): p[3] for p in r.passages if p[2] == 0}
+        split[n] = []
+        for book, rank, pos, text in r.passages:
+            sentences = _sentences(text)
+            article = (r.book_ids[book], heads.get((book, rank), rank))
+            for key, _ in sentences:
+                articles.setdefault(key, set()).add(article)
+            split[n].append(((book, rank, pos), sentences))
+
+    candidates = {}
+    weights = {}
+    demands = {}
+    for n in retrieved:
+        r = results[n]
+        passages = []
+        for order_key, sentences in split[n]:
+            kept = [(k, s) for k, s in sentences if k and len(articles[k]) < BOILERPLATE_ARTICLES]
+            text = ' '.join(s for _, s in kept)
+            if len(text) >= MIN_PASSAGE_CHARS:
+                passages.append(order_key + (kept, text))
+        # BM25 scales differ per book (IDF is per corpus), so normalise to each book's best passage
+        scores = _score_passages(r.query, passages)
+        top = {}
+        for p, score in zip(passages, scores):
+            top[p[0]] = max(top.get(p[0], 0.0), score)
+        scores = [score / top[p[0]] if top[p[0]] > 0 else 0.0 for p, score in zip(passages, scores)]
+
+        terms = set(_TOKEN_RE.findall(r.query.lower()))
+        coverage = 0.0
+        if passages and terms:
+            best = max(range(len(passages)), key=lambda i: scores[i])
+            coverage = len(terms & set(_TOKEN_RE.findall(passages[best][-1].lower()))) / len(terms)
+        candidates[n] = (passages, scores)
+        # Even a result matching none of its terms keeps a quarter of a perfect match's weight
+        weights[n] = 0.25 + coverage
+        demands[n] = min(cap, sum(len(p[-1]) + 5 for p in passages))
+        books = {p[0] for p in passages}
+        budget -= len(f"### QUERY: {r.query}\n{r.note}") + sum(len(r.book_ids[b]) + 30 for b in books)
+
+    # Most relevant first, so a sentence shared between sub-queries stays with the best one
+    given = set()
+    rendered = list(results)
+    pending = sorted(retrieved, key=lambda n: -weights[n])
+    while pending:
+        shares = _share_budget([weights[n] for n in pending], [demands[n] for n in pending],
+                               budget, MIN_SHARE_CHARS)
+        n, share = pending.pop(0), shares[0]
+        r = results[n]
+        passages, scores = candidates[n]
+        fresh, fresh_scores = [], []
+        for p, score in zip(passages, scores):
+            text = ' '.join(s for k, s in p[3] if k not in given)
+            if len(text) >= MIN_PASSAGE_CHARS:
+                fresh.append(p[:3] + (text,))
+                fresh_scores.append(score)
+        chosen = _choose_passages(fresh, fresh_scores, share)
+        if not chosen:
+            rendered[n] = f"No articles found for '{r.query}' in {', '.join(r.book_ids)}.{r.note}"
+            continue
+        for i in chosen:
+            given.update(k for k, _ in _sentences(fresh[i][-1]))
+
+        sources = []
+        for book in dict.fromkeys(fresh[i][0] for i in chosen):
+            text = ' ... '.join(fresh[i][-1] for i in chosen if fresh[i][0] == book)[:share]
+            budget -= len(text)
+            sources.append(f"<source id=\"{r.book_ids[book]}\">\n{text}...\n</source>")
+        rendered[n] = f"### QUERY: {r.query}\n" + "\n".join(sources) + r.note
+    return rendered
+
+def _normalize_query(query: str) -> str:
+    return ' '.join(_TOKEN_RE.findall(query.lower()))
+
+_APOSTROPHE_RE = re.compile(r"['\u2018\u2019`]")
+_QUALIFIER_RE = re.compile(r'\s*\([^)]*\)\s*$')
+
+def _normalize_title(title: str) -> str:
+    # "Ohm’s Law", "ohms law" and "Ohm's_law" all become "ohms law"; accents are dropped
+    title = unicodedata.normalize('NFKD', title.replace('_', ' '))
+    title = ''.join(c for c in title if not unicodedata.combining(c))
+    return ' '.join(_TOKEN_RE.findall(_APOSTROPHE_RE.sub('', title.lower())))
+
+def _match_title(query: str, suggestions: list):
+    # Path of the suggestion whose normalized title is the query. Failing that, one title that only
+    # adds a qualifier ("Raspberry Pi (computer)"); two of them ("Mercury (planet)", "Mercury
+    # (element)") are ambiguous and left to full-text search.
+    wanted = _normalize_title(query)
+    if not wanted:
+        return None
+    qualified = []
+    for title, path in suggestions:
+        if _normalize_title(title) == wanted:
+            return path
+        if _normalize_title(_QUALIFIER_RE.sub('', title)) == wanted:
+            qualified.append(path)
+    return qualified[0] if len(qualified) == 1 else None
+
+def _article_path(book_id: str, href: str) -> str:
+    # "/content/wikipedia_en_all_nopic_2025-12/A/Water" -> "A/Water"
+    marker = f"/content/{book_id}/"
+    idx = href.find(marker)
+    return href[idx + len(marker):] if idx >= 0 else href
+
+class _ArticleCache:
+    """
+    Two-tier cache of extracted article text and search candidates.
+    Tier 1 is a bounded in-memory LRU, tier 2 a SQLite file that survives restarts.
+    Keys start with the resolved book ID, which carries the ZIM date, so a replaced
+    archive never serves stale entries.
+    """
+
+    def __init__(self, cache_dir: str, memory_entries: int = CACHE_MEMORY_ENTRIES):
+        self.memory = OrderedDict()
+        self.memory_entries = memory_entries
+        self.stats = {
+            'article_memory_hits': 0, 'article_disk_hits': 0, 'article_misses': 0,
+            'query_memory_hits': 0, 'query_disk_hits': 0, 'query_misses': 0,
+            'query_negative_hits': 0,
+        }
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.writes = 0
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            db = sqlite3.connect(os.path.join(cache_dir, "kiwix_cache.db"), check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS articles (book TEXT, path TEXT, text_limit INTEGER, "
+                       "text TEXT, stored REAL, PRIMARY KEY (book, path))")
+            db.execute("CREATE TABLE IF NOT EXISTS queries (book TEXT, context TEXT, query TEXT, "
+                       "links TEXT, stored REAL, PRIMARY KEY (book, context, query))")
+            db.commit()
+            self.db = db
+        except (OSError, sqlite3.Error) as e:
+            # Read-only or missing data volume: keep going with the memory tier only
+            log.warning("Disk cache disabled (%s)", e)
+
+    # --- memory tier ---
+    def _mem_get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+        return value
+
+    def _mem_put(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    # --- disk tier ---
+    def _db_get(self, sql: str, args: tuple):
+        with self.db_lock:
+            return self.db.execute(sql, args).fetchone()
+
+    async def _db_read(self, sql: str, args: tuple):
+        # Off the event loop: a write or prune holding db_lock must not stall other searches
+        if self.db is None:
+            return None
+        try:
+            return await asyncio.to_thread(self._db_get, sql, args)
+        except sqlite3.Error:
+            return None
+
+    def _db_put(self, sql: str, args: tuple):
+        with self.db_lock:
+            self.db.execute(sql, args)
+            self.writes += 1
+            if self.writes % CACHE_PRUNE_EVERY == 0:
+                self._prune()
+            self.db.commit()
+
+    def _prune(self):
+        for table in ("articles", "queries"):
+            self.db.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} "
+                            f"ORDER BY stored DESC LIMIT -1 OFFSET ?)", (CACHE_DISK_ENTRIES,))
+
+    async def _db_write(self, sql: str, args: tuple):
+        if self.db is None:
+            return
+        try:
+            await asyncio.to_thread(self._db_put, sql, args)
+        except sqlite3.Error as e:
+            log.warning("Disk cache write failed (%s)", e)
+
+    # --- articles ---
+    async def get_article(self, book: str, path: str, limit: int):
+        key = ('a', book, path)
+        entry = self._mem_get(key)
+        if entry is not None and entry[0] >= limit:
+            self.stats['article_memory_hits'] += 1
+            return entry[1][:limit]
+        row = await self._db_read("SELECT text_limit, text FROM articles WHERE book=? AND path=?", (book, path))
+        # Text cached under a smaller budget can't answer a larger one
+        if row is not None and row[0] >= limit:
+            self.stats['article_disk_hits'] += 1
+            self._mem_put(key, (row[0], row[1]))
+            return row[1][:limit]
+        self.stats['article_misses'] += 1
+        return None
+
+    async def put_article(self, book: str, path: str, limit: int, text: str):
+        self._mem_put(('a', book, path), (limit, text))
+        await self._db_write("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?)",
+                             (book, path, limit, text, time.time()))
+
+    # --- query -> candidates ---
+    async def get_candidates(self, book: str, context: str, query: str):
+        key = ('q', book, context, query)
+        entry = self._mem_get(key)
+        tier = 'memory'
+        if entry is None:
+            row = await self._db_read("SELECT links, stored FROM queries WHERE book=? AND context=? AND query=?",
+                                      (book, context, query))
+            if row is not None:
+                entry = (json.loads(row[0]), row[1])
+                tier = 'disk'
+                self._mem_put(key, entry)
+        if entry is None:
+            self.stats['query_misses'] += 1
+            return None
+        links, stored = entry
+        if not links:
+            # "No articles found" is only trusted for a while
+            if time.time() - stored > CACHE_NEGATIVE_TTL:
+                self.stats['query_misses'] += 1
+                return None
+            # Counted apart from the tier hits, which stay a measure of answers actually served
+            self.stats['query_negative_hits'] += 1
+        else:
+            self.stats[f'query_{tier}_hits'] += 1
+        return links
+
+    async def put_candidates(self, book: str, context: str, query: str, links: list):
+        stored = time.time()
+        self._mem_put(('q', book, context, query), (links, stored))
+        await self._db_write("INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)",
+                             (book, context, query, json.dumps(links), stored))
+
+_CACHES = {}
+
+def _get_cache(cache_dir: str) -> _ArticleCache:
+    cache = _CACHES.get(cache_dir)
+    if cache is None:
+        cache = _CACHES.setdefault(cache_dir, _ArticleCache(cache_dir))
+    return cache
+
+def cache_stats() -> dict:
+    """Hit/miss counters for every article cache in this process, keyed by cache directory."""
+    return {cache_dir: dict(cache.stats) for cache_dir, cache in _CACHES.items()}
+
+_TITLE_STATS = {'hits': 0, 'misses': 0, 'errors': 0, 'suggest_seconds': 0.0,
+                'fulltext_searches': 0, 'fulltext_seconds': 0.0}
+
+def title_stats() -> dict:
+    """Title fast path counters, with the full-text search time its hits saved net of every lookup's cost."""
+    stats = dict(_TITLE_STATS)
+    lookups = stats['hits'] + stats['misses'] + stats['errors']
+    fulltext = stats['fulltext_seconds'] / stats['fulltext_searches'] if stats['fulltext_searches'] else 0.0
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['suggest_mean_ms'] = stats['suggest_seconds'] / lookups * 1000 if lookups else 0.0
+    stats['fulltext_mean_ms'] = fulltext * 1000
+    # Each hit skipped one full-text search; each lookup, hit or not, cost one suggest round-trip
+    stats['saved_ms'] = (stats['hits'] * fulltext - stats['suggest_seconds']) * 1000
+    return stats
+
+class _Span(dict):
+    """One timed stage of a tool call; attributes (book, cache, bytes...) are set as dict items."""
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str, attrs: dict):
+        super().__init__(attrs)
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self['error'] = exc_type.__name__
+        _METRICS.observe(self.stage, time.perf_counter() - self.start, self)
+        return False
+
+class _NullSpan:
+    # Stand-in used when metrics are off: every operation is a no-op
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def _span(stage: str, **attrs):
+    if not _METRICS.enabled:
+        return _NULL_SPAN
+    return _Span(stage, attrs)
+
+class _Metrics:
+    """Process-wide latency histograms per (stage, cache outcome), byte/error counters and recent spans."""
+
+    def __init__(self):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.histograms = {}   # (stage, cache) -> {'buckets': [...], 'count': n, 'sum': seconds}
+        self.bytes = {}        # stage -> bytes transferred
+        self.errors = {}       # stage -> spans that raised
+        self.recent = deque(maxlen=SPAN_HISTORY)
+        self.textfile_written = 0.0
+
+    def observe(self, stage: str, seconds: float, attrs: dict):
+        key = (stage, attrs.get('cache', ''))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {'buckets': [0] * len(METRICS_BUCKETS), 'count': 0, 'sum': 0.0}
+            idx = bisect.bisect_left(METRICS_BUCKETS, seconds)
+            if idx < len(METRICS_BUCKETS):
+                hist['buckets'][idx] += 1
+            hist['count'] += 1
+            hist['sum'] += seconds
+            if attrs.get('bytes'):
+                self.bytes[stage] = self.bytes.get(stage, 0) + attrs['bytes']
+            if 'error' in attrs:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+        record = {'stage': stage, 'duration_ms': round(seconds * 1000, 3)}
+        record.update(attrs)
+        self.recent.append(record)
+        log.debug("span %s", record)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.bytes.clear()
+            self.errors.clear()
+            self.recent.clear()
+
+    def write_textfile(self, path: str):
+        # Atomic rewrite, at most every METRICS_TEXTFILE_INTERVAL seconds
+        now = time.monotonic()
+        if now - self.textfile_written < METRICS_TEXTFILE_INTERVAL:
+            return
+        self.textfile_written = now
+        try:
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                f.write(metrics_prometheus())
+            os.replace(tmp, path)
+        except OSError as e:
+            log.warning("Cannot write metrics to %s (%s)", path, e)
+
+_METRICS = _Metrics()
+
+def _bucket_quantile(hist: dict, q: float) -> float:
+    # Linear interpolation inside the bucket holding the q-th observation (seconds)
+    target = q * hist['count']
+    seen = 0
+    lower = 0.0
+    for upper, n in zip(METRICS_BUCKETS, hist['buckets']):
+        if n and seen + n >= target:
+            return lower + (upper - lower) * (target - seen) / n
+        seen += n
+        lower = upper
+    return METRICS_BUCKETS[-1]
+
+def metrics_snapshot() -> dict:
+    """Aggregated per-stage latency (count, mean, p50/p95 estimates), bytes, errors and recent spans."""
+    with _METRICS.lock:
+        stages = {}
+        for (stage, cache), hist in sorted(_METRICS.histograms.items()):
+            stages.setdefault(stage, {})[cache or 'n/a'] = {
+                'count': hist['count'],
+                'mean_ms': hist['sum'] / hist['count'] * 1000 if hist['count'] else 0.0,
+                'p50_ms': _bucket_quantile(hist, 0.50) * 1000,
+                'p95_ms': _bucket_quantile(hist, 0.95) * 1000,
+            }
+        return {
+            'enabled': _METRICS.enabled,
+            'stages': stages,
+            'bytes': dict(_METRICS.bytes),
+            'errors': dict(_METRICS.errors),
+            'recent_spans': list(_METRICS.recent),
+            'cache': cache_stats(),
+            'backend': backend_stats(),
+            'title_fast_path': title_stats(),
+        }
+
+def metrics_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP kiwix_tool_stage_seconds Time spent per retrieval stage.",
+        "# TYPE kiwix_tool_stage_seconds histogram",
+    ]
+    with _METRICS.lock:
+        for (stage, cache), hist in sorted(_METRICS.histograms.items()):
+            labels = f'stage="{stage}",cache="{cache}"'
+            cumulative = 0
+            for upper, n in zip(METRICS_BUCKETS, hist['buckets']):
+                cumulative += n
+                lines.append(f'kiwix_tool_stage_seconds_bucket{{{labels},le="{upper:g}"}} {cumulative}')
+            lines.append(f'kiwix_tool_stage_seconds_bucket{{{labels},le="+Inf"}} {hist["count"]}')
+            lines.append(f'kiwix_tool_stage_seconds_sum{{{labels}}} {hist["sum"]:.6f}')
+            lines.append(f'kiwix_tool_stage_seconds_count{{{labels}}} {hist["count"]}')
+        lines.append("# HELP kiwix_tool_stage_bytes_total Bytes transferred per retrieval stage.")
+        lines.append("# TYPE kiwix_tool_stage_bytes_total counter")
+        for stage, n in sorted(_METRICS.bytes.items()):
+            lines.append(f'kiwix_tool_stage_bytes_total{{stage="{stage}"}} {n}')
+        lines.append("# HELP kiwix_tool_stage_errors_total Stages that raised.")
+        lines.append("# TYPE kiwix_tool_stage_errors_total counter")
+        for stage, n in sorted(_METRICS.errors.items()):
+            lines.append(f'kiwix_tool_stage_errors_total{{stage="{stage}"}} {n}')
+    backend = backend_stats()
+    lines.append("# HELP kiwix_tool_request_timeout_seconds Current adaptive timeout per endpoint and book.")
+    lines.append("# TYPE kiwix_tool_request_timeout_seconds gauge")
+    for key, stats in backend['latency'].items():
+        endpoint, book = key.split(":", 1)
+        lines.append(f'kiwix_tool_request_timeout_seconds{{endpoint="{endpoint}",book="{book}"}} {stats["timeout_ms"] / 1000:.3f}')
+    lines.append("# HELP kiwix_tool_hedged_requests_total Duplicate requests sent for slow responses.")
+    lines.append("# TYPE kiwix_tool_hedged_requests_total counter")
+    for endpoint, n in sorted(backend['hedges'].items()):
+        lines.append(f'kiwix_tool_hedged_requests_total{{endpoint="{endpoint}"}} {n}')
+    lines.append("# HELP kiwix_tool_circuit_open Books currently skipped by the circuit breaker.")
+    lines.append("# TYPE kiwix_tool_circuit_open gauge")
+    for book in backend['open_breakers']:
+        lines.append(f'kiwix_tool_circuit_open{{book="{book}"}} 1')
+    titles = title_stats()
+    lines.append("# HELP kiwix_tool_title_lookups_total Title fast path lookups by outcome.")
+    lines.append("# TYPE kiwix_tool_title_lookups_total counter")
+    for outcome in ('hits', 'misses', 'errors'):
+        lines.append(f'kiwix_tool_title_lookups_total{{outcome="{outcome}"}} {titles[outcome]}')
+    lines.append("# HELP kiwix_tool_title_saved_seconds Full-text search time saved by title hits, net of lookup cost.")
+    lines.append("# TYPE kiwix_tool_title_saved_seconds gauge")
+    lines.append(f'kiwix_tool_title_saved_seconds {titles["saved_ms"] / 1000:.6f}')
+    lines.append("# HELP kiwix_tool_cache_events_total Article/query cache hits and misses.")
+    lines.append("# TYPE kiwix_tool_cache_events_total counter")
+    for cache_dir, stats in sorted(cache_stats().items()):
+        for event, n in sorted(stats.items()):
+            lines.append(f'kiwix_tool_cache_events_total{{cache_dir="{cache_dir}",event="{event}"}} {n}')
+    return "\n".join(lines) + "\n"
+
+class _CircuitOpen(RuntimeError):
+    pass
+
+def _percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class _Backend:
+    """
+    Latency history of kiwix-serve requests per (endpoint, book), the adaptive timeouts and
+    hedge delays derived from it, and one circuit breaker per book. Book '' stands for the
+    endpoint as a whole, which is what a book with too little history falls back to.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.windows = {}    # (endpoint, book) -> recent latencies (seconds)
+        self.requests = {}   # endpoint -> requests admitted
+        self.hedges = {}     # endpoint -> duplicate requests sent
+        self.timeouts = {}   # (endpoint, book) -> requests that timed out
+        self.breakers = {}   # book -> {'failures': n, 'last_ok', 'opened': monotonic time or None, 'probing': bool}
+
+    def _window(self, endpoint: str, book: str):
+        for key in ((endpoint, book), (endpoint, '')):
+            window = self.windows.get(key)
+            if window is not None and len(window) >= LATENCY_MIN_SAMPLES:
+                return sorted(window)
+        return None
+
+    def timeout(self, endpoint: str, book: str, cold: float) -> float:
+        # p99 x TIMEOUT_MULTIPLIER once there is history, the fixed cold-start timeout before that
+        with self.lock:
+            window = self._window(endpoint, book)
+        if window is None:
+            return cold
+        return min(TIMEOUT_CEILING, max(TIMEOUT_FLOOR, _percentile(window, 0.99) * TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self, endpoint: str, book: str):
+        with self.lock:
+            window = self._window(endpoint, book)
+        return _percentile(window, HEDGE_PERCENTILE) if window is not None else None
+
+    def may_hedge(self, endpoint: str) -> bool:
+        # Duplicates are capped at HEDGE_BUDGET of all requests so a slow server is not swamped
+        with self.lock:
+            if self.hedges.get(endpoint, 0) >= HEDGE_BUDGET * self.requests.get(endpoint, 0):
+                return False
+            self.hedges[endpoint] = self.hedges.get(endpoint, 0) + 1
+            return True
+
+    def admit(self, endpoint: str, book: str):
+        # Fails fast while the book's breaker is open; after the cooldown one trial request goes through
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            breaker = self.breakers.get(book)
+            if breaker is None or breaker['opened'] is None:
+                return
+            if breaker['probing'] or time.monotonic() - breaker['opened'] < BREAKER_COOLDOWN:
+                raise _CircuitOpen(f"{book or 'kiwix-serve'} is not responding "
+                                   f"({breaker['failures']} failed requests), skipped for now")
+            breaker['probing'] = True
+
+    def observe(self, endpoint: str, book: str, seconds: float, ok: bool, timed_out: bool = False):
+        with self.lock:
+            if ok or timed_out:
+                # A timeout is a lower bound on the latency: keeping it lets the timeout grow on a slow server
+                for key in ((endpoint, book), (endpoint, '')):
+                    window = self.windows.get(key)
+                    if window is None:
+                        window = self.windows[key] = deque(maxlen=LATENCY_WINDOW)
+                    window.append(seconds)
+            if timed_out:
+                self.timeouts[(endpoint, book)] = self.timeouts.get((endpoint, book), 0) + 1
+            now = time.monotonic()
+            breaker = self.breakers.get(book)
+            if breaker is None:
+                breaker = self.breakers[book] = {'failures': 0, 'last_ok': None, 'opened': None, 'probing': False}
+            if ok:
+                breaker.update(failures=0, last_ok=now, opened=None, probing=False)
+                return
+            breaker['failures'] += 1
+            quiet = breaker['last_ok'] is None or now - breaker['last_ok'] >= BREAKER_QUIET
+            if breaker['probing'] or (breaker['failures'] >= BREAKER_FAILURES and quiet):
+                if breaker['opened'] is None or breaker['probing']:
+                    log.warning("Circuit open for %s after %d failed requests", book or 'kiwix-serve',
+                                breaker['failures'])
+                breaker['opened'] = now
+                breaker['probing'] = False
+
+    def reset(self):
+        with self.lock:
+            self.windows.clear()
+            self.requests.clear()
+            self.hedges.clear()
+            self.timeouts.clear()
+            self.breakers.clear()
+
+_BACKEND = _Backend()
+
+def backend_stats() -> dict:
+    """Per-endpoint/book latency percentiles and current timeouts, hedges sent and open circuit breakers."""
+    with _BACKEND.lock:
+        windows = {key: sorted(w) for key, w in _BACKEND.windows.items() if w}
+        timeouts = dict(_BACKEND.timeouts)
+        stats = {
+            'requests': dict(_BACKEND.requests),
+            'hedges': dict(_BACKEND.hedges),
+            'open_breakers': sorted(book or 'kiwix-serve' for book, b in _BACKEND.breakers.items() if b['opened']),
+        }
+    stats['latency'] = {
+        f"{endpoint}:{book or '*'}": {
+            'samples': len(w),
+            'p50_ms': _percentile(w, 0.50) * 1000,
+            'p95_ms': _percentile(w, 0.95) * 1000,
+            'timeout_ms': _BACKEND.timeout(endpoint, book, 0.0) * 1000,
+            'timeouts': timeouts.get((endpoint, book), 0),
+        }
+        for (endpoint, book), w in sorted(windows.items())
+    }
+    return stats
+
+async def _request(endpoint: str, book: str, cold_timeout: float, send, span=None):
+    """
+    Runs send(timeout, attrs) -> awaitable under the adaptive timeout for (endpoint, book). If it
+    is still running at that endpoint's p95, a duplicate is sent and whichever succeeds first is
+    used; the other is cancelled. Each copy records into its own attrs dict and only the
+    winner's are copied to `span`. Timeouts and connection errors count against the book's
+    circuit breaker, and an open breaker fails the request immediately.
+    """
+    span = span if span is not None else _NULL_SPAN
+    _BACKEND.admit(endpoint, book)
+    timeout = _BACKEND.timeout(endpoint, book, cold_timeout)
+    delay = _BACKEND.hedge_delay(endpoint, book)
+    span['timeout_ms'] = round(timeout * 1000)
+
+    started = {}
+    attrs = {}
+    def launch(budget):
+        attrs_of_copy = {}
+        task = asyncio.ensure_future(send(budget, attrs_of_copy))
+        # A cancelled loser can still finish with its own timeout; that is expected, not worth a warning
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        started[task] = time.monotonic()
+        attrs[task] = attrs_of_copy
+        return task
+
+    first = launch(timeout)
+    pending = {first}
+    error = None
+    try:
+        if delay is not None and delay < timeout:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done and _BACKEND.may_hedge(endpoint):
+                span['hedged'] = True
+                pending.add(launch(timeout - delay))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    _BACKEND.observe(endpoint, book, time.monotonic() - started[task], ok=True)
+                    if task is not first:
+                        span['hedge_won'] = True
+                    for key, value in attrs[task].items():
+                        span[key] = value
+                    return task.result()
+                error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    timed_out = isinstance(error, asyncio.TimeoutError)
+    if timed_out or isinstance(error, aiohttp.ClientConnectionError):
+        _BACKEND.observe(endpoint, book, time.monotonic() - started[first], ok=False, timed_out=timed_out)
+    else:
+        # The server answered; whatever failed afterwards is not its fault
+        _BACKEND.observe(endpoint, book, time.monotonic() - started[first], ok=True)
+    raise error
+
+def _format_timeout(query: str, progress: dict, deadline: float) -> str:
+    # Partial answer for a sub-query that did not finish inside the tool deadline
+    where = f" in {progress['book']}" if progress.get('book') else ""
+    msg = f"### QUERY: {query}\n[Timed out after {deadline:g}s during '{progress.get('stage')}'{where}.]"
+    if progress.get('article'):
+        msg += f"\nBest matching article (not retrieved): {progress['article']}"
+    return msg
+
+_SESSIONS = {}
+
+def _get_session() -> aiohttp.ClientSession:
+    # One pooled keep-alive session per event loop (Open WebUI runs a single loop)
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        for old_loop in [l for l in _SESSIONS if l.is_closed()]:
+            del _SESSIONS[old_loop]
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=KEEPALIVE)
+        session = aiohttp.ClientSession(connector=connector)
+        _SESSIONS[loop] = session
+    return session
+
+async def _close_sessions():
+    # For scripts that drive the tool with asyncio.run(); Open WebUI keeps the pool for the process lifetime
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+
+async def _http_get(url: str, timeout: float, headers: dict = None):
+    session = _get_session()
+    async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+        body = await r.read()
+        return r.status, r.headers, body
+
+async def _embed_query(url: str, model: str, query: str) -> list:
+    session = _get_session()
+    payload = {"model": model, "input": [EMBED_QUERY_PREFIX + query], "truncate": True}
+    async with session.post(f"{url}/api/embed", json=payload,
+                            timeout=aiohttp.ClientTimeout(total=EMBED_TIMEOUT)) as r:
+        if r.status != 200:
+            raise RuntimeError(f"embedder returned HTTP {r.status}")
+        return (await r.json(content_type=None))["embeddings"][0]
+
+async def _http_get_text(url: str, timeout: float, text_limit: int, byte_cap: int, span=None) -> str:
+    # Streams an article through _TextExtractor; stops reading at the text budget or the byte cap
+    span = span if span is not None else _NULL_SPAN
+    session = _get_session()
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+        extractor = _TextExtractor(text_limit)
+        try:
+            decoder = codecs.getincrementaldecoder(r.charset or 'utf-8')(errors='replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        received = 0
+        parse_time = 0.0
+        async for chunk in r.content.iter_chunked(STREAM_CHUNK):
+            received += len(chunk)
+            started = time.perf_counter()
+            extractor.feed(decoder.decode(chunk))
+            parse_time += time.perf_counter() - started
+            if extractor.done or received >= byte_cap:
+                # Leaving early drops the connection instead of draining a multi-MB body
+                break
+        span['bytes'] = received
+        span['extract_ms'] = round(parse_time * 1000, 3)
+        return extractor.text()
+
+class _CatalogIndex:
+    """
+    Process-wide index of the kiwix-serve OPDS catalog.
+    The feed is downloaded and parsed once, then re-validated with a conditional GET
+    after `ttl` seconds. Lookups are served from memory.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.books = []      # [{'id', 'name', 'title'}] in feed order
+        self.by_key = {}     # exact lowercase title/name/id -> book id
+        self.memo = {}       # partial name -> book id (or None), cleared on rebuild
+        self.etag = None
+        self.last_modified = None
+        self.checked_at = 0.0
+        self.lock = None
+        self.lock_loop = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        # asyncio locks are bound to the loop they were first used on
+        loop = asyncio.get_running_loop()
+        if self.lock is None or self.lock_loop is not loop:
+            self.lock = asyncio.Lock()
+            self.lock_loop = loop
+        return self.lock
+
+    async def ensure_fresh(self, ttl: float, timeout: float = CATALOG_TIMEOUT, span=None):
+        span = span if span is not None else _NULL_SPAN
+        span['cache'] = 'hit'
+        if self.books and time.monotonic() - self.checked_at < ttl:
+            return
+        async with self._get_lock():
+            # Another sub-query may have refreshed while we waited on the lock
+            if self.books and time.monotonic() - self.checked_at < ttl:
+                return
+            await self._refresh(timeout, span)
+
+    def invalidate(self):
+        # Forces a full (unconditional) reload on the next lookup, e.g. after a 404 on a cached ID
+        self.checked_at = 0.0
+        self.etag = None
+        self.last_modified = None
+
+    async def _refresh(self, timeout: float, span=None):
+        span = span if span is not None else _NULL_SPAN
+        headers = {}
+        if self.books and self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.books and self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        url = f"{self.host}/catalog/v2/entries"
+        status, resp_headers, content = await _request("catalog", "", timeout,
+                                                       lambda budget, _: _http_get(url, budget, headers), span)
+        span['bytes'] = len(content)
+        if status == 304:
+            span['cache'] = 'revalidated'
+            self.checked_at = time.monotonic()
+            return
+        if status != 200:
+            # Keep serving the previous index if we have one
+            if self.books:
+                self.checked_at = time.monotonic()
+            return
+
+        log.info("Rebuilding catalog index from %s", self.host)
+        span['cache'] = 'miss'
+        self._rebuild(content)
+        self.etag = resp_headers.get('ETag')
+        self.last_modified = resp_headers.get('Last-Modified')
+        self.checked_at = time.monotonic()
+
+    def _rebuild(self, content: bytes):
+        # Kiwix-serve returns an OPDS Atom feed (XML), not JSON
+        soup = BeautifulSoup(content, 'xml')
+        books = []
         for entry in soup.find_all('entry'):
             # Title often contains readable name: "Wikipedia English"
             title = entry.find('title').text if entry.find('title') else ""
-            
-            if partial_name.lower() in title.lower():
-                # Extract ID from the <link type="text/html" href="/content/ID">
-                # We search for the link that points to the content root
-                link = entry.find('link', type="text/html")
-                if link and link.get('href'):
-                    # href is like "/content/wikipedia_en_all_nopic_2025-12"
-                    # We need just the ID part
-                    raw_id = link['href'].split('/content/')[-1]
-                    return raw_id
+            name = entry.find('name').text if entry.find('name') else ""
+            # Extract ID from the <link type="text/html" href="/content/ID">
+            # href is like "/content/wikipedia_en_all_nopic_2025-12", we need just the ID part
+            link = entry.find('link', type="text/html")
+            book_id = link['href'].split('/content/')[-1] if link and link.get('href') else None
+            books.append({'id': book_id, 'name': name, 'title': title})
+        self._set_books(books)
+
+    def _set_books(self, books: list):
+        by_key = {}
+        for book in books:
+            if not book['id']:
+                continue
+            for key in (book['title'], book['name'], book['id']):
+                if key:
+                    by_key.setdefault(key.lower(), book['id'])
+
+        # Swap in one go so concurrent readers never see a half-built index
+        self.books, self.by_key, self.memo = books, by_key, {}
+
+    def resolve(self, partial_name: str):
+        needle = partial_name.lower()
+        if needle in self.by_key:
+            return self.by_key[needle]
+        memo = self.memo
+        if needle in memo:
+            return memo[needle]
+
+        book_id = None
+        # Titles first (feed order), then the machine names/IDs (e.g. "stackoverflow.com_en_all")
+        for field in ('title', 'name', 'id'):
+            for book in self.books:
+                if book['id'] and book[field] and needle in book[field].lower():
+                    book_id = book['id']
+                    break
+            if book_id:
+                break
+        memo[needle] = book_id
+        return book_id
+
+    def titles(self):
+        return [b['title'] for b in self.books if b['title']]
+
+
+_CATALOGS = {}
+
+def _get_catalog(host: str) -> _CatalogIndex:
+    catalog = _CATALOGS.get(host)
+    if catalog is None:
+        catalog = _CATALOGS.setdefault(host, _CatalogIndex(host))
+    return catalog
+
+class _ZimLibrary(_CatalogIndex):
+    """
+    Book index over ZIM files opened directly with libzim, bypassing kiwix-serve.
+    Archives are memory-mapped by libzim; search uses the embedded Xapian full-text index,
+    falling back to the title index. Book IDs are the file names without ".zim", the same
+    IDs kiwix-serve uses, so results and cache keys line up across backends.
+    """
+
+    def __init__(self, zim_dir: str):
+        super().__init__(zim_dir)
+        self.archives = {}   # book id -> (path, mtime, Archive)
+        self.searchers = {}  # book id -> (lock, Searcher)
+
+    async def _refresh(self, timeout: float, span=None):
+        if span is not None:
+            span['cache'] = 'miss'
+        await asyncio.to_thread(self._scan)
+
+    def _listed(self):
+        # Books in library.xml (maintenance/kiwix_library.py), the same set kiwix-serve
+        # serves; superseded versions that are still draining are left out. None: no file.
+        try:
+            root = ET.parse(os.path.join(self.host, "library.xml")).getroot()
+        except (OSError, ET.ParseError):
+            return None
+        return [os.path.join(self.host, b.get("path")) for b in root.iter("book") if b.get("path")]
+
+    def _scan(self):
+        # ZIMs may live in category sub-folders (zims/tech/...), as civ_ingest.sh files them
+        paths = self._listed()
+        if paths is None:
+            paths = [os.path.join(root, f) for root, _, files in os.walk(self.host)
+                     for f in files if f.endswith(".zim")]
+        found = {}
+        for path in paths:
+            try:
+                found[os.path.basename(path)[:-4]] = (path, os.stat(path).st_mtime)
+            except OSError:
+                continue
+
+        archives = {}
+        for book_id, (path, mtime) in sorted(found.items()):
+            old = self.archives.get(book_id)
+            if old and old[0] == path and old[1] == mtime:
+                archives[book_id] = old
+                continue
+            try:
+                archives[book_id] = (path, mtime, Archive(path))
+            except RuntimeError as e:
+                log.warning("Cannot open %s: %s", path, e)
+
+        books = [{'id': book_id, 'name': _zim_metadata(a, "Name"), 'title': _zim_metadata(a, "Title")}
+                 for book_id, (_, _, a) in archives.items()]
+        # Drop searchers of archives that were replaced or removed
+        self.searchers = {b: s for b, s in self.searchers.items() if archives.get(b) is self.archives.get(b)}
+        self.archives = archives
+        self._set_books(books)
+        self.checked_at = time.monotonic()
+
+    def search(self, book_id: str, query: str, limit: int) -> list:
+        archive = self.archives[book_id][2]
+        paths = []
+        if archive.has_fulltext_index:
+            entry = self.searchers.get(book_id)
+            if entry is None:
+                entry = self.searchers.setdefault(book_id, (threading.Lock(), Searcher(archive)))
+            lock, searcher = entry
+            with lock:
+                paths = list(searcher.search(Query().set_query(query)).getResults(0, limit))
+        if not paths and archive.has_title_index:
+            paths = list(SuggestionSearcher(archive).suggest(query).getResults(0, limit))
+        # Same link shape kiwix-serve renders, so _rank_links treats both backends alike
+        return [f"/content/{book_id}/{p}" for p in paths]
+
+    def suggest(self, book_id: str, query: str, limit: int) -> list:
+        # Title index lookup, as [(title, path)] like kiwix-serve's /suggest
+        archive = self.archives[book_id][2]
+        if not archive.has_title_index:
+            return []
+        paths = SuggestionSearcher(archive).suggest(query).getResults(0, limit)
+        return [(archive.get_entry_by_path(p).title, p) for p in paths]
+
+    def read_text(self, book_id: str, path: str, limit: int, max_bytes: int, span=None) -> str:
+        archive = self.archives[book_id][2]
+        entry = archive.get_entry_by_path(urllib.parse.unquote(path))
+        while entry.is_redirect:
+            entry = entry.get_redirect_entry()
+        item = entry.get_item()
+        if not item.mimetype.startswith("text/html"):
+            return ""
+        # item.content is a memoryview, so the byte cap is applied without copying the blob
+        body = bytes(item.content[:max_bytes])
+        started = time.perf_counter()
+        text = _html_to_text(body, limit)
+        if span is not None:
+            span['bytes'] = len(body)
+            span['extract_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return text
+
+def _zim_metadata(archive, key: str) -> str:
+    try:
+        return archive.get_metadata(key).decode("utf-8", errors="replace")
+    except RuntimeError:
+        return ""
+
+class _SemanticIndex:
+    """
+    Read side of one book's index from maintenance/semantic_index.py. The vector matrix and
+    the IVF lists are memory-mapped; a search scores the centroids, then only the rows of the
+    `nprobe` closest lists, and reads the winning passages from chunks.db.
+    """
+
+    def __init__(self, path: str, meta: dict, stamp: int):
+        self.meta = meta
+        self.stamp = stamp
+        dim, count = meta["dim"], meta["count"]
+        dtype = np.int8 if meta["dtype"] == "int8" else np.float16
+        self.vectors = np.memmap(os.path.join(path, "vectors.bin"), dtype=dtype, mode='r', shape=(count, dim))
+        self.scales = None
+        if meta["dtype"] == "int8":
+            self.scales = np.memmap(os.path.join(path, "scales.bin"), dtype=np.float32, mode='r', shape=(count,))
+        self.centroids = np.fromfile(os.path.join(path, "centroids.bin"), dtype=np.float32).reshape(-1, dim)
+        self.lists = np.memmap(os.path.join(path, "lists.bin"), dtype=np.uint32, mode='r', shape=(count,))
+        self.offsets = np.fromfile(os.path.join(path, "offsets.bin"), dtype=np.uint64)
+        self.db = sqlite3.connect(f"file:{os.path.join(path, 'chunks.db')}?mode=ro", uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def search(self, vector, k: int, nprobe: int) -> list:
+        """[(similarity, article path, title, passage)] of the k nearest passages, best first."""
+        q = np.asarray(vector, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        probe = np.argsort(-(self.centroids @ q))[:nprobe]
+        rows = [self.lists[int(self.offsets[c]):int(self.offsets[c + 1])] for c in probe]
+        rows = np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.uint32)
+        if not len(rows):
+            return []
+        # Row order keeps the reads through the map sequential
+        sims = self.vectors[rows].astype(np.float32) @ q
+        if self.scales is not None:
+            sims *= self.scales[rows]
+        best = np.argsort(-sims)[:k]
+        ids = [int(rows[i]) for i in best]
+        with self.lock:
+            found = {row[0]: row[1:] for row in self.db.execute(
+                f"SELECT id, path, title, text FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids)}
+        return [(float(sims[i]),) + tuple(found[row]) for i, row in zip(best, ids) if row in found]
+
+_SEMANTIC_INDEXES = {}
+_SEMANTIC_LOCK = threading.Lock()
+
+def _get_semantic_index(index_dir: str, book_id: str):
+    # None when the book has no complete, non-empty index; reopened when meta.json changes (rebuild)
+    if np is None:
         return None
+    path = os.path.join(index_dir, book_id)
+    try:
+        stamp = os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+    except OSError:
+        return None
+    with _SEMANTIC_LOCK:
+        index = _SEMANTIC_INDEXES.get(path)
+        if index is not None and index.stamp == stamp:
+            return index
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            index = _SemanticIndex(path, meta, stamp) if meta.get("complete") and meta.get("count") else None
+        except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+            log.warning("Semantic index %s unusable: %s", path, e)
+            index = None
+        _SEMANTIC_INDEXES[path] = index
+        return index
+
+_ZIM_LIBRARIES = {}
+
+def _get_zim_library(zim_dir: str) -> _ZimLibrary:
+    library = _ZIM_LIBRARIES.get(zim_dir)
+    if library is None:
+        library = _ZIM_LIBRARIES.setdefault(zim_dir, _ZimLibrary(zim_dir))
+    return library
+
+async def _resolve_book_id(catalog: _CatalogIndex, partial_name: str, ttl: float = CATALOG_TTL) -> str:
+    try:
+        with _span("catalog", keyword=partial_name) as span:
+            await catalog.ensure_fresh(ttl, span=span)
+            book_id = catalog.resolve(partial_name)
+            span['book'] = book_id
+            return book_id
+    except asyncio.CancelledError:
+        raise
     except:
         return None
 
-def _get_available_books(host: str):
+async def _get_available_books(catalog: _CatalogIndex, ttl: float = CATALOG_TTL):
     try:
-            r = requests.get(f"{host}/catalog/v2/entries", timeout=1)
-            soup = BeautifulSoup(r.content, 'xml')
-            titles = [e.find('title').text for e in soup.find_all('entry') if e.find('title')]
-            return titles
+            await catalog.ensure_fresh(ttl)
+            return catalog.titles()
+    except asyncio.CancelledError:
+            raise
     except:
             return "Unable to list (XML Parse Error)."
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Persistent SHA-256 cache for large files (ZIMs, PDFs).
+
+Digests are stored in SQLite keyed by (path, size, mtime_ns, inode), so a file that
+has not changed since it was last hashed is never read again. Any change to the file
+(rewrite, replace, touch) changes the key and forces a fresh hash.
+
+Usage:
+    python3 maintenance/checksum_cache.py FILE...               # sha256sum-style output
+    python3 maintenance/checksum_cache.py FILE --verify HASH    # exit 1 on mismatch
+    python3 maintenance/checksum_cache.py --prune               # drop entries for missing files
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+
+CIV_ROOT = os.getenv("CIV_ROOT", "/opt/civilization")
+DB_PATH = os.getenv("CIV_CHECKSUM_DB", os.path.join(CIV_ROOT, "cache", "checksums.db"))
+READ_CHUNK = 16 * 1024 * 1024
+
+def _connect():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    db = sqlite3.connect(DB_PATH, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS checksums ("
+        " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER,"
+        " sha256 TEXT, hashed_at REAL)"
+    )
+    return db
+
+def _key(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns, st.st_ino
+
+def lookup(path):
+    """Cached digest for `path`, or None if unknown or the file changed since."""
+    try:
+        abspath, size, mtime_ns, inode = _key(path)
+        with _connect() as db:
+            row = db.execute(
+                "SELECT sha256 FROM checksums WHERE path=? AND size=? AND mtime_ns=? AND inode=?",
+                (abspath, size, mtime_ns, inode),
+            ).fetchone()
+        return row[0] if row else None
+    except (OSError, sqlite3.Error):
+        return None
+
+def record(path, digest):
+    """Remember `digest` for the file as it is on disk right now."""
+    try:
+        abspath, size, mtime_ns, inode = _key(path)
+        with _connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, strftime('%s','now'))",
+                (abspath, size, mtime_ns, inode, digest),
+            )
+    except (OSError, sqlite3.Error) as e:
+        # Cache is an optimisation; never fail the caller over it
+        print(f"    [!] Checksum cache unavailable: {e}")
+
+def forget(path):
+    try:
+        with _connect() as db:
+            db.execute("DELETE FROM checksums WHERE path=?", (os.path.abspath(path),))
+    except (OSError, sqlite3.Error):
+        pass
+
+def sha256_file(path, progress=False):
+    """SHA-256 of `path`, from the cache when the file is unchanged."""
+    digest = lookup(path)
+    if digest:
+        return digest
+
+    h = hashlib.sha256()
+    file_size = os.path.getsize(path) or 1
+    processed = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+            processed += len(chunk)
+            if progress:
+                filled = int(40 * processed // file_size)
+                bar = "=" * filled + "-" * (40 - filled)
+                sys.stdout.write(f"\r    [{bar}] {processed * 100.0 / file_size:.1f}%")
+                sys.stdout.flush()
+    if progress:
+        print()
+
+    digest = h.hexdigest()
+    record(path, digest)
+    return digest
+
+def prune():
+    """Drop entries whose file no longer exists. Returns the number removed."""
+    with _connect() as db:
+        paths = [row[0] for row in db.execute("SELECT path FROM checksums")]
+        gone = [(p,) for p in paths if not os.path.exists(p)]
+        db.executemany("DELETE FROM checksums WHERE path=?", gone)
+    return len(gone)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Cached SHA-256 for large files")
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--verify", metavar="HASH", help="Compare a single file against HASH")
+    parser.add_argument("--prune", action="store_true", help="Remove entries for deleted files")
+    args = parser.parse_args()
+
+    if args.prune:
+        print(f"[OK] Pruned {prune()} stale entries from {DB_PATH}")
+        return
+    if args.verify:
+        if len(args.files) != 1:
+            parser.error("--verify takes exactly one file")
+        ok = sha256_file(args.files[0]) == args.verify.strip().lower()
+        print(f"{'[PASS]' if ok else '[FAIL]'} {args.files[0]}")
+        sys.exit(0 if ok else 1)
+
+    status = 0
+    for path in args.files:
+        try:
+            print(f"{sha256_file(path)}  {path}")
+        except OSError as e:
+            print(f"[!] {path}: {e}", file=sys.stderr)
+            status = 1
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
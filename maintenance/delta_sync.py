@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+zsync-style delta updates for refreshed ZIM archives.
+
+The server side publishes a control file (`<file>.zblocks`) with a rolling weak checksum
+and a strong hash for every fixed-size block of the new file. The client scans its old
+version of the same book with the rolling checksum (at every byte offset, so shifted
+data still matches), copies every block it already has, and fetches only the missing
+byte ranges with Range requests. The result is verified against the published SHA-256.
+
+Control file format (text header, blank line, then one record per block):
+    civ-zsync: 1
+    Length: <bytes>
+    Blocksize: <bytes>
+    SHA-256: <hex>
+
+    <8-byte big-endian weak checksum><16-byte BLAKE2b-128 of the block> ...
+
+Weak checksum of a block x[0..B-1]: a = sum(x), b = sum((B - i) * x[i]) mod 2^32,
+weak = a << 32 | b (rsync/zsync's rolling sum, widened to 64 bits to keep weak
+collisions, and therefore strong-hash checks, rare on multi-GB files).
+
+numpy (optional) enables the rolling scan; without it only block-aligned matches are
+found, which still covers in-place changes. `make` requires numpy.
+
+Usage:
+    python3 maintenance/delta_sync.py make new.zim                 # writes new.zim.zblocks
+    python3 maintenance/delta_sync.py sync URL old.zim new.zim [--sha256 HEX]
+"""
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import checksum_cache
+import range_download
+
+try:
+    import numpy as np
+except ImportError:  # aligned-only matching
+    np = None
+
+CONTROL_SUFFIX = ".zblocks"
+DEFAULT_BLOCK_SIZE = 64 * 1024
+SCAN_CHUNK = 4 * 1024 * 1024
+RECORD = 24  # 8 weak + 16 strong
+MASK32 = 0xFFFFFFFF
+MAX_BITMAP_BITS = 26
+SCAN_WORKERS = min(8, os.cpu_count() or 1)
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+def _block_weaks(buf, block_size):
+    # Weak checksums of consecutive whole blocks in buf (numpy)
+    n = len(buf) // block_size
+    x = np.frombuffer(buf, dtype=np.uint8, count=n * block_size).reshape(n, block_size)
+    weights = np.arange(block_size, 0, -1, dtype=np.int64)
+    a = x.sum(axis=1, dtype=np.int64)
+    b = (x @ weights) & MASK32
+    return ((a.astype(np.uint64) << np.uint64(32)) | b.astype(np.uint64))
+
+def _rolling_sums(buf, block_size):
+    # a, b of the block starting at every offset 0..len(buf)-block_size.
+    # uint32 wraparound is exact here: a < 2^32 and b is defined mod 2^32.
+    x = np.frombuffer(buf, dtype=np.uint8).astype(np.uint32)
+    n = len(x)
+    s1 = np.zeros(n + 1, dtype=np.uint32)
+    np.cumsum(x, out=s1[1:])
+    x *= np.arange(n, dtype=np.uint32)
+    s2 = np.zeros(n + 1, dtype=np.uint32)
+    np.cumsum(x, out=s2[1:])
+    a = s1[block_size:] - s1[:-block_size]
+    # b(k) = (B + k) * a(k) - sum(j * x[j]) over the window
+    b = np.arange(block_size, n + 1, dtype=np.uint32)
+    b *= a
+    b -= s2[block_size:]
+    b += s2[:-block_size]
+    return a, b
+
+def _bitmap_slot(b, bits):
+    # Multiplicative hash of the 32-bit b sum into `bits` bits
+    h = b * np.uint32(0x9E3779B1)
+    h >>= np.uint32(32 - bits)
+    return h
+
+def make_control(path, out=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Write the control file for `path`; returns its path."""
+    if np is None:
+        raise RuntimeError("numpy is required to build control files")
+    out = out or path + CONTROL_SUFFIX
+    size = os.path.getsize(path)
+    sha = hashlib.sha256()
+    records = bytearray()
+    per_read = max(1, SCAN_CHUNK // block_size) * block_size
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(per_read)
+            if not buf:
+                break
+            sha.update(buf)
+            whole = len(buf) // block_size
+            weaks = _block_weaks(buf, block_size) if whole else []
+            for i in range(whole):
+                records += int(weaks[i]).to_bytes(8, "big")
+                records += strong_hash(buf[i * block_size:(i + 1) * block_size])
+            if len(buf) % block_size:
+                # Trailing partial block: always fetched, recorded for completeness
+                records += b"\0" * 8 + strong_hash(buf[whole * block_size:])
+    header = (f"civ-zsync: 1\nLength: {size}\nBlocksize: {block_size}\n"
+              f"SHA-256: {sha.hexdigest()}\n\n").encode()
+    tmp = out + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(records)
+    os.replace(tmp, out)
+    return out
+
+def parse_control(data):
+    head, sep, body = data.partition(b"\n\n")
+    if not sep or not head.startswith(b"civ-zsync: 1"):
+        raise ValueError("not a civ-zsync control file")
+    fields = dict(line.split(": ", 1) for line in head.decode().splitlines())
+    length, block_size = int(fields["Length"]), int(fields["Blocksize"])
+    count = (length + block_size - 1) // block_size
+    if len(body) != count * RECORD:
+        raise ValueError(f"control file has {len(body) // RECORD} blocks, expected {count}")
+    weak = [int.from_bytes(body[i * RECORD:i * RECORD + 8], "big") for i in range(count)]
+    strong = [body[i * RECORD + 8:(i + 1) * RECORD] for i in range(count)]
+    return {"length": length, "block_size": block_size, "sha256": fields.get("SHA-256"),
+            "weak": weak, "strong": strong}
+
+def _scan_aligned(old_path, control, found):
+    # No numpy: compare strong hashes at block-aligned offsets only
+    block_size = control["block_size"]
+    wanted = {}
+    for i, h in enumerate(control["strong"]):
+        if i not in found and (i + 1) * block_size <= control["length"]:
+            wanted.setdefault(h, []).append(i)
+    with open(old_path, "rb") as f:
+        offset = 0
+        while wanted:
+            block = f.read(block_size)
+            if len(block) < block_size:
+                break
+            for i in wanted.pop(strong_hash(block), ()):
+                found[i] = offset
+            offset += block_size
+
+def _scan_window(fd, start, block_size, bitmap, bits, sorted_weak):
+    # Exact weak-checksum hits in one window: [(file_offset, weak, strong_hash)]
+    buf = os.pread(fd, SCAN_CHUNK + block_size - 1, start)
+    if len(buf) < block_size:
+        return []
+    a, b = _rolling_sums(buf, block_size)
+    cand = np.nonzero(bitmap[_bitmap_slot(b, bits)])[0]
+    if not len(cand):
+        return []
+    weaks = (a[cand].astype(np.uint64) << np.uint64(32)) | b[cand].astype(np.uint64)
+    pos = np.minimum(np.searchsorted(sorted_weak, weaks), len(sorted_weak) - 1)
+    hit = sorted_weak[pos] == weaks
+    return [(start + k, w, strong_hash(buf[k:k + block_size]))
+            for k, w in zip(cand[hit].tolist(), weaks[hit].tolist())]
+
+def _scan_rolling(old_path, control, found, workers=SCAN_WORKERS):
+    block_size = control["block_size"]
+    full = control["length"] // block_size  # whole blocks; the tail is always fetched
+    if not full:
+        return
+    weak = np.array(control["weak"][:full], dtype=np.uint64)
+    sorted_weak = np.sort(weak)
+    # ~16 slots per block keeps prefilter false positives near 6% while the bitmap
+    # stays as small (cache-resident) as possible
+    bits = min(MAX_BITMAP_BITS, max(12, (full * 16).bit_length()))
+    bitmap = np.zeros(1 << bits, dtype=bool)
+    bitmap[_bitmap_slot((weak & np.uint64(MASK32)).astype(np.uint32), bits)] = True
+    by_weak = {}
+    for i, w in enumerate(control["weak"][:full]):
+        by_weak.setdefault(w, []).append(i)
+    strong = control["strong"]
+    remaining = full - sum(1 for i in found if i < full)
+
+    size = os.path.getsize(old_path)
+    starts = list(range(0, max(size - block_size + 1, 0), SCAN_CHUNK))
+    fd = os.open(old_path, os.O_RDONLY)
+    try:
+        # numpy and blake2b release the GIL, so windows scan in parallel
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch in range(0, len(starts), workers * 2):
+                if not remaining:
+                    break
+                windows = [pool.submit(_scan_window, fd, s, block_size, bitmap, bits, sorted_weak)
+                           for s in starts[batch:batch + workers * 2]]
+                for window in windows:
+                    for offset, w, local_hash in window.result():
+                        for i in by_weak.get(w, ()):
+                            if i not in found and strong[i] == local_hash:
+                                found[i] = offset
+                                remaining -= 1
+    finally:
+        os.close(fd)
+
+def _runs(indexes):
+    # Consecutive integers -> [(first, last)]
+    runs = []
+    for i in sorted(indexes):
+        if runs and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return runs
+
+def fetch_control(url, session=None):
+    s = session or requests.Session()
+    r = s.get(url + CONTROL_SUFFIX, timeout=range_download.TIMEOUT)
+    if r.status_code == 404:
+        return None
+    r.raise_for_status()
+    return parse_control(r.content)
+
+def sync(url, old_path, dest, control=None, expected_sha256=None, connections=range_download.DEFAULT_CONNECTIONS,
+         progress=True, limiter=None):
+    """
+    Build `dest` (the file at `url`) from `old_path` plus the changed ranges.
+    Returns (sha256_hex, stats). Raises DownloadError if the control file is missing
+    or the result fails verification.
+    """
+    control = control or fetch_control(url)
+    if control is None:
+        raise range_download.DownloadError(f"no control file at {url}{CONTROL_SUFFIX}")
+    block_size, length = control["block_size"], control["length"]
+    count = len(control["strong"])
+    expected = (expected_sha256 or control["sha256"] or "").lower()
+
+    start = time.monotonic()
+    found = {}
+    (_scan_rolling if np is not None else _scan_aligned)(old_path, control, found)
+    scan_s = time.monotonic() - start
+
+    part = dest + ".part"
+    fd = os.open(part, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, length)
+        # Copy matched blocks, merging runs that are also contiguous in the old file
+        with open(old_path, "rb") as old:
+            runs = []
+            for i in sorted(found):
+                if runs and runs[-1][1] == i - 1 and found[i] == runs[-1][2] + (i - runs[-1][0]) * block_size:
+                    runs[-1][1] = i
+                else:
+                    runs.append([i, i, found[i]])
+            for first, last, src in runs:
+                remaining = (last - first + 1) * block_size
+                dst = first * block_size
+                while remaining:
+                    n = min(remaining, SCAN_CHUNK)
+                    os.pwrite(fd, os.pread(old.fileno(), n, src), dst)
+                    src += n
+                    dst += n
+                    remaining -= n
+
+        missing = [i for i in range(count) if i not in found]
+        ranges = [(first * block_size, min((last + 1) * block_size, length) - 1) for first, last in _runs(missing)]
+        fetched = sum(end - start + 1 for start, end in ranges)
+        if ranges:
+            info = range_download.probe(url)
+            if info["size"] != length:
+                raise range_download.DownloadError(f"control file is for {length} bytes, remote has {info['size']}")
+            validator = info["etag"] if info["etag"] and not info["etag"].startswith("W/") else info["last_modified"]
+            range_download.fetch_ranges(info["url"], fd, ranges, connections, progress, fetched, validator, limiter)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    sha = hashlib.sha256()
+    with open(part, "rb") as f:
+        for chunk in iter(lambda: f.read(16 * 1024 * 1024), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    if expected and digest != expected:
+        os.remove(part)
+        raise range_download.DownloadError("delta result failed SHA-256 verification (removed)")
+    os.replace(part, dest)
+    checksum_cache.record(dest, digest)
+
+    stats = {"blocks": count, "reused": len(found), "fetched_bytes": fetched,
+             "reused_bytes": len(found) * block_size, "scan_s": round(scan_s, 2)}
+    return digest, stats
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="zsync-style delta updates for ZIM files")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("make", help="Write <file>.zblocks for publishing next to the file")
+    p.add_argument("file")
+    p.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    p = sub.add_parser("sync", help="Rebuild the remote file from an old local version")
+    p.add_argument("url")
+    p.add_argument("old")
+    p.add_argument("dest")
+    p.add_argument("--sha256", help="Published SHA-256 (default: from the control file)")
+    p.add_argument("-c", "--connections", type=int, default=range_download.DEFAULT_CONNECTIONS)
+    args = parser.parse_args()
+
+    if args.cmd == "make":
+        print(f"[OK] Wrote {make_control(args.file, block_size=args.block_size)}")
+        return
+    try:
+        digest, stats = sync(args.url, args.old, args.dest, expected_sha256=args.sha256,
+                             connections=args.connections)
+    except (range_download.DownloadError, requests.RequestException, ValueError, OSError) as e:
+        print(f"[!] Delta sync failed: {e}")
+        sys.exit(1)
+    print(f"[OK] {args.dest}: reused {stats['reused']}/{stats['blocks']} blocks, "
+          f"fetched {stats['fetched_bytes'] / 1048576:.1f} MB (scan {stats['scan_s']}s)")
+    print(f"     sha256 {digest}")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 import requests
-import re
 import os
-import subprocess
-import hashlib
-import sys
-from urllib.parse import urljoin
+
+import checksum_cache
+import delta_sync
+import download_scheduler
+import mirror_catalog
+import range_download
 
 # Config
 BASE_URL = "https://download.kiwix.org/zim/"
@@ -13,78 +14,54 @@ INCOMING_DIR = "/opt/civilization/incoming"
 LIBRARY_DIR = "/opt/civilization/library/zims"
 
 # The 29-Item Manifest
-# Format: (CategoryDirectory, FilePattern, Description)
+# Format: (CategoryDirectory, FilePattern, Description, Priority) - lower priority downloads first
 MANIFEST = [
     # 1. Critical Core
-    ("wikipedia/", "wikipedia_en_all_nopic_2025", "Wikipedia English (Text Only)"),
-    ("wikipedia/", "wikipedia_tr_all_maxi_2025", "Wikipedia Turkish (Full)"),
-    ("wikipedia/", "wikipedia_en_medicine_maxi", "WikiMed Medical"),
-    ("ifixit/", "ifixit_en_all_2025", "iFixit Repair"),
-    ("other/", "appropedia_en_all_maxi", "Appropedia Sustainability"),
-    ("wikivoyage/", "wikivoyage_en_all_maxi_2025", "Wikivoyage Global"),
-    ("other/", "openstreetmap-wiki_en_all_maxi", "OpenStreetMap Wiki"),
-    ("phet/", "phet_en_all", "PhET Simulations"),
-    ("other/", "wikispecies_en_all_maxi", "Wikispecies Taxonomy"),
+    ("wikipedia/", "wikipedia_en_all_nopic_2025", "Wikipedia English (Text Only)", 1),
+    ("wikipedia/", "wikipedia_tr_all_maxi_2025", "Wikipedia Turkish (Full)", 1),
+    ("wikipedia/", "wikipedia_en_medicine_maxi", "WikiMed Medical", 1),
+    ("ifixit/", "ifixit_en_all_2025", "iFixit Repair", 1),
+    ("other/", "appropedia_en_all_maxi", "Appropedia Sustainability", 1),
+    ("wikivoyage/", "wikivoyage_en_all_maxi_2025", "Wikivoyage Global", 1),
+    ("other/", "openstreetmap-wiki_en_all_maxi", "OpenStreetMap Wiki", 1),
+    ("phet/", "phet_en_all", "PhET Simulations", 1),
+    ("other/", "wikispecies_en_all_maxi", "Wikispecies Taxonomy", 1),
     
     # 2. Engineering & Dev
-    ("stack_exchange/", "stackoverflow.com_en_all", "StackOverflow"),
-    ("stack_exchange/", "superuser.com_en_all", "SuperUser SysAdmin"),
-    ("stack_exchange/", "askubuntu.com_en_all", "AskUbuntu"),
-    ("other/", "mdn_en_all", "MDN Web Docs"),
-    ("other/", "archlinux_en_all", "ArchLinux Wiki"),
-    ("stack_exchange/", "raspberrypi.stackexchange.com_en_all", "Raspberry Pi Q&A"),
+    ("stack_exchange/", "stackoverflow.com_en_all", "StackOverflow", 2),
+    ("stack_exchange/", "superuser.com_en_all", "SuperUser SysAdmin", 2),
+    ("stack_exchange/", "askubuntu.com_en_all", "AskUbuntu", 2),
+    ("other/", "mdn_en_all", "MDN Web Docs", 2),
+    ("other/", "archlinux_en_all", "ArchLinux Wiki", 2),
+    ("stack_exchange/", "raspberrypi.stackexchange.com_en_all", "Raspberry Pi Q&A", 2),
     
     # 3. Dev Pack
-    ("other/", "python_en_docs", "Python Docs"),
-    ("other/", "rust_en_all", "Rust Docs"),
-    ("stack_exchange/", "devops.stackexchange.com_en_all", "Docker/DevOps"),
-    ("other/", "bash_en_all", "Bash Docs"),
-    ("other/", "git_en_all", "Git Docs"),
-    ("other/", "postgresql_en_all", "Postgres Docs"),
-    ("other/", "arduino_en_all", "Arduino Docs"),
-    ("stack_exchange/", "electronics.stackexchange.com_en_all", "Electronics Q&A"),
+    ("other/", "python_en_docs", "Python Docs", 3),
+    ("other/", "rust_en_all", "Rust Docs", 3),
+    ("stack_exchange/", "devops.stackexchange.com_en_all", "Docker/DevOps", 3),
+    ("other/", "bash_en_all", "Bash Docs", 3),
+    ("other/", "git_en_all", "Git Docs", 3),
+    ("other/", "postgresql_en_all", "Postgres Docs", 3),
+    ("other/", "arduino_en_all", "Arduino Docs", 3),
+    ("stack_exchange/", "electronics.stackexchange.com_en_all", "Electronics Q&A", 3),
     
     # 4. Education & Culture
-    ("gutenberg/", "gutenberg_en_all_2023", "Project Gutenberg (2023 Archive)"),
-    ("wikibooks/", "wikibooks_en_all_maxi", "Wikibooks"),
-    ("wikisource/", "wikisource_en_all_maxi", "Wikisource"),
-    ("wikipedia/", "wikipedia_en_top_maxi", "Wikipedia Top Articles (Images)"),
-    ("other/", "rationalwiki_en_all", "RationalWiki"),
-    ("ted/", "ted_en_playlists", "TED Talks"),
+    ("gutenberg/", "gutenberg_en_all_2023", "Project Gutenberg (2023 Archive)", 4),
+    ("wikibooks/", "wikibooks_en_all_maxi", "Wikibooks", 4),
+    ("wikisource/", "wikisource_en_all_maxi", "Wikisource", 4),
+    ("wikipedia/", "wikipedia_en_top_maxi", "Wikipedia Top Articles (Images)", 4),
+    ("other/", "rationalwiki_en_all", "RationalWiki", 4),
+    ("ted/", "ted_en_playlists", "TED Talks", 4),
 ]
 
-def find_latest_file(category, pattern):
-    url = urljoin(BASE_URL, category)
-    try:
-        r = requests.get(url, timeout=10)
-    except Exception as e:
-        print(f"[!] Error accessing {url}: {e}")
-        return None, 0
-
-    best_match = None
-    best_match_size = "?"
-    
-    try:
-        lines = r.text.splitlines()
-        for line in lines:
-            if pattern in line:
-                m = re.search(r'href="([^"]+)"', line)
-                if m:
-                    filename = m.group(1)
-                    if not filename.endswith(".zim"):
-                        continue
-                        
-                    s_m = re.search(r'</a>\s+[\d-]+\s+[\d:]+\s+([0-9.]+[GMK]?)', line)
-                    size_str = s_m.group(1) if s_m else "0M"
-                    
-                    if best_match is None or filename > best_match:
-                        best_match = filename
-                        best_match_size = size_str
-    except:
-        pass
-                        
-    if best_match:
-        return urljoin(url, best_match), best_match_size
+def find_latest_file(category, pattern, db=None):
+    # Answered from the local mirror catalog (see mirror_catalog.py)
+    if db is None:
+        db = mirror_catalog.connect()
+        mirror_catalog.refresh(db, BASE_URL, [category])
+    row = mirror_catalog.latest(db, pattern, category)
+    if row:
+        return mirror_catalog.file_url(row, BASE_URL), row["size_str"]
     return None, 0
 
 def parse_size_to_gb(size_str):
@@ -102,33 +79,18 @@ def parse_size_to_gb(size_str):
     except:
         return 0.0
 
-def verify_sha256(filepath, expected_hash):
-    print(f"    [*] Verifying SHA256 checksum for {os.path.basename(filepath)}...")
-    sha256_hash = hashlib.sha256()
-    file_size = os.path.getsize(filepath)
-    processed = 0
-    
-    with open(filepath, "rb") as f:
-        while True:
-            # Read in 16MB chunks for speed
-            chunk = f.read(16 * 1024 * 1024)
-            if not chunk:
-                break
-            sha256_hash.update(chunk)
-            processed += len(chunk)
-            
-            # Update progress bar
-            percent = (processed / file_size) * 100
-            bar_length = 40
-            filled_length = int(bar_length * processed // file_size)
-            bar = '=' * filled_length + '-' * (bar_length - filled_length)
-            sys.stdout.write(f'\r    [{bar}] {percent:.1f}%')
-            sys.stdout.flush()
-    
-    print() # New line after verify
-    
-    calculated = sha256_hash.hexdigest()
-    if calculated == expected_hash:
+def verify_sha256(filepath, expected_hash, digest=None):
+    # digest: already known (hashed during download); otherwise cached or computed
+    if digest is None:
+        cached = checksum_cache.lookup(filepath)
+        if cached:
+            print(f"    [*] Using cached SHA256 for {os.path.basename(filepath)}.")
+            digest = cached
+        else:
+            print(f"    [*] Verifying SHA256 checksum for {os.path.basename(filepath)}...")
+            digest = checksum_cache.sha256_file(filepath, progress=True)
+
+    if digest == expected_hash.lower():
         print("    [PASS] Integrity Verified.")
         return True
     else:
@@ -146,10 +108,57 @@ def get_remote_sha256(url):
         pass
     return None
 
+def find_previous_version(filename):
+    # Newest older copy of the same book anywhere under the library (ingest sorts into subfolders)
+    book, _, _, _, date = mirror_catalog.parse_name(filename)
+    best = None
+    for root, _, files in os.walk(LIBRARY_DIR):
+        for name in files:
+            other_book, _, _, _, other_date = mirror_catalog.parse_name(name)
+            if name.endswith(".zim") and other_book == book and other_date and date and other_date < date:
+                if best is None or other_date > best[0]:
+                    best = (other_date, os.path.join(root, name))
+    return best[1] if best else None
+
+def delta_update(url, previous, dest_path, expected_hash, args):
+    # zsync-style update from the previous version; False means fall back to a full download
+    try:
+        control = delta_sync.fetch_control(url)
+    except (requests.RequestException, ValueError) as e:
+        print(f"    [!] Delta control file unusable: {e}")
+        return False
+    if control is None:
+        print("    [*] No delta control file published, downloading in full.")
+        return False
+
+    reservations = download_scheduler.DiskReservations(INCOMING_DIR, int(args.reserve_gb * 1024 ** 3))
+    if not reservations.reserve(dest_path, control["length"]):
+        print("    [!] Not enough disk space for the delta update.")
+        return False
+    print(f"    [+] Delta update from {os.path.basename(previous)}...")
+    try:
+        digest, stats = delta_sync.sync(url, previous, dest_path, control, expected_hash, args.connections)
+    except (range_download.DownloadError, requests.RequestException, OSError) as e:
+        print(f"    [!] Delta update failed ({e}), downloading in full.")
+        return False
+    finally:
+        reservations.release(dest_path)
+    print(f"    [OK] Reused {stats['reused_bytes'] / 1024 ** 3:.2f} GB, fetched "
+          f"{stats['fetched_bytes'] / 1024 ** 3:.2f} GB; SHA256 {'verified' if expected_hash else 'from control file'}.")
+    return True
+
 def main():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--dry-run", action="store_true", help="Don't download, just list")
+    parser.add_argument("--connections", type=int, default=range_download.DEFAULT_CONNECTIONS,
+                        help="Parallel connections per file")
+    parser.add_argument("--jobs", type=int, default=download_scheduler.DEFAULT_JOBS, help="Files downloaded at once")
+    parser.add_argument("--bwlimit", type=float, default=0, help="Total bandwidth cap in MB/s (0 = unlimited)")
+    parser.add_argument("--reserve-gb", type=float, default=download_scheduler.DEFAULT_RESERVE_MARGIN / 1024 ** 3,
+                        help="Free space to always leave on the disk")
+    parser.add_argument("--delta", action="store_true",
+                        help="Update from the previous version in the library when a .zblocks file is published")
     args = parser.parse_args()
 
     print("=== Civilization Node: Manifest Downloader (Secure) ===")
@@ -158,10 +167,18 @@ def main():
         os.makedirs(INCOMING_DIR)
 
     total_gb = 0.0
+    jobs = []
+
+    # One parallel conditional fetch per distinct category; offline uses the cached catalog
+    print("[*] Refreshing mirror catalog...")
+    db = mirror_catalog.connect()
+    changed, unchanged, failed = mirror_catalog.refresh(db, BASE_URL, sorted({m[0] for m in MANIFEST}))
+    if failed:
+        print(f"    [!] {failed} listings unreachable, using cached entries.")
 
-    for category, pattern, description in MANIFEST:
+    for category, pattern, description, priority in MANIFEST:
         print(f"\n[*] Searching for: {description} ({pattern})...")
-        url, size_str = find_latest_file(category, pattern)
+        url, size_str = find_latest_file(category, pattern, db)
         
         if not url:
             print(f"    [!] NOT FOUND in {category}")
@@ -178,9 +195,6 @@ def main():
         if args.dry_run:
             continue
             
-        # ... (Download logic omitted for dry run focus, but strictly needs to remain for real run)
-        # I am rewriting the whole file, so I need to put the download logic back in!
-        
         dest_path = os.path.join(INCOMING_DIR, filename)
         lib_path = os.path.join(LIBRARY_DIR, filename)
 
@@ -191,8 +205,6 @@ def main():
         expected_hash = get_remote_sha256(url)
         if not expected_hash:
             print("    [!] WARNING: No remote SHA256 found.")
-            # Verify if user wants to strict fail here? 
-            # For now, let's proceed but warn.
             
         if os.path.exists(dest_path):
              print(f"    [!] File exists in incoming. Verifying...")
@@ -201,18 +213,23 @@ def main():
                  continue
              else:
                  print("    [!] Checksum failed/missing. Re-downloading...")
+                 checksum_cache.forget(dest_path)
                  os.remove(dest_path)
 
-        print(f"    [+] Downloading to {INCOMING_DIR}...")
-        try:
-            subprocess.run(["wget", "-c", "--show-progress", "-O", dest_path, url], check=True)
-            if expected_hash:
-                if not verify_sha256(dest_path, expected_hash):
-                    print("    [!!!] CORRUPTION DETECTED. DELETING.")
-                    os.remove(dest_path)
-                    sys.exit(1)
-        except Exception as e:
-            print(f"    [!] Failed: {e}")
+        if args.delta:
+            previous = find_previous_version(filename)
+            if previous and delta_update(url, previous, dest_path, expected_hash, args):
+                continue
+
+        jobs.append(download_scheduler.Job(filename, url, dest_path, priority, expected_hash))
+
+    if jobs:
+        print(f"\n[+] Downloading {len(jobs)} files to {INCOMING_DIR} ({args.jobs} at a time"
+              f"{f', capped at {args.bwlimit} MB/s' if args.bwlimit else ''})...")
+        done = download_scheduler.run(jobs, INCOMING_DIR, workers=args.jobs, bandwidth=args.bwlimit * 1024 * 1024,
+                                      margin=int(args.reserve_gb * 1024 ** 3), connections=args.connections)
+        ok = sum(1 for job in done if job.status == "done")
+        print(f"[*] {ok}/{len(done)} downloads completed.")
 
     print("-" * 40)
     print(f"TOTAL MANIFEST SIZE: {total_gb:.2f} GB")
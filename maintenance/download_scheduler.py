@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Download scheduler: several files at once, one global bandwidth cap, and disk space
+reserved before each download starts.
+
+Reservations live in `<incoming>/.reservations.json` and are updated under an flock,
+so concurrent downloads (and concurrent scripts) cannot all pass the same free-space
+check. Each reservation counts only the bytes its `.part` file has not yet allocated,
+so in-progress downloads are not double counted against statvfs.
+
+Jobs run in priority order (lower number first). A job that does not fit waits until a
+running job finishes; if nothing is running and it still does not fit, it is skipped.
+
+Usage:
+    python3 maintenance/download_scheduler.py --dir /opt/civilization/incoming --jobs 3 --bwlimit 20 URL...
+"""
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import checksum_cache
+import range_download
+
+DEFAULT_JOBS = 2
+DEFAULT_RESERVE_MARGIN = 5 * 1024 ** 3  # always leave this much free
+RESERVATIONS_FILE = ".reservations.json"
+
+class TokenBucket:
+    """Bandwidth limiter shared by every connection of every download (bytes/second)."""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # Go into debt and sleep it off, so large chunks are not starved
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+def _allocated(path):
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return 0
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class DiskReservations:
+    """Cross-process disk space reservations for one download directory."""
+
+    def __init__(self, directory, margin=DEFAULT_RESERVE_MARGIN):
+        self.directory = directory
+        self.margin = margin
+        self.path = os.path.join(directory, RESERVATIONS_FILE)
+        self.lock_path = self.path + ".lock"
+
+    def _locked(self, update):
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path) as f:
+                        entries = json.load(f)
+                except (OSError, ValueError):
+                    entries = {}
+                # Drop reservations of processes that died without releasing
+                entries = {k: v for k, v in entries.items() if _pid_alive(v["pid"])}
+                result = update(entries)
+                tmp = self.path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp, self.path)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def outstanding(self, entries):
+        # Bytes promised but not yet allocated on disk
+        return sum(max(0, e["size"] - _allocated(e["part"])) for e in entries.values())
+
+    def available(self):
+        s = os.statvfs(self.directory)
+        free = s.f_bavail * s.f_frsize
+        return self._locked(lambda entries: free - self.outstanding(entries) - self.margin)
+
+    def reserve(self, dest, size):
+        """Reserve space for `dest` (final path); False if it does not fit right now."""
+        def update(entries):
+            s = os.statvfs(self.directory)
+            free = s.f_bavail * s.f_frsize
+            need = max(0, size - _allocated(dest + ".part"))
+            if need > free - self.outstanding(entries) - self.margin:
+                return False
+            entries[dest] = {"size": size, "part": dest + ".part", "pid": os.getpid()}
+            return True
+        return self._locked(update)
+
+    def release(self, dest):
+        self._locked(lambda entries: entries.pop(dest, None))
+
+class Job:
+    def __init__(self, name, url, dest, priority=0, expected_sha256=None):
+        self.name = name
+        self.url = url
+        self.dest = dest
+        self.priority = priority
+        self.expected_sha256 = expected_sha256
+        self.info = None
+        self.size = 0
+        self.done = 0
+        self.status = "queued"  # queued, running, done, failed, skipped
+        self.error = None
+
+class _BatchProgress:
+    def __init__(self, jobs, enabled=True):
+        self.jobs = jobs
+        self.start = time.monotonic()
+        self.resumed = 0  # bytes found on disk, excluded from the rate
+        self.lock = threading.Lock()
+        self.enabled = enabled
+        self.stop = threading.Event()
+
+    def counter(self, job):
+        def add(n, resumed=False):
+            with self.lock:
+                job.done += n
+                if resumed:
+                    self.resumed += n
+        return add
+
+    def line(self):
+        with self.lock:
+            done = sum(j.done for j in self.jobs)
+            total = sum(j.size for j in self.jobs if j.status != "skipped") or 1
+            running = [j.name for j in self.jobs if j.status == "running"]
+            finished = sum(1 for j in self.jobs if j.status in ("done", "failed", "skipped"))
+            resumed = self.resumed
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        rate = max(done - resumed, 0) / elapsed
+        eta = (total - done) / rate if rate > 0 else 0
+        filled = int(30 * min(done, total) // total)
+        bar = "=" * filled + "-" * (30 - filled)
+        return (f"[{bar}] {done * 100.0 / total:5.1f}% {finished}/{len(self.jobs)} files "
+                f"{rate / 1048576:6.1f} MB/s ETA {int(eta) // 3600:d}h{int(eta) % 3600 // 60:02d}m "
+                f"| {', '.join(running)[:60]}")
+
+    def run(self):
+        while not self.stop.wait(1.0):
+            if self.enabled:
+                sys.stdout.write("\r" + self.line().ljust(130))
+                sys.stdout.flush()
+
+def _run_job(job, batch, reservations, limiter, connections):
+    try:
+        digest = range_download.download(job.url, job.dest, connections=connections,
+                                         progress=batch.counter(job), limiter=limiter, info=job.info)
+        if job.expected_sha256 and digest != job.expected_sha256.lower():
+            checksum_cache.forget(job.dest)
+            os.remove(job.dest)
+            raise range_download.DownloadError("checksum mismatch (file deleted)")
+        job.status = "done"
+    except Exception as e:
+        job.status = "failed"
+        job.error = e
+    finally:
+        reservations.release(job.dest)
+
+def run(jobs, directory, workers=DEFAULT_JOBS, bandwidth=0, margin=DEFAULT_RESERVE_MARGIN,
+        connections=range_download.DEFAULT_CONNECTIONS, progress=True):
+    """
+    Download `jobs` into `directory`. bandwidth: total bytes/second cap (0 = unlimited).
+    Returns the jobs with status/error filled in.
+    """
+    jobs = sorted(jobs, key=lambda j: j.priority)  # stable: manifest order within a tier
+
+    def probe(job):
+        # Exact sizes for the reservations (and one less HEAD per download)
+        try:
+            job.info = range_download.probe(job.url)
+            job.size = max(job.info["size"], 0)
+        except Exception as e:
+            job.status, job.error = "failed", e
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(probe, jobs))
+
+    reservations = DiskReservations(directory, margin)
+    limiter = TokenBucket(bandwidth) if bandwidth else None
+    batch = _BatchProgress(jobs, progress)
+    printer = threading.Thread(target=batch.run, daemon=True)
+    printer.start()
+
+    threads = {}
+    pending = [j for j in jobs if j.status == "queued"]
+    try:
+        while pending or threads:
+            # Start as many as fit, highest priority first
+            for job in list(pending):
+                if len(threads) >= workers:
+                    break
+                if reservations.reserve(job.dest, job.size):
+                    pending.remove(job)
+                    job.status = "running"
+                    t = threading.Thread(target=_run_job, args=(job, batch, reservations, limiter, connections),
+                                         daemon=True)
+                    threads[job] = t
+                    t.start()
+                elif not threads:
+                    # Nothing running will free space: this one cannot ever fit
+                    pending.remove(job)
+                    job.status = "skipped"
+                    job.error = f"not enough disk space for {job.size / 1024 ** 3:.2f} GB"
+                else:
+                    # Strict priority: wait for space rather than let lower tiers jump ahead
+                    break
+            for job, t in list(threads.items()):
+                if not t.is_alive():
+                    del threads[job]
+                    if progress:
+                        state = "[OK]" if job.status == "done" else f"[!] {job.status}: {job.error}"
+                        sys.stdout.write("\r" + " " * 130 + f"\r    {state} {job.name}\n")
+            time.sleep(0.2)
+    finally:
+        batch.stop.set()
+        printer.join()
+        for job in threads:
+            reservations.release(job.dest)
+    if progress:
+        print("\r" + batch.line().ljust(130))
+    return jobs
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Download several files under a bandwidth cap")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--dir", required=True, help="Destination directory")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS)
+    parser.add_argument("--bwlimit", type=float, default=0, help="Total MB/s (0 = unlimited)")
+    parser.add_argument("--reserve-gb", type=float, default=DEFAULT_RESERVE_MARGIN / 1024 ** 3)
+    parser.add_argument("-c", "--connections", type=int, default=range_download.DEFAULT_CONNECTIONS)
+    args = parser.parse_args()
+
+    jobs = [Job(url.rsplit("/", 1)[-1], url, os.path.join(args.dir, url.rsplit("/", 1)[-1]), priority=i)
+            for i, url in enumerate(args.urls)]
+    done = run(jobs, args.dir, args.jobs, args.bwlimit * 1024 * 1024, int(args.reserve_gb * 1024 ** 3),
+               args.connections)
+    failed = [j for j in done if j.status != "done"]
+    for job in failed:
+        print(f"[!] {job.name}: {job.status} ({job.error})")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Maintains library/zims/library.xml for `kiwix-serve --library --monitorLibrary`.
+
+kiwix-serve watches the file and picks up changes without a restart, so content goes
+live with no outage and every other archive stays open and warm. Each `sync`:
+
+  * stats every ZIM under the library and reads metadata (zim_ingest's few-KB header
+    reader) only for new or changed files; everything else comes from the state file;
+  * lists only the newest version of each book (same Name + Flavour), so a new
+    version replaces the old one in a single atomic rename of library.xml and the two
+    are never served side by side;
+  * warms the pointer tables of newly listed archives into the page cache first;
+  * moves superseded files to $CIV_ROOT/retired/ once they have been out of the
+    library for the drain period, so queries that were already running on them finish.
+
+Usage:
+    python3 maintenance/kiwix_library.py sync [--drain 600] [--purge]
+    python3 maintenance/kiwix_library.py list
+"""
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+import mirror_catalog
+import zim_ingest
+
+CIV_ROOT = os.getenv("CIV_ROOT", "/opt/civilization")
+LIBRARY_DIR = zim_ingest.LIBRARY_DIR
+LIBRARY_XML = "library.xml"
+STATE_FILE = ".library_state.json"
+RETIRED_DIR = os.path.join(CIV_ROOT, "retired")
+DRAIN_SECONDS = 600  # longest a running query may keep using a superseded archive
+
+def _load_state(library):
+    try:
+        with open(os.path.join(library, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"archives": {}, "retiring": {}}
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def scan(library, known):
+    """{relative path: archive record} for every readable ZIM; unchanged files are not reopened.
+
+    A known file that can no longer be read keeps its last good record, so a bad copy
+    or a file being replaced in place does not drop a book from the library.
+    """
+    archives = {}
+    for root, dirs, files in os.walk(library):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if not name.endswith(".zim") or name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, library)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            old = known.get(rel)
+            if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                archives[rel] = old
+                continue
+            try:
+                zim = zim_ingest.read_zim(path)
+            except zim_ingest.MissingDecoder as e:
+                # This host's problem, not the file's: never publish a library without it
+                raise zim_ingest.MissingDecoder(f"{rel}: {e}") from None
+            except (zim_ingest.ZimError, OSError) as e:
+                if old:
+                    print(f"    [!] Cannot re-read {rel} ({e}), keeping its last good record")
+                    archives[rel] = old
+                else:
+                    print(f"    [!] Skipping {rel}: {e}")
+                continue
+            archives[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "uuid": zim["uuid"],
+                             "url_ptr": zim["url_ptr"], "cluster_ptr": zim["cluster_ptr"],
+                             "entries": zim["entries"], "clusters": zim["clusters"],
+                             "metadata": zim["metadata"]}
+    return archives
+
+def book_key(rel, record):
+    meta = record["metadata"]
+    if meta.get("Name"):
+        return f"{meta['Name']}|{meta.get('Flavour', '')}"
+    return mirror_catalog.parse_name(os.path.basename(rel))[0]
+
+def newest_versions(archives):
+    """{book key: relative path} of the newest archive of each book (Date, then mtime)."""
+    best = {}
+    for rel, record in archives.items():
+        key = book_key(rel, record)
+        rank = (record["metadata"].get("Date", ""), record["mtime_ns"])
+        if key not in best or rank > best[key][0]:
+            best[key] = (rank, rel)
+    return {key: rel for key, (_, rel) in best.items()}
+
+def warm(path, record):
+    # Directory and cluster pointer tables are touched by every lookup: prefetch them
+    # so the first queries against a new archive do not pay for cold seeks
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, record["url_ptr"], 8 * record["entries"], os.POSIX_FADV_WILLNEED)
+        os.posix_fadvise(fd, record["cluster_ptr"], 8 * record["clusters"], os.POSIX_FADV_WILLNEED)
+    except (OSError, AttributeError):
+        pass
+    finally:
+        os.close(fd)
+
+def render(archives, listed):
+    root = ET.Element("library", version="20110515")
+    for rel in sorted(listed):
+        record = archives[rel]
+        meta = record["metadata"]
+        ET.SubElement(root, "book", {
+            "id": str(uuid.UUID(record["uuid"])),
+            "path": rel,
+            "title": meta.get("Title", ""),
+            "description": meta.get("Description", ""),
+            "language": meta.get("Language", ""),
+            "creator": meta.get("Creator", ""),
+            "publisher": meta.get("Publisher", ""),
+            "name": meta.get("Name", ""),
+            "flavour": meta.get("Flavour", ""),
+            "tags": meta.get("Tags", ""),
+            "date": meta.get("Date", ""),
+            "size": str(record["size"] // 1024),
+        })
+    ET.indent(root)
+    return b'<?xml version="1.0" encoding="UTF-8" ?>\n' + ET.tostring(root, encoding="utf-8") + b"\n"
+
+def listed_paths(library):
+    """Relative paths currently in library.xml (empty if there is none yet)."""
+    try:
+        return {b.get("path") for b in ET.parse(os.path.join(library, LIBRARY_XML)).getroot().iter("book")}
+    except (OSError, ET.ParseError):
+        return set()
+
+def retire(library, rel, purge):
+    path = os.path.join(library, rel)
+    if not os.path.exists(path):
+        return
+    if purge:
+        os.remove(path)
+        print(f"    [-] Deleted {rel}")
+        return
+    dest = os.path.join(RETIRED_DIR, rel)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.move(path, dest)
+    print(f"    [-] Retired {rel} -> {dest}")
+
+def sync(library=LIBRARY_DIR, drain=DRAIN_SECONDS, purge=False):
+    """Bring library.xml in line with the files on disk. Returns (added, removed, retired).
+
+    Raises zim_ingest.MissingDecoder, before anything is written, if an archive cannot be
+    read on this host for lack of zstandard/libzim.
+    """
+    state = _load_state(library)
+    archives = scan(library, state["archives"])
+    listed = set(newest_versions(archives).values())
+    before = listed_paths(library)
+
+    added = listed - before
+    for rel in sorted(added):
+        warm(os.path.join(library, rel), archives[rel])
+
+    xml_path = os.path.join(library, LIBRARY_XML)
+    data = render(archives, listed)
+    try:
+        with open(xml_path, "rb") as f:
+            unchanged = f.read() == data
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        # One rename: kiwix-serve sees either the old set or the new set, never both versions
+        _write_atomic(xml_path, data)
+
+    # Superseded archives stay on disk until in-flight queries have drained
+    now = time.time()
+    retiring = {rel: since for rel, since in state["retiring"].items() if rel in archives and rel not in listed}
+    for rel in archives:
+        if rel not in listed and rel not in retiring:
+            retiring[rel] = now
+    retired = []
+    for rel, since in sorted(retiring.items()):
+        if now - since >= drain:
+            try:
+                retire(library, rel, purge)
+            except OSError as e:
+                print(f"    [!] Could not retire {rel}: {e}")
+                continue
+            retired.append(rel)
+            del retiring[rel]
+            archives.pop(rel, None)
+
+    state = {"archives": archives, "retiring": retiring}
+    _write_atomic(os.path.join(library, STATE_FILE), json.dumps(state).encode())
+    return sorted(added), sorted(before - listed), retired
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Keep kiwix-serve's library.xml in sync with the ZIM folder")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("sync")
+    p.add_argument("--library", default=LIBRARY_DIR)
+    p.add_argument("--drain", type=int, default=DRAIN_SECONDS,
+                   help="Seconds a superseded archive stays on disk after leaving the library")
+    p.add_argument("--purge", action="store_true", help="Delete drained archives instead of moving them to retired/")
+    p = sub.add_parser("list")
+    p.add_argument("--library", default=LIBRARY_DIR)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.library):
+        print(f"[!] {args.library} does not exist.")
+        sys.exit(1)
+
+    if args.cmd == "list":
+        state = _load_state(args.library)
+        listed = listed_paths(args.library)
+        for rel in sorted(listed):
+            title = state["archives"].get(rel, {}).get("metadata", {}).get("Title", "")
+            print(f"    [LIVE]     {rel:<60} {title}")
+        for rel, since in sorted(state["retiring"].items()):
+            print(f"    [DRAINING] {rel:<60} superseded {int(time.time() - since)}s ago")
+        return
+
+    try:
+        added, removed, retired = sync(args.library, args.drain, args.purge)
+    except zim_ingest.MissingDecoder as e:
+        print(f"[!] {e}. library.xml left unchanged; run: pip install -r requirements.txt")
+        sys.exit(1)
+    for rel in added:
+        print(f"    [+] {rel}")
+    for rel in removed:
+        print(f"    [-] {rel}")
+    print(f"[OK] library.xml: {len(listed_paths(args.library))} books, {len(added)} added, "
+          f"{len(removed)} removed, {len(retired)} retired.")
+
+if __name__ == "__main__":
+    main()
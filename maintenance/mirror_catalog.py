@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Local SQLite catalog of every ZIM on the Kiwix mirror.
+
+`refresh()` walks the mirror root and every category listing in parallel with
+conditional GETs (ETag / Last-Modified), so unchanged categories cost one 304 each.
+Files are stored with their parsed name parts (project, language, flavour, date) and
+an FTS5 index, so browsing, fuzzy search, "latest version of X" and budget totals are
+local queries that keep working offline.
+
+Usage:
+    python3 maintenance/mirror_catalog.py refresh
+    python3 maintenance/mirror_catalog.py search "wiki med"
+    python3 maintenance/mirror_catalog.py latest wikipedia_en_all_nopic
+    python3 maintenance/mirror_catalog.py budget wikipedia_en_all_nopic stackoverflow.com_en_all
+"""
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+
+CIV_ROOT = os.getenv("CIV_ROOT", "/opt/civilization")
+DB_PATH = os.getenv("CIV_MIRROR_DB", os.path.join(CIV_ROOT, "cache", "mirror_catalog.db"))
+BASE_URL = "https://download.kiwix.org/zim/"
+ROOT = ""  # validators key for the mirror root listing
+FETCH_WORKERS = 8
+TIMEOUT = 10
+
+# project_lang_flavour_YYYY-MM.zim, e.g. stackoverflow.com_en_all_2025-10.zim
+NAME_RE = re.compile(r'^(?P<project>[^_]+)_(?P<lang>[a-z]{2,3}(?:-[a-z]+)?)_(?:(?P<flavour>.+?)_)?(?P<date>\d{4}-\d{2})\.zim$')
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+# <a href="file.zim">file.zim</a>            2026-01-06 23:51   40M
+LISTING_RE = re.compile(r'<a href="([^"/?]+\.zim)">[^<]*</a>\s+([\d-]+)\s+([\d:]+)\s+([0-9.]+[GMK]?)')
+DIR_RE = re.compile(r'<a href="([^"/?.][^"/?]*/)">')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    category TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fetched REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT, category TEXT, book TEXT, project TEXT, language TEXT,
+    flavour TEXT, date TEXT, modified TEXT, size_str TEXT, size_bytes INTEGER,
+    UNIQUE(category, name)
+);
+CREATE INDEX IF NOT EXISTS files_book ON files(book, date);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+    name, project, language, flavour, category, content='files', content_rowid='id',
+    tokenize="unicode61 tokenchars '.-'"
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts(rowid, name, project, language, flavour, category)
+    VALUES (new.id, new.name, new.project, new.language, new.flavour, new.category);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts(files_fts, rowid, name, project, language, flavour, category)
+    VALUES ('delete', old.id, old.name, old.project, old.language, old.flavour, old.category);
+END;
+"""
+
+def parse_listing(html):
+    """All .zim rows of an Apache-style index page: [(filename, 'YYYY-MM-DD HH:MM', size_str)]."""
+    return [(m.group(1), f"{m.group(2)} {m.group(3)}", m.group(4)) for m in LISTING_RE.finditer(html)]
+
+def parse_directories(html):
+    """Subdirectory links of an index page (parent and sort links excluded)."""
+    return sorted(set(DIR_RE.findall(html)))
+
+def fetch_pages(categories, base_url=BASE_URL, validators=None, workers=FETCH_WORKERS, session=None):
+    """
+    Fetch each distinct category page once, concurrently, optionally conditional.
+    validators: {category: (etag, last_modified)} from a previous fetch.
+    Returns {category: (status, etag, last_modified, html)}; status None on network errors,
+    304 (html None) when the page is unchanged.
+    """
+    unique = list(dict.fromkeys(categories))
+    validators = validators or {}
+    s = session or requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+
+    def fetch(category):
+        url = urljoin(base_url, category)
+        etag, last_modified = validators.get(category) or (None, None)
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        try:
+            r = s.get(url, headers=headers, timeout=TIMEOUT)
+            if r.status_code == 304:
+                return category, (304, etag, last_modified, None)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            print(f"[!] Error accessing {url}: {e}")
+            return category, (None, None, None, None)
+        return category, (r.status_code, r.headers.get("ETag"), r.headers.get("Last-Modified"), r.text)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(unique) or 1))) as pool:
+        return dict(pool.map(fetch, unique))
+
+def size_to_bytes(size_str):
+    s = (size_str or "").strip().upper()
+    try:
+        if s and s[-1] in SIZE_UNITS:
+            return int(float(s[:-1]) * SIZE_UNITS[s[-1]])
+        return int(float(s))
+    except ValueError:
+        return 0
+
+def parse_name(filename):
+    """(book, project, language, flavour, date) from a Kiwix file name; best effort."""
+    m = NAME_RE.match(filename)
+    if not m:
+        stem = filename[:-4] if filename.endswith(".zim") else filename
+        return stem, stem.split("_")[0], None, None, None
+    book = filename[:m.start("date") - 1]
+    return book, m.group("project"), m.group("lang"), m.group("flavour"), m.group("date")
+
+def connect(path=None):
+    path = path or DB_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path, timeout=30)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+    return db
+
+def _store_category(db, category, rows):
+    # Replace the category's rows; the FTS index follows through the triggers
+    db.execute("DELETE FROM files WHERE category=?", (category,))
+    db.executemany(
+        "INSERT OR REPLACE INTO files (name, category, book, project, language, flavour, date, modified, size_str, size_bytes)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(name, category, *parse_name(name), modified, size_str, size_to_bytes(size_str))
+         for name, modified, size_str in rows],
+    )
+
+def refresh(db=None, base_url=BASE_URL, categories=None):
+    """
+    Incrementally sync the catalog with the mirror. Returns (changed, unchanged, failed)
+    category counts. On network failure the existing catalog is left as is.
+    """
+    db = db or connect()
+    validators = {r["category"]: (r["etag"], r["last_modified"]) for r in db.execute("SELECT * FROM listings")}
+
+    if categories is None:
+        root = fetch_pages([ROOT], base_url, validators)[ROOT]
+        status, etag, last_modified, html = root
+        if status is None:
+            return 0, 0, 1
+        if html is not None:
+            categories = parse_directories(html)
+            with db:
+                db.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)", (ROOT, etag, last_modified, time.time()))
+                # Categories that disappeared from the mirror
+                known = [r[0] for r in db.execute("SELECT category FROM listings WHERE category != ?", (ROOT,))]
+                for gone in set(known) - set(categories):
+                    db.execute("DELETE FROM files WHERE category=?", (gone,))
+                    db.execute("DELETE FROM listings WHERE category=?", (gone,))
+        else:
+            categories = [c for c in validators if c != ROOT]
+
+    changed = unchanged = failed = 0
+    pages = fetch_pages(categories, base_url, validators)
+    with db:
+        for category, (status, etag, last_modified, html) in pages.items():
+            if status is None:
+                failed += 1
+            elif html is None:
+                unchanged += 1
+            else:
+                _store_category(db, category, parse_listing(html))
+                db.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)",
+                           (category, etag, last_modified, time.time()))
+                changed += 1
+    return changed, unchanged, failed
+
+def file_url(row, base_url=BASE_URL):
+    return urljoin(urljoin(base_url, row["category"]), row["name"])
+
+def categories(db):
+    return db.execute(
+        "SELECT category, COUNT(*) AS files, SUM(size_bytes) AS bytes FROM files GROUP BY category ORDER BY category"
+    ).fetchall()
+
+def browse(db, category):
+    return db.execute("SELECT * FROM files WHERE category=? ORDER BY name", (category,)).fetchall()
+
+def _fts_query(text):
+    # Every word as a prefix term: "wiki med" -> "wiki"* "med"*
+    words = re.findall(r"[\w.\-]+", text.lower())
+    return " ".join(f'"{w}"*' for w in words)
+
+def search(db, text, category=None, language=None, latest_only=False, limit=50):
+    """Fuzzy (prefix, any order) search over name/project/language/flavour/category."""
+    match = _fts_query(text)
+    if not match:
+        return []
+    # The same filters apply to the FTS query and the substring fallback
+    where, where_args = "", []
+    if category:
+        where += " AND f.category = ?"
+        where_args.append(category)
+    if language:
+        where += " AND f.language = ?"
+        where_args.append(language)
+    if latest_only:
+        where += " AND f.date = (SELECT MAX(date) FROM files g WHERE g.book = f.book)"
+    sql = ("SELECT f.* FROM files_fts JOIN files f ON f.id = files_fts.rowid"
+           " WHERE files_fts MATCH ?" + where + " ORDER BY bm25(files_fts), f.date DESC LIMIT ?")
+    rows = db.execute(sql, [match] + where_args + [limit]).fetchall()
+    if rows:
+        return rows
+    # Substring fallback for fragments FTS tokens do not cover (e.g. middle of a word)
+    sql = "SELECT f.* FROM files f WHERE f.name LIKE ?" + where + " ORDER BY f.name DESC LIMIT ?"
+    return db.execute(sql, [f"%{text}%"] + where_args + [limit]).fetchall()
+
+def latest(db, pattern, category=None):
+    """Newest file (by name date, then name) whose name contains `pattern`."""
+    sql = "SELECT * FROM files WHERE instr(name, ?) > 0"
+    args = [pattern]
+    if category:
+        sql += " AND category = ?"
+        args.append(category)
+    return db.execute(sql + " ORDER BY date DESC, name DESC LIMIT 1", args).fetchone()
+
+def budget(db, patterns):
+    """Latest file for each pattern and the total size: ([(pattern, row or None)], total_bytes)."""
+    picks = [(p, latest(db, p)) for p in patterns]
+    return picks, sum(row["size_bytes"] for _, row in picks if row)
+
+def last_refresh(db):
+    row = db.execute("SELECT MAX(fetched) FROM listings").fetchone()
+    return row[0] if row else None
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Local catalog of the Kiwix mirror")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("refresh")
+    sub.add_parser("stats")
+    p = sub.add_parser("search")
+    p.add_argument("text")
+    p.add_argument("--category")
+    p.add_argument("--lang")
+    p.add_argument("--latest", action="store_true", help="Only the newest date of each book")
+    p = sub.add_parser("latest")
+    p.add_argument("pattern")
+    p = sub.add_parser("budget")
+    p.add_argument("patterns", nargs="+")
+    args = parser.parse_args()
+
+    db = connect()
+    if args.cmd == "refresh":
+        start = time.monotonic()
+        changed, unchanged, failed = refresh(db)
+        print(f"[OK] {changed} categories updated, {unchanged} unchanged, {failed} failed "
+              f"({time.monotonic() - start:.1f}s)")
+        sys.exit(1 if failed and not (changed or unchanged) else 0)
+    if args.cmd == "stats":
+        for row in categories(db):
+            print(f"{row['category']:<25} {row['files']:>6} files {row['bytes'] / 1024 ** 3:>10.1f} GB")
+        ts = last_refresh(db)
+        print(f"Last refresh: {time.strftime('%Y-%m-%d %H:%M', time.localtime(ts)) if ts else 'never'}")
+    elif args.cmd == "search":
+        for row in search(db, args.text, args.category, args.lang, args.latest):
+            print(f"{row['category'] + row['name']:<70} {row['size_str']:>8}")
+    elif args.cmd == "latest":
+        row = latest(db, args.pattern)
+        if not row:
+            print(f"[!] No match for {args.pattern}")
+            sys.exit(1)
+        print(f"{file_url(row)}  {row['size_str']}")
+    elif args.cmd == "budget":
+        picks, total = budget(db, args.patterns)
+        for pattern, row in picks:
+            print(f"{pattern:<40} | {row['name'] if row else 'Not Found':<50} | {row['size_str'] if row else '-':>8}")
+        print(f"TOTAL: {total / 1024 ** 3:.2f} GB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Unattended batch ingest of the PDF library ($CIV_ROOT/library/pdfs, as civ_ingest.sh files
+it) into a passage index the Kiwix tool searches with context "pdfs". Replaces uploading
+PDFs through Open WebUI a handful at a time.
+
+    1. Every PDF is hashed (checksum_cache: unchanged files are not read again).
+    2. PDFs whose digest is not in the cache are extracted in a process pool (pdftotext
+       when poppler-utils is installed, pypdf otherwise), one page at a time. Pages are
+       normalised: ligatures and hyphenated line breaks are repaired, headers, footers
+       and page numbers that repeat across pages are dropped. Each page is then split
+       into passages exactly as the tool splits articles. The result is cached by
+       content digest, so re-runs only process new or changed files, and a renamed or
+       copied PDF is free.
+    3. Passages without a cached vector go to the embedder (Ollama /api/embed) in batches
+       of EMBED_BATCH, EMBED_JOBS requests in flight. The queue between extraction and
+       embedding is bounded: when the embedder falls behind, extraction waits instead of
+       piling up text in memory. Vectors are cached by passage text hash, so an
+       interrupted run resumes where it stopped.
+    4. The index is written in semantic_index.py's format to
+       $CIV_ROOT/index/semantic/pdf_library (vectors, chunks.db, IVF lists), built
+       beside the live one and swapped in, and skipped when no PDF changed.
+
+Usage:
+    python3 maintenance/pdf_ingest.py                        # whole library
+    python3 maintenance/pdf_ingest.py --jobs 8 --embed-jobs 4 --batch 256
+    python3 maintenance/pdf_ingest.py --status
+"""
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+
+import checksum_cache
+import semantic_index
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kiwix_tool  # noqa: E402  (same passage splitting and index location as query time)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+CIV_ROOT = os.getenv("CIV_ROOT", "/opt/civilization")
+PDF_DIR = os.path.join(CIV_ROOT, "library", "pdfs")
+INDEX_DIR = semantic_index.INDEX_DIR
+CACHE_DB = os.path.join(CIV_ROOT, "cache", "pdf_ingest.db")
+
+JOBS = os.cpu_count() or 1        # extraction processes
+EMBED_BATCH = 128                 # passages per /api/embed request
+EMBED_JOBS = 2                    # requests in flight
+QUEUE_BATCHES = 4                 # batches waiting for the embedder before extraction pauses
+TASKS_PER_CHILD = 20              # recycle extraction processes (PDF parsers leak on odd files)
+EXTRACT_TIMEOUT = 300             # seconds per PDF for pdftotext
+FLUSH_CHUNKS = 4096               # index rows written per batch
+HASH_JOBS = 4
+
+REPEAT_SHARE = 0.5                # a top/bottom line on this share of pages is a header/footer
+REPEAT_MIN_PAGES = 4
+EDGE_LINES = 2                    # lines at the top and bottom of a page checked for repeats
+NUMBERED_EDGE_CHARS = 40          # up to this length, lines differing only in numbers also repeat
+_PAGE_NUMBER_RE = re.compile(r'^\s*(page\s*)?\d+(\s*(of|/)\s*\d+)?\s*$', re.IGNORECASE)
+_HYPHEN_BREAK_RE = re.compile(r'(\w)-\n\s*(\w)')
+_HYPHEN_END_RE = re.compile(r'\w-\s*$')
+_DIGITS_RE = re.compile(r'\d+')
+_CONTROL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def extract_pages(path):
+    """(method, [page text]) from pdftotext when installed, else pypdf."""
+    failure = None
+    if shutil.which("pdftotext"):
+        out = subprocess.run(["pdftotext", "-enc", "UTF-8", "-eol", "unix", path, "-"],
+                             capture_output=True, timeout=EXTRACT_TIMEOUT)
+        if out.returncode == 0:
+            pages = out.stdout.decode("utf-8", errors="replace").split("\f")
+            return "pdftotext", pages[:-1] if pages and not pages[-1].strip() else pages
+        stderr = " ".join(out.stderr.decode("utf-8", errors="replace").split())
+        failure = f"pdftotext exited with {out.returncode}: {stderr[:300] or 'no message'}"
+    if PdfReader is None:
+        raise RuntimeError(failure or "no PDF text extractor (apt install poppler-utils, or pip install pypdf)")
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        reader.decrypt("")
+    return "pypdf", [page.extract_text() or "" for page in reader.pages]
+
+def _edge_key(line):
+    # "Page 3 of 40" and "Page 4 of 40" are the same footer; longer lines must repeat verbatim
+    line = line.strip().lower()
+    return _DIGITS_RE.sub("#", line) if len(line) <= NUMBERED_EDGE_CHARS else line
+
+def normalize_pages(pages):
+    """Clean page texts: repeated headers/footers and page numbers removed, lines re-flowed."""
+    split = []
+    for text in pages:
+        text = unicodedata.normalize("NFKC", _CONTROL_RE.sub(" ", text))
+        split.append([line for line in text.split("\n")])
+
+    repeated = set()
+    if len(split) >= REPEAT_MIN_PAGES:
+        counts = {}
+        for lines in split:
+            content = [l for l in lines if l.strip()]
+            for key in {_edge_key(l) for l in content[:EDGE_LINES] + content[-EDGE_LINES:]}:
+                counts[key] = counts.get(key, 0) + 1
+        repeated = {k for k, n in counts.items() if n >= REPEAT_SHARE * len(split)}
+
+    cleaned = []
+    for lines in split:
+        content = [i for i, l in enumerate(lines) if l.strip()]
+        edges = set(content[:EDGE_LINES] + content[-EDGE_LINES:])
+        # The end of a word hyphenated on the line above is body text, however often it repeats
+        edges -= {i for prev, i in zip(content, content[1:])
+                  if _HYPHEN_END_RE.search(lines[prev]) and lines[i].lstrip()[:1].islower()}
+        kept = [l for i, l in enumerate(lines)
+                if not (i in edges and _edge_key(l) in repeated) and not _PAGE_NUMBER_RE.match(l)]
+        text = _HYPHEN_BREAK_RE.sub(r"\1\2", "\n".join(kept))
+        # Blank lines separate paragraphs; single line breaks are layout
+        paragraphs = [" ".join(p.split()) for p in re.split(r"\n\s*\n", text)]
+        cleaned.append(" ".join(p for p in paragraphs if p))
+    return cleaned
+
+def process_pdf(path, passage_chars):
+    """Runs in a worker process: {'method', 'pages', 'chunks': [[page, text]], 'error'}."""
+    try:
+        method, pages = extract_pages(path)
+    except Exception as e:  # any parser failure is recorded, not fatal to the batch
+        return {"method": None, "pages": 0, "chunks": [], "error": f"{type(e).__name__}: {e}"}
+    chunks = [[number, passage]
+              for number, text in enumerate(normalize_pages(pages), start=1)
+              for passage in kiwix_tool._split_passages(text, passage_chars)]
+    return {"method": method, "pages": len(pages), "chunks": chunks, "error": None}
+
+def pdf_title(rel):
+    # civ_ingest.sh names files <category>_<author>_<title>_<year>.pdf
+    return os.path.splitext(os.path.basename(rel))[0].replace("_", " ")
+
+class Cache:
+    """Extracted passages per PDF digest and vectors per (model, passage hash), in SQLite."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS docs (sha256 TEXT, passage_chars INTEGER, method TEXT, "
+                        "pages INTEGER, error TEXT, chunks BLOB, PRIMARY KEY (sha256, passage_chars))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS vectors (model TEXT, hash INTEGER, vector BLOB, "
+                        "PRIMARY KEY (model, hash))")
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def doc(self, sha256, passage_chars):
+        with self.lock:
+            row = self.db.execute("SELECT method, pages, error, chunks FROM docs WHERE sha256=? AND passage_chars=?",
+                                  (sha256, passage_chars)).fetchone()
+        if row is None:
+            return None
+        return {"method": row[0], "pages": row[1], "error": row[2], "chunks": json.loads(zlib.decompress(row[3]))}
+
+    def has_docs(self, passage_chars):
+        with self.lock:
+            return {r[0] for r in self.db.execute("SELECT sha256 FROM docs WHERE passage_chars=?", (passage_chars,))}
+
+    def put_doc(self, sha256, passage_chars, doc):
+        blob = zlib.compress(json.dumps(doc["chunks"]).encode())
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?, ?, ?)",
+                            (sha256, passage_chars, doc["method"], doc["pages"], doc["error"], blob))
+            self.db.commit()
+
+    def vector_hashes(self, model):
+        with self.lock:
+            return {r[0] for r in self.db.execute("SELECT hash FROM vectors WHERE model=?", (model,))}
+
+    def put_vectors(self, model, hashes, vectors):
+        rows = [(model, h, v.astype(np.float16).tobytes()) for h, v in zip(hashes, vectors)]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?)", rows)
+            self.db.commit()
+
+    def vectors(self, model, hashes):
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self.lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                for h, blob in self.db.execute(f"SELECT hash, vector FROM vectors WHERE model=? AND hash IN "
+                                               f"({','.join('?' * len(batch))})", [model] + batch):
+                    found[h] = np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+        return found
+
+    def forget(self, keep_docs, keep_hashes, passage_chars, model):
+        # The cache follows the library: entries of deleted PDFs go with them
+        gone = [(s,) for s in self.has_docs(passage_chars) - keep_docs]
+        with self.lock:
+            self.db.executemany("DELETE FROM docs WHERE sha256=? AND passage_chars=?",
+                                [(s, passage_chars) for (s,) in gone])
+            stale = [(model, h) for (h,) in self.db.execute("SELECT hash FROM vectors WHERE model=?", (model,))
+                     if h not in keep_hashes]
+            self.db.executemany("DELETE FROM vectors WHERE model=? AND hash=?", stale)
+            self.db.commit()
+        return len(gone), len(stale)
+
+    def close(self):
+        self.db.close()
+
+def scan(pdf_dir):
+    """{relative path: absolute path} of every PDF under the library."""
+    found = {}
+    for root, dirs, files in os.walk(pdf_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.lower().endswith(".pdf") and not name.startswith("."):
+                path = os.path.join(root, name)
+                found[os.path.relpath(path, pdf_dir)] = path
+    return found
+
+class Embedder:
+    """EMBED_JOBS threads draining a bounded queue of passage batches into the vector cache."""
+
+    def __init__(self, cache, args):
+        self.cache = cache
+        self.args = args
+        self.queue = queue.Queue(maxsize=QUEUE_BATCHES)
+        self.session = requests.Session()
+        self.error = None
+        self.embedded = 0
+        self.lock = threading.Lock()
+        self.pending = []   # [(hash, text)] not yet a full batch
+        self.seen = cache.vector_hashes(args.model)
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(args.embed_jobs)]
+        for t in self.threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if self.error is not None:
+                continue  # drain without working so put() never blocks forever
+            try:
+                vectors = semantic_index.embed(self.session, self.args.embed_url, self.args.model,
+                                               [kiwix_tool.EMBED_DOCUMENT_PREFIX + text for _, text in batch])
+                self.cache.put_vectors(self.args.model, [h for h, _ in batch], vectors)
+                with self.lock:
+                    self.embedded += len(batch)
+            except Exception as e:  # a dead worker would leave add() blocked on a full queue
+                self.error = e
+
+    def add(self, texts):
+        """Queue passages that have no vector yet; blocks while the queue is full (backpressure)."""
+        for text in texts:
+            h = semantic_index.text_hash(text)
+            if h not in self.seen:
+                self.seen.add(h)
+                self.pending.append((h, text))
+            if len(self.pending) >= self.args.batch:
+                self._put(self.pending)
+                self.pending = []
+
+    def _put(self, batch):
+        if self.error is not None:
+            raise RuntimeError(f"embedding failed: {self.error}")
+        self.queue.put(batch)
+
+    def finish(self):
+        if self.pending and self.error is None:
+            self.queue.put(self.pending)
+        self.pending = []
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        if self.error is not None:
+            raise RuntimeError(f"embedding failed: {self.error}")
+
+def _crashed():
+    return {"method": None, "pages": 0, "chunks": [],
+            "error": "the extraction process crashed (parser killed by a signal or out of memory)"}
+
+def _extract_alone(path, passage_chars):
+    # A crash breaks the whole pool, taking every PDF in flight with it; alone, only the culprit fails
+    with ProcessPoolExecutor(max_workers=1) as solo:
+        try:
+            return solo.submit(process_pdf, path, passage_chars).result()
+        except BrokenProcessPool:
+            return _crashed()
+
+def extract_all(todo, cache, embedder, args):
+    """Extract `todo` ({sha256: path}) in the process pool, at most 2 x jobs PDFs in flight,
+    feeding passages to the embedder as each PDF finishes. Returns (done, failed)."""
+    counts = {"done": 0, "failed": 0}
+    items = iter(sorted(todo.items(), key=lambda kv: kv[1]))
+
+    def finish(sha, path, doc):
+        # A failure is cached like a result, so later runs do not retry the same file
+        cache.put_doc(sha, args.passage_chars, doc)
+        if doc["error"]:
+            counts["failed"] += 1
+            print(f"    [!] {os.path.basename(path)}: {doc['error']}")
+        else:
+            counts["done"] += 1
+            # Blocks while the embedder is behind, which stops new submissions too
+            embedder.add(text for _, text in doc["chunks"])
+        finished = counts["done"] + counts["failed"]
+        if finished % 25 == 0 or finished == len(todo):
+            print(f"    [*] {finished}/{len(todo)} PDFs extracted, {embedder.embedded} passages embedded",
+                  flush=True)
+
+    more = True
+    while more:
+        suspects = []
+        with ProcessPoolExecutor(max_workers=args.jobs, max_tasks_per_child=TASKS_PER_CHILD) as pool:
+            running = {}
+
+            def submit():
+                for sha, path in items:
+                    running[pool.submit(process_pdf, path, args.passage_chars)] = (sha, path)
+                    return True
+                return False
+
+            while len(running) < 2 * args.jobs and (more := submit()):
+                pass
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    sha, path = running.pop(future)
+                    try:
+                        doc = future.result()
+                    except BrokenProcessPool:
+                        suspects.append((sha, path))
+                        continue
+                    finish(sha, path, doc)
+                    if not suspects:
+                        more = submit()
+        for sha, path in suspects:
+            finish(sha, path, _extract_alone(path, args.passage_chars))
+    return counts["done"], counts["failed"]
+
+def write_index(index, docs, cache, args, fingerprint):
+    """Writes every passage of `docs` ([(rel, doc)]) as a fresh index beside `index` and swaps it in."""
+    tmp = f"{index}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    meta = {"zim": None, "source": "pdfs", "fingerprint": fingerprint, "model": args.model, "dtype": args.dtype,
+            "passage_chars": args.passage_chars, "dim": None, "count": 0, "cursor": 0, "complete": False,
+            "nlist": 0, "built": None, "documents": len(docs)}
+    writer = semantic_index.IndexWriter(tmp, meta)
+    try:
+        pending = []
+        for rel, doc in docs + [(None, None)]:
+            if doc is not None:
+                pending.extend((f"{rel}#page={page}", pdf_title(rel), text, semantic_index.text_hash(text))
+                               for page, text in doc["chunks"])
+            if pending and (len(pending) >= FLUSH_CHUNKS or doc is None):
+                vectors = cache.vectors(args.model, [h for *_, h in pending])
+                missing = [p for p in pending if p[3] not in vectors]
+                if missing:
+                    raise RuntimeError(f"{len(missing)} passages have no vector (re-run to embed them)")
+                writer.append(pending, np.stack([vectors[p[3]] for p in pending]), 0)
+                pending = []
+    finally:
+        writer.close()
+    meta["nlist"] = semantic_index.build_ivf(tmp, meta) if meta["count"] else 0
+    meta["complete"] = bool(meta["count"])
+    meta["built"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    semantic_index._write_atomic(os.path.join(tmp, semantic_index.META_FILE), json.dumps(meta, indent=1).encode())
+
+    # The tool reopens an index when meta.json changes; open maps of the old files stay valid
+    old = f"{index}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(index):
+        os.rename(index, old)
+    os.rename(tmp, index)
+    shutil.rmtree(old, ignore_errors=True)
+    return meta
+
+def ingest(args):
+    started = time.time()
+    files = scan(args.pdf_dir)
+    print(f"=== PDF ingest: {len(files)} PDFs in {args.pdf_dir} ===")
+    with ThreadPoolExecutor(HASH_JOBS) as pool:
+        digests = dict(zip(files, pool.map(checksum_cache.sha256_file, files.values())))
+
+    cache = Cache(args.cache_db)
+    try:
+        cached = cache.has_docs(args.passage_chars)
+        todo = {}
+        for rel in sorted(files):
+            if digests[rel] not in cached:
+                todo.setdefault(digests[rel], files[rel])
+        unchanged = sum(1 for rel in files if digests[rel] in cached)
+        print(f"[*] {unchanged} unchanged, {len(todo)} to extract ({args.jobs} processes).")
+
+        embedder = Embedder(cache, args)
+        try:
+            # Passages of cached PDFs that an interrupted run did not finish embedding
+            for sha in sorted(set(digests.values()) & cached):
+                doc = cache.doc(sha, args.passage_chars)
+                embedder.add(text for _, text in doc["chunks"])
+            extracted, failed = extract_all(todo, cache, embedder, args)
+        finally:
+            embedder.finish()
+
+        docs, keep, listed = [], set(), set()
+        for rel in sorted(files):
+            if digests[rel] in listed:
+                continue  # a copy of a PDF already in the index
+            listed.add(digests[rel])
+            doc = cache.doc(digests[rel], args.passage_chars)
+            if doc and not doc["error"]:
+                docs.append((rel, doc))
+                keep.update(semantic_index.text_hash(text) for _, text in doc["chunks"])
+        fingerprint = hashlib.blake2b(json.dumps(sorted((rel, digests[rel]) for rel, _ in docs)).encode(),
+                                      digest_size=16).hexdigest()
+        index = os.path.join(args.index_dir, kiwix_tool.PDF_INDEX)
+        meta = semantic_index.read_meta(index)
+        if (meta and meta.get("complete") and meta.get("fingerprint") == fingerprint
+                and meta["model"] == args.model and meta["dtype"] == args.dtype
+                and meta["passage_chars"] == args.passage_chars):
+            print(f"[OK] Index up to date ({meta['count']} passages from {meta['documents']} PDFs).")
+        else:
+            meta = write_index(index, docs, cache, args, fingerprint)
+            print(f"[OK] {index}: {meta['count']} passages from {len(docs)} PDFs, {meta['nlist']} lists.")
+        dropped_docs, dropped_vectors = cache.forget(set(digests.values()), keep, args.passage_chars, args.model)
+        print(f"    {extracted} extracted, {failed} failed, {embedder.embedded} passages embedded, "
+              f"{dropped_docs + dropped_vectors} stale cache entries dropped, {time.time() - started:.0f}s.")
+        return failed
+    finally:
+        cache.close()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Extract, chunk and embed the PDF library for the Kiwix tool")
+    parser.add_argument("--pdf-dir", default=PDF_DIR)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--cache-db", default=CACHE_DB)
+    parser.add_argument("--embed-url", default=semantic_index.EMBED_URL)
+    parser.add_argument("--model", default=semantic_index.EMBED_MODEL)
+    parser.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    parser.add_argument("--jobs", type=int, default=JOBS, help="Extraction processes")
+    parser.add_argument("--embed-jobs", type=int, default=EMBED_JOBS, help="Embedding requests in flight")
+    parser.add_argument("--batch", type=int, default=EMBED_BATCH, help="Passages per embedding request")
+    parser.add_argument("--passage-chars", type=int, default=kiwix_tool.PASSAGE_CHARS)
+    parser.add_argument("--status", action="store_true", help="Show the index and exit")
+    args = parser.parse_args()
+
+    if np is None:
+        print("[!] numpy is required (pip install numpy).")
+        sys.exit(1)
+    if args.status:
+        meta = semantic_index.read_meta(os.path.join(args.index_dir, kiwix_tool.PDF_INDEX))
+        if not meta:
+            print(f"[!] No PDF index in {args.index_dir}.")
+            sys.exit(1)
+        print(f"    {kiwix_tool.PDF_INDEX}: {meta['count']} passages from {meta['documents']} PDFs, "
+              f"{meta['model']} ({meta['dtype']}), built {meta['built']}")
+        return
+    if not os.path.isdir(args.pdf_dir):
+        print(f"[!] {args.pdf_dir} does not exist.")
+        sys.exit(1)
+    if not shutil.which("pdftotext") and PdfReader is None:
+        print("[!] No PDF text extractor: apt install poppler-utils (fast) or pip install pypdf.")
+        sys.exit(1)
+
+    try:
+        failed = ingest(args)
+    except (RuntimeError, OSError, sqlite3.Error) as e:
+        # Extracted PDFs and embedded passages are cached; the next run picks up from there
+        print(f"[!] {e}")
+        sys.exit(1)
+    if failed:
+        print(f"[!] {failed} PDFs could not be read (see above); they are retried when the files change.")
+
+if __name__ == "__main__":
+    main()
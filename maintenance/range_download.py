@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Parallel multi-connection HTTP downloader (replacement for `wget -c`).
+
+The file is split into fixed-size Range segments fetched over a pool of keep-alive
+connections and written in place into a preallocated `<dest>.part`. Finished segments
+are recorded in a `<dest>.part.json` journal, so an interrupted download resumes and
+loses at most the segments that were in flight (one per connection).
+
+SHA-256 is computed while the download runs: a hasher thread follows the contiguous
+prefix of finished segments and reads it back while it is still in the page cache, so
+no second pass over the file is needed afterwards. The digest is stored in the
+checksum cache (checksum_cache.py) for the finished file.
+
+Usage:
+    python3 maintenance/range_download.py URL DEST [--connections 8] [--segment-mb 64]
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+import checksum_cache
+
+DEFAULT_CONNECTIONS = 8
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+READ_CHUNK = 1024 * 1024
+SEGMENT_RETRIES = 4
+TIMEOUT = (10, 60)  # connect, read
+
+class DownloadError(Exception):
+    pass
+
+class RemoteChanged(DownloadError):
+    pass
+
+class _Journal:
+    """Resume state: remote identity plus the set of finished segment indices."""
+
+    def __init__(self, path, info):
+        self.path = path
+        self.info = info
+        self.done = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, info):
+        journal = cls(path, info)
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return journal
+        # Only resume if the remote file is still the same one
+        keys = ("url", "size", "etag", "last_modified", "segment_size")
+        if all(saved.get(k) == info.get(k) for k in keys):
+            journal.done = set(saved.get("done", []))
+        return journal
+
+    def mark_done(self, index):
+        with self.lock:
+            self.done.add(index)
+            self._save()
+
+    def _save(self):
+        state = dict(self.info)
+        state["done"] = sorted(self.done)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def frontier(self):
+        # Bytes from offset 0 that are fully on disk
+        with self.lock:
+            n = 0
+            while n in self.done:
+                n += 1
+        return min(n * self.info["segment_size"], self.info["size"])
+
+class _FrontierHasher(threading.Thread):
+    """
+    Hashes the .part file in order, up to the contiguous-completed frontier.
+    hashlib state cannot be serialised, so after a restart the already-finished prefix is
+    rehashed here in the background, overlapping with the remaining network transfer.
+    """
+
+    def __init__(self, fd, size):
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.size = size
+        self.sha = hashlib.sha256()
+        self.offset = 0
+        self.frontier = 0
+        self.closing = False
+        self.aborted = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def advance(self, frontier):
+        with self.cond:
+            if frontier > self.frontier:
+                self.frontier = frontier
+                self.cond.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.cond:
+                    while self.offset >= self.frontier and not self.closing and not self.aborted:
+                        self.cond.wait()
+                    if self.aborted or self.offset >= self.frontier:
+                        return
+                    target = self.frontier
+                while self.offset < target and not self.aborted:
+                    chunk = os.pread(self.fd, min(READ_CHUNK * 16, target - self.offset), self.offset)
+                    if not chunk:
+                        raise DownloadError(f"short read while hashing at {self.offset}")
+                    self.sha.update(chunk)
+                    self.offset += len(chunk)
+        except (OSError, DownloadError) as e:
+            self.error = e
+
+    def finish(self):
+        """Drain to the end of file and return the hex digest."""
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        self.join()
+        if self.error:
+            raise DownloadError(f"hashing failed: {self.error}")
+        if self.offset != self.size:
+            raise DownloadError(f"hashed {self.offset} of {self.size} bytes")
+        return self.sha.hexdigest()
+
+    def abort(self):
+        with self.cond:
+            self.aborted = True
+            self.cond.notify()
+        self.join()
+
+def probe(url, session=None):
+    """HEAD the URL (following mirror redirects): final URL, size, range support, validators."""
+    s = session or requests.Session()
+    r = s.head(url, allow_redirects=True, timeout=TIMEOUT)
+    r.raise_for_status()
+    size = int(r.headers.get("Content-Length", -1))
+    return {
+        "url": r.url,
+        "size": size,
+        "ranges": r.headers.get("Accept-Ranges", "").lower() == "bytes" and size > 0,
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+    }
+
+def preallocate(path, size):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    # Filesystems without fallocate support (some FUSE/NFS): stays sparse
+                    pass
+    finally:
+        os.close(fd)
+
+class _Progress:
+    # enabled: True prints a bar, a callable receives byte deltas instead (batch progress)
+    def __init__(self, total, already, enabled):
+        self.total = total
+        self.done = already
+        self.start_done = already
+        self.start = time.monotonic()
+        self.last_print = 0.0
+        self.callback = enabled if callable(enabled) else None
+        self.enabled = enabled is True
+        self.lock = threading.Lock()
+        if self.callback and already:
+            self.callback(already, True)
+
+    def add(self, n):
+        if self.callback:
+            self.callback(n)
+        with self.lock:
+            self.done += n
+            now = time.monotonic()
+            if self.enabled and now - self.last_print >= 0.5:
+                self.last_print = now
+                self._print(now)
+
+    def _print(self, now):
+        elapsed = max(now - self.start, 1e-6)
+        rate = (self.done - self.start_done) / elapsed
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        percent = self.done * 100.0 / self.total if self.total else 0
+        filled = int(40 * self.done // self.total) if self.total else 0
+        bar = "=" * filled + "-" * (40 - filled)
+        sys.stdout.write(f"\r    [{bar}] {percent:5.1f}% {rate / 1048576:7.1f} MB/s ETA {int(eta) // 60:d}m{int(eta) % 60:02d}s")
+        sys.stdout.flush()
+
+    def finish(self):
+        if self.enabled:
+            self._print(time.monotonic())
+            print()
+
+def _fetch_segment(local, url, fd, index, start, end, progress, validator, limiter=None):
+    # One Range request; retried from the segment start on failure
+    session = getattr(local, "session", None)
+    if session is None:
+        session = local.session = requests.Session()
+    headers = {"Range": f"bytes={start}-{end}"}
+    if validator:
+        # Server must refuse (200 full body) rather than mix bytes of a changed file
+        headers["If-Range"] = validator
+
+    last_error = None
+    for attempt in range(SEGMENT_RETRIES):
+        written = 0
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+                if r.status_code != 206:
+                    # 200 = If-Range mismatch (file changed upstream); retrying will not help
+                    raise RemoteChanged(f"segment {index}: expected 206, got HTTP {r.status_code}")
+                offset = start
+                for chunk in r.iter_content(READ_CHUNK):
+                    if offset + len(chunk) > end + 1:
+                        raise DownloadError(f"segment {index}: server sent more than requested")
+                    if limiter:
+                        limiter.consume(len(chunk))
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    written += len(chunk)
+                    progress.add(len(chunk))
+                if offset != end + 1:
+                    raise DownloadError(f"segment {index}: short read ({offset - start} of {end - start + 1} bytes)")
+            return index
+        except RemoteChanged:
+            progress.add(-written)
+            raise
+        except (requests.RequestException, DownloadError) as e:
+            last_error = e
+            progress.add(-written)
+            time.sleep(min(2 ** attempt, 10))
+    raise DownloadError(str(last_error))
+
+def fetch_ranges(url, fd, ranges, connections=DEFAULT_CONNECTIONS, progress=True, total=None,
+                 validator=None, limiter=None):
+    """
+    Fetch inclusive byte ranges [(start, end), ...] of `url` into `fd` at the same offsets,
+    over `connections` pooled connections. Used by delta sync for the changed blocks.
+    """
+    bar = _Progress(total or sum(end - start + 1 for start, end in ranges) or 1, 0, progress)
+    local = threading.local()
+    with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+        futures = [pool.submit(_fetch_segment, local, url, fd, i, start, end, bar, validator, limiter)
+                   for i, (start, end) in enumerate(ranges)]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+    bar.finish()
+
+def _single_stream(info, part_path, progress_enabled, limiter=None):
+    # No Range support (or unknown size): plain streaming download, restarted from zero
+    with requests.get(info["url"], stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        total = int(r.headers.get("Content-Length", 0)) or info["size"]
+        progress = _Progress(max(total, 1), 0, progress_enabled)
+        sha = hashlib.sha256()
+        with open(part_path, "wb") as f:
+            for chunk in r.iter_content(READ_CHUNK):
+                if limiter:
+                    limiter.consume(len(chunk))
+                f.write(chunk)
+                sha.update(chunk)
+                progress.add(len(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+        progress.finish()
+    return sha.hexdigest()
+
+def download(url, dest, connections=DEFAULT_CONNECTIONS, segment_size=DEFAULT_SEGMENT_SIZE, progress=True,
+             limiter=None, info=None):
+    """
+    Download `url` to `dest` over up to `connections` parallel Range requests.
+    Resumes from `<dest>.part` + journal if present. Returns the file's SHA-256 hex digest.
+    Raises DownloadError on failure.
+
+    progress: True for a progress bar, False for none, or a callable fed byte deltas
+    (called once as callback(n, True) for bytes already on disk when resuming).
+    limiter: shared object with consume(nbytes) that blocks to cap bandwidth.
+    info: a previous probe(url) result, to skip the HEAD request.
+    """
+    part_path = dest + ".part"
+    journal_path = part_path + ".json"
+
+    info = dict(info or probe(url))
+    if not info["ranges"]:
+        print("    [!] Server does not support ranges, using a single stream.")
+        digest = _single_stream(info, part_path, progress, limiter)
+        os.replace(part_path, dest)
+        checksum_cache.record(dest, digest)
+        return digest
+
+    size = info["size"]
+    info["segment_size"] = segment_size
+    journal = _Journal.load(journal_path, info)
+    try:
+        on_disk = os.path.getsize(part_path)
+    except OSError:
+        on_disk = None
+    if on_disk != size:
+        # .part deleted or cut short behind the journal's back: its "done" segments are not on disk
+        journal.done = set()
+    if not journal.done and on_disk is not None:
+        # Stale .part from a different remote version (or no journal): start over
+        os.remove(part_path)
+    preallocate(part_path, size)
+
+    segments = []
+    for index, start in enumerate(range(0, size, segment_size)):
+        if index not in journal.done:
+            segments.append((index, start, min(start + segment_size, size) - 1))
+    already = size - sum(end - start + 1 for _, start, end in segments)
+    if already and progress is True:
+        print(f"    [*] Resuming: {already / 1048576:.1f} MB already on disk.")
+    journal.save()
+
+    bar = _Progress(size, already, progress)
+    validator = info["etag"] if info["etag"] and not info["etag"].startswith("W/") else info["last_modified"]
+    local = threading.local()
+    fd = os.open(part_path, os.O_RDWR)
+    hasher = _FrontierHasher(fd, size)
+    hasher.start()
+    hasher.advance(journal.frontier())
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+            futures = [
+                pool.submit(_fetch_segment, local, info["url"], fd, index, start, end, bar, validator, limiter)
+                for index, start, end in segments
+            ]
+            try:
+                for future in as_completed(futures):
+                    journal.mark_done(future.result())
+                    hasher.advance(journal.frontier())
+            except BaseException:
+                # Ctrl-C or a failed segment: keep what finished, drop the rest
+                for f in futures:
+                    f.cancel()
+                raise
+        digest = hasher.finish()
+        os.fsync(fd)
+    finally:
+        hasher.abort()
+        os.close(fd)
+    bar.finish()
+
+    os.replace(part_path, dest)
+    os.remove(journal_path)
+    checksum_cache.record(dest, digest)
+    return digest
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Parallel ranged HTTP downloader")
+    parser.add_argument("url")
+    parser.add_argument("dest")
+    parser.add_argument("-c", "--connections", type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument("--segment-mb", type=float, default=DEFAULT_SEGMENT_SIZE / 1048576)
+    args = parser.parse_args()
+
+    try:
+        digest = download(args.url, args.dest, args.connections, int(args.segment_mb * 1048576))
+    except (DownloadError, requests.RequestException, OSError) as e:
+        print(f"\n[!] Download failed: {e}")
+        sys.exit(1)
+    print(f"[OK] Saved to {args.dest}")
+    print(f"     sha256 {digest}")
+
+if __name__ == "__main__":
+    main()
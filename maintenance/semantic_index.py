@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+Offline semantic passage index over selected ZIMs, for kiwix_tool's "semantic" and
+"hybrid" retrieval modes (questions worded unlike any article title still find passages).
+
+Articles are extracted and split exactly as the tool does at query time
+(kiwix_tool._html_to_text / _split_passages), embedded in large batches by the
+nomic-embed-text model that rag_setup.sh pulls (Ollama /api/embed), and stored per ZIM
+version under $CIV_ROOT/index/semantic/<book id>/:
+
+    meta.json      model, dimension, storage type, row count, resume cursor, complete flag
+    vectors.bin    row-major matrix of unit vectors: int8 (per-row scale in scales.bin) or float16
+    chunks.db      SQLite: row id -> article path, title, text hash, passage text
+    centroids.bin  IVF coarse quantizer: k-means centroids (float32, nlist x dim)
+    lists.bin      row ids grouped by nearest centroid (uint32)
+    offsets.bin    start of each centroid's group in lists.bin (uint64, nlist + 1)
+
+The tool memory-maps these files, scores the centroids and scans only the rows of the
+closest `nprobe` groups.
+
+Builds resume: rows are made durable every FLUSH_CHUNKS passages before meta.json records
+how far the walk got, so an interrupted build continues from its last flush. A new
+version of a book reuses the vectors of every passage whose text is unchanged in the
+previous version's index, so a monthly refresh only embeds new or edited passages.
+Indexes whose ZIM has left the library are removed after each build.
+
+Usage:
+    python3 maintenance/semantic_index.py build --priority 1
+    python3 maintenance/semantic_index.py build --book wikipedia_en_medicine_maxi --embed-url http://localhost:11434
+    python3 maintenance/semantic_index.py build --indexed     # new versions of already indexed books
+    python3 maintenance/semantic_index.py status
+    python3 maintenance/semantic_index.py query wikipedia_en_medicine_maxi_2025-11 "my water tastes metallic"
+"""
+import ast
+import bisect
+import hashlib
+import json
+import math
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import mirror_catalog
+import zim_ingest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kiwix_tool  # noqa: E402  (same extraction and passage splitting as query time)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from libzim.reader import Archive
+except ImportError:
+    Archive = None
+
+CIV_ROOT = os.getenv("CIV_ROOT", "/opt/civilization")
+LIBRARY_DIR = zim_ingest.LIBRARY_DIR
+INDEX_DIR = os.path.join(CIV_ROOT, "index", "semantic")
+MANIFEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "download_manifest.py")
+
+# Ollama runs on the host (see docker-compose.yml)
+EMBED_URL = "http://localhost:11434"
+EMBED_MODEL = "nomic-embed-text"
+EMBED_BATCH = 128   # passages per /api/embed request
+EMBED_JOBS = 2      # requests in flight
+EMBED_TIMEOUT = 300
+EMBED_RETRIES = 3
+
+FLUSH_CHUNKS = 4096  # passages per durable checkpoint
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 65536  # rows the centroids are trained on
+MAX_LISTS = 4096
+ASSIGN_BLOCK = 65536
+
+META_FILE = "meta.json"
+VECTORS_FILE = "vectors.bin"
+SCALES_FILE = "scales.bin"
+CHUNKS_DB = "chunks.db"
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def read_meta(index):
+    try:
+        with open(os.path.join(index, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def library_zims(library=LIBRARY_DIR):
+    """{file name: path} of every ZIM under the library."""
+    found = {}
+    for root, dirs, files in os.walk(library):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.endswith(".zim") and not name.startswith("."):
+                found[name] = os.path.join(root, name)
+    return found
+
+def select_zims(patterns, library=LIBRARY_DIR):
+    """{book id: path} of the newest local version of every book matching a manifest pattern."""
+    newest = {}
+    for name, path in library_zims(library).items():
+        if not any(name.startswith(p) for p in patterns):
+            continue
+        book, _, _, _, date = mirror_catalog.parse_name(name)
+        if book not in newest or (date or "", name) > newest[book][0]:
+            newest[book] = ((date or "", name), path)
+    return {os.path.basename(path)[:-4]: path for _, path in newest.values()}
+
+def text_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little", signed=True)
+
+def embed(session, url, model, texts, timeout=EMBED_TIMEOUT):
+    """Unit-length float32 embeddings of `texts`, one /api/embed request."""
+    for attempt in range(EMBED_RETRIES):
+        try:
+            r = session.post(f"{url}/api/embed", json={"model": model, "input": texts, "truncate": True},
+                             timeout=timeout)
+            r.raise_for_status()
+            try:
+                vectors = np.asarray(r.json()["embeddings"], dtype=np.float32)
+            except (KeyError, TypeError, IndexError) as e:
+                raise ValueError(f"malformed /api/embed response: {r.text[:200]!r}") from e
+            break
+        except (requests.RequestException, ValueError):
+            if attempt == EMBED_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+    if vectors.shape[0] != len(texts):
+        raise ValueError(f"embedder returned {vectors.shape[0]} vectors for {len(texts)} inputs")
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def quantize(vectors, dtype):
+    """(rows, scales) in the on-disk type; int8 keeps one float32 scale per row."""
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+def _pointer(f, header, index):
+    (offset,) = struct.unpack("<Q", zim_ingest._read(f, header["url_ptr"] + 8 * index, 8))
+    return offset
+
+def _user_entries(f, header, new_scheme):
+    """[first, end) of the path pointer list that libzim numbers as entries 0..entry_count-1."""
+    if not new_scheme:
+        return 0, header["entries"]
+    # The list is sorted by namespace + path, so the C/ (content) entries are one run
+    namespace = lambda i: zim_ingest._read(f, _pointer(f, header, i) + 3, 1)
+    entries = range(header["entries"])
+    return (bisect.bisect_left(entries, True, key=lambda i: namespace(i) >= b"C"),
+            bisect.bisect_left(entries, True, key=lambda i: namespace(i) > b"C"))
+
+def _dirent_path(f, offset):
+    """(namespace, path, has content) of the directory entry at `offset`."""
+    raw = zim_ingest._read(f, offset, zim_ingest.DIRENT_READ)
+    mime, _, namespace = struct.unpack_from("<HBc", raw)
+    start = 12 if mime == 0xFFFF else 8 if mime >= 0xFFFD else 16  # redirect / deleted / article
+    end = raw.find(b"\0", start)
+    while end < 0:
+        more = zim_ingest._read(f, offset + len(raw), zim_ingest.DIRENT_READ)
+        if not more:
+            raise zim_ingest.ZimError(f"directory entry at {offset} truncated")
+        raw += more
+        end = raw.find(b"\0", start)
+    return namespace.decode("ascii"), raw[start:end].decode("utf-8"), mime < 0xFFFD
+
+def iter_articles(archive, start, article_chars, passage_chars, max_bytes):
+    """(entry id, [(path, title, passage)]) for every entry from `start`; non-articles yield no passages.
+
+    libzim's Python API cannot list entries, so paths come from the ZIM's own path pointer
+    list, in the order (and with the ids) libzim gives them, and are opened by path."""
+    new_scheme = archive.has_new_namespace_scheme
+    with open(archive.filename, "rb") as f:
+        header = zim_ingest.read_header(f, os.fstat(f.fileno()).st_size)
+        first, end = _user_entries(f, header, new_scheme)
+        if end - first != archive.entry_count:
+            raise zim_ingest.ZimError(f"{end - first} content entries in the path list, libzim counts "
+                                      f"{archive.entry_count}")
+        for i in range(start, end - first):
+            namespace, path, content = _dirent_path(f, _pointer(f, header, first + i))
+            if not content:
+                yield i, []
+                continue
+            entry = archive.get_entry_by_path(path if new_scheme else f"{namespace}/{path}")
+            item = entry.get_item()
+            if not item.mimetype.startswith("text/html"):
+                yield i, []
+                continue
+            text = kiwix_tool._html_to_text(memoryview(item.content)[:max_bytes], article_chars)
+            yield i, [(entry.path, entry.title, p) for p in kiwix_tool._split_passages(text, passage_chars)]
+
+def manifest_patterns(max_priority, path=MANIFEST_FILE):
+    """File patterns of download_manifest.MANIFEST entries at `max_priority` or more urgent.
+
+    Read from the file rather than imported: importing download_manifest pulls in the whole
+    download stack (delta_sync, the scheduler, range_download)."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "MANIFEST" for t in node.targets):
+            return [pattern for _, pattern, _, priority in ast.literal_eval(node.value) if priority <= max_priority]
+    raise ValueError(f"no MANIFEST in {path}")
+
+class IndexWriter:
+    """Append-only rows of one index; meta.json only moves forward once the rows are on disk."""
+
+    def __init__(self, index, meta):
+        self.index = index
+        self.meta = meta
+        os.makedirs(index, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(index, CHUNKS_DB))
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, path TEXT, title TEXT, "
+                        "hash INTEGER, text TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS chunks_hash ON chunks(hash)")
+        # Forget whatever an interrupted run wrote after its last checkpoint
+        self.db.execute("DELETE FROM chunks WHERE id >= ?", (meta["count"],))
+        self.db.commit()
+        self.files = {}
+        self._open_files()
+
+    def _open_files(self):
+        if self.files or not self.meta["dim"]:
+            return
+        width = self.meta["dim"] * (1 if self.meta["dtype"] == "int8" else 2)
+        names = [(VECTORS_FILE, width)] + ([(SCALES_FILE, 4)] if self.meta["dtype"] == "int8" else [])
+        for name, row_bytes in names:
+            path = os.path.join(self.index, name)
+            f = open(path, "r+b" if os.path.exists(path) else "w+b")
+            f.truncate(self.meta["count"] * row_bytes)
+            f.seek(0, os.SEEK_END)
+            self.files[name] = f
+
+    def append(self, chunks, vectors, cursor):
+        """Write rows for `chunks` ([(path, title, text, hash)]) and move the resume cursor."""
+        if len(chunks):
+            if not self.meta["dim"]:
+                self.meta["dim"] = int(vectors.shape[1])
+                self._open_files()
+            rows, scales = quantize(vectors, self.meta["dtype"])
+            self.files[VECTORS_FILE].write(rows.tobytes())
+            if scales is not None:
+                self.files[SCALES_FILE].write(scales.tobytes())
+            for f in self.files.values():
+                f.flush()
+                os.fsync(f.fileno())
+            first = self.meta["count"]
+            self.db.executemany("INSERT INTO chunks (id, path, title, hash, text) VALUES (?, ?, ?, ?, ?)",
+                                [(first + i, path, title, h, text) for i, (path, title, text, h) in enumerate(chunks)])
+            self.db.commit()
+            self.meta["count"] += len(chunks)
+        self.meta["cursor"] = cursor
+        self.save()
+
+    def save(self):
+        _write_atomic(os.path.join(self.index, META_FILE), json.dumps(self.meta, indent=1).encode())
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.db.close()
+
+class PreviousIndex:
+    """Vectors of the last complete index of the same book, looked up by passage text hash."""
+
+    def __init__(self, index, meta):
+        self.db = sqlite3.connect(f"file:{os.path.join(index, CHUNKS_DB)}?mode=ro", uri=True)
+        self.vectors, self.scales = open_vectors(index, meta)
+
+    def lookup(self, hashes):
+        """{hash: float32 unit vector} for every hash the previous version has."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = self.db.execute(f"SELECT hash, MIN(id) FROM chunks WHERE hash IN ({','.join('?' * len(batch))}) "
+                                   "GROUP BY hash", batch).fetchall()
+            for h, row in rows:
+                vector = self.vectors[row].astype(np.float32)
+                found[h] = vector * self.scales[row] if self.scales is not None else vector
+        return found
+
+    def close(self):
+        self.db.close()
+
+def open_vectors(index, meta):
+    dtype = np.int8 if meta["dtype"] == "int8" else np.float16
+    vectors = np.memmap(os.path.join(index, VECTORS_FILE), dtype=dtype, mode="r", shape=(meta["count"], meta["dim"]))
+    scales = None
+    if meta["dtype"] == "int8":
+        scales = np.memmap(os.path.join(index, SCALES_FILE), dtype=np.float32, mode="r", shape=(meta["count"],))
+    return vectors, scales
+
+def find_previous(index_dir, book_id, meta):
+    """The newest complete index of an older version of the same book with compatible vectors."""
+    book = mirror_catalog.parse_name(book_id + ".zim")[0]
+    best = None
+    for name in os.listdir(index_dir) if os.path.isdir(index_dir) else []:
+        if name == book_id or mirror_catalog.parse_name(name + ".zim")[0] != book:
+            continue
+        other = read_meta(os.path.join(index_dir, name))
+        if (other and other.get("complete") and other["count"] and other["model"] == meta["model"]
+                and other["dtype"] == meta["dtype"] and other["passage_chars"] == meta["passage_chars"]
+                and other["article_chars"] == meta["article_chars"]):
+            if best is None or name > best[0]:
+                best = (name, other)
+    if best is None:
+        return None
+    return PreviousIndex(os.path.join(index_dir, best[0]), best[1])
+
+def _dequantize(vectors, scales, start, end):
+    block = vectors[start:end].astype(np.float32)
+    return block * scales[start:end, None] if scales is not None else block
+
+def build_ivf(index, meta, seed=0):
+    """Spherical k-means over a sample of the rows, then group every row under its nearest centroid."""
+    vectors, scales = open_vectors(index, meta)
+    count = meta["count"]
+    nlist = max(1, min(MAX_LISTS, int(math.sqrt(count))))
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(count, min(count, KMEANS_SAMPLE), replace=False))
+    sample = vectors[sample_rows].astype(np.float32)
+    if scales is not None:
+        sample *= scales[sample_rows, None]
+
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        filled = np.bincount(labels, minlength=nlist) > 0
+        # An empty cluster keeps its old centroid
+        centroids[filled] = sums[filled] / np.maximum(np.linalg.norm(sums[filled], axis=1, keepdims=True), 1e-12)
+
+    labels = np.empty(count, dtype=np.int64)
+    for start in range(0, count, ASSIGN_BLOCK):
+        end = min(count, start + ASSIGN_BLOCK)
+        labels[start:end] = np.argmax(_dequantize(vectors, scales, start, end) @ centroids.T, axis=1)
+    order = np.argsort(labels, kind="stable").astype(np.uint32)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.uint64)
+
+    _write_atomic(os.path.join(index, "centroids.bin"), centroids.astype(np.float32).tobytes())
+    _write_atomic(os.path.join(index, "lists.bin"), order.tobytes())
+    _write_atomic(os.path.join(index, "offsets.bin"), offsets.tobytes())
+    return nlist
+
+def build(book_id, zim_path, args):
+    """Index (or finish indexing) one ZIM. Returns (passages embedded, passages reused)."""
+    index = os.path.join(args.index_dir, book_id)
+    archive = Archive(zim_path)
+    st = os.stat(zim_path)
+    source = {"zim": os.path.basename(zim_path), "uuid": str(archive.uuid), "size": st.st_size,
+              "model": args.model, "dtype": args.dtype, "passage_chars": args.passage_chars,
+              "article_chars": args.article_chars}
+    meta = read_meta(index)
+    if meta and any(meta.get(k) != v for k, v in source.items()):
+        # Different file or different settings under the same name: start over
+        print(f"    [*] {book_id}: source or settings changed, rebuilding.")
+        shutil.rmtree(index)
+        meta = None
+    if meta and meta["complete"]:
+        print(f"    [OK] {book_id}: up to date ({meta['count']} passages).")
+        return 0, 0
+    if meta is None:
+        meta = dict(source, dim=None, count=0, cursor=0, complete=False, nlist=0, built=None)
+    elif meta["cursor"]:
+        print(f"    [*] {book_id}: resuming at entry {meta['cursor']} of {archive.entry_count} "
+              f"({meta['count']} passages done).")
+
+    writer = IndexWriter(index, meta)
+    previous = find_previous(args.index_dir, book_id, meta)
+    session = requests.Session()
+    embedded = reused = 0
+    started = time.time()
+
+    def flush(pending, cursor):
+        nonlocal embedded, reused
+        hashes = [text_hash(text) for _, _, text in pending]
+        known = previous.lookup(hashes) if previous else {}
+        todo = [i for i, h in enumerate(hashes) if h not in known]
+        batches = [todo[i:i + args.batch] for i in range(0, len(todo), args.batch)]
+        fresh = {}
+        for batch, vectors in zip(batches, pool.map(
+                lambda b: embed(session, args.embed_url, args.model,
+                                [kiwix_tool.EMBED_DOCUMENT_PREFIX + pending[i][2] for i in b]), batches)):
+            fresh.update(zip(batch, vectors))
+        vectors = np.stack([fresh[i] if i in fresh else known[h] for i, h in enumerate(hashes)]) if pending else None
+        writer.append([p + (h,) for p, h in zip(pending, hashes)], vectors, cursor)
+        embedded += len(todo)
+        reused += len(pending) - len(todo)
+        print(f"    [*] {book_id}: entry {cursor}/{archive.entry_count}, {meta['count']} passages "
+              f"({embedded} embedded, {reused} reused, {time.time() - started:.0f}s)", flush=True)
+
+    try:
+        with ThreadPoolExecutor(args.jobs) as pool:
+            pending = []
+            for entry, passages in iter_articles(archive, meta["cursor"], args.article_chars,
+                                                 args.passage_chars, kiwix_tool.ARTICLE_MAX_BYTES):
+                pending.extend(passages)
+                if len(pending) >= args.flush:
+                    flush(pending, entry + 1)
+                    pending = []
+            flush(pending, archive.entry_count)
+    finally:
+        writer.close()
+        if previous:
+            previous.close()
+
+    meta["nlist"] = build_ivf(index, meta) if meta["count"] else 0
+    meta["complete"] = True
+    meta["built"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    _write_atomic(os.path.join(index, META_FILE), json.dumps(meta, indent=1).encode())
+    print(f"[OK] {book_id}: {meta['count']} passages, {meta['nlist']} lists "
+          f"({embedded} embedded, {reused} reused from the previous version).")
+    return embedded, reused
+
+def prune(index_dir=INDEX_DIR, library=LIBRARY_DIR):
+    """Remove indexes whose ZIM is no longer in the library."""
+    present = library_zims(library)
+    removed = []
+    for name in sorted(os.listdir(index_dir)) if os.path.isdir(index_dir) else []:
+        meta = read_meta(os.path.join(index_dir, name))
+        # Indexes not built from a ZIM (pdf_ingest.py's PDF library) are not this function's to remove
+        if meta and meta.get("zim") and meta["zim"] not in present:
+            shutil.rmtree(os.path.join(index_dir, name))
+            removed.append(name)
+    return removed
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the semantic passage index used by kiwix_tool")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build")
+    p.add_argument("--book", action="append", default=[], help="Manifest pattern (repeatable)")
+    p.add_argument("--priority", type=int, help="Every manifest book at this priority or more urgent")
+    p.add_argument("--indexed", action="store_true", help="Every book that already has an index (after updates)")
+    p.add_argument("--library", default=LIBRARY_DIR)
+    p.add_argument("--index-dir", default=INDEX_DIR)
+    p.add_argument("--embed-url", default=EMBED_URL)
+    p.add_argument("--model", default=EMBED_MODEL)
+    p.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    p.add_argument("--batch", type=int, default=EMBED_BATCH)
+    p.add_argument("--jobs", type=int, default=EMBED_JOBS)
+    p.add_argument("--flush", type=int, default=FLUSH_CHUNKS)
+    p.add_argument("--passage-chars", type=int, default=kiwix_tool.PASSAGE_CHARS)
+    p.add_argument("--article-chars", type=int, default=kiwix_tool.ARTICLE_TEXT_CHARS)
+    p = sub.add_parser("status")
+    p.add_argument("--index-dir", default=INDEX_DIR)
+    p = sub.add_parser("query")
+    p.add_argument("book_id")
+    p.add_argument("text")
+    p.add_argument("--index-dir", default=INDEX_DIR)
+    p.add_argument("--embed-url", default=EMBED_URL)
+    p.add_argument("--top", type=int, default=5)
+    p.add_argument("--nprobe", type=int, default=kiwix_tool.SEMANTIC_NPROBE)
+    args = parser.parse_args()
+
+    if np is None:
+        print("[!] numpy is required (pip install numpy).")
+        sys.exit(1)
+
+    if args.cmd == "status":
+        for name in sorted(os.listdir(args.index_dir)) if os.path.isdir(args.index_dir) else []:
+            meta = read_meta(os.path.join(args.index_dir, name))
+            if meta:
+                state = "complete" if meta["complete"] else f"partial (entry {meta['cursor']})"
+                print(f"    {name:<50} {meta['count']:>10} passages  {meta['dtype']:<7}  {state}")
+        return
+
+    if args.cmd == "query":
+        index = kiwix_tool._get_semantic_index(args.index_dir, args.book_id)
+        if index is None:
+            print(f"[!] No complete index for {args.book_id} in {args.index_dir}.")
+            sys.exit(1)
+        vector = embed(requests.Session(), args.embed_url, index.meta["model"],
+                       [kiwix_tool.EMBED_QUERY_PREFIX + args.text])[0]
+        try:
+            for score, path, title, text in index.search(vector, args.top, args.nprobe):
+                print(f"[{score:.3f}] {title} ({path})\n    {text[:200]}", flush=True)
+        except BrokenPipeError:
+            # Reader stopped early (`| head`, `| grep -q`): drop the rest quietly
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+
+    if Archive is None:
+        print("[!] libzim is required to read ZIM files (pip install libzim).")
+        sys.exit(1)
+    patterns = list(args.book)
+    if args.priority is not None:
+        patterns += manifest_patterns(args.priority)
+    if args.indexed and os.path.isdir(args.index_dir):
+        patterns += sorted({mirror_catalog.parse_name(name + ".zim")[0] for name in os.listdir(args.index_dir)})
+    if not patterns:
+        print("[!] Choose books with --book PATTERN, --priority N and/or --indexed.")
+        sys.exit(1)
+
+    zims = select_zims(patterns, args.library)
+    print(f"=== Semantic index: {len(zims)} ZIMs -> {args.index_dir} ===")
+    failed = 0
+    for book_id, path in sorted(zims.items()):
+        try:
+            build(book_id, path, args)
+        except (requests.RequestException, ValueError, OSError, RuntimeError) as e:
+            # Progress up to the last checkpoint is kept; the next run resumes there
+            print(f"[!] {book_id}: {e}")
+            failed += 1
+    for name in prune(args.index_dir, args.library):
+        print(f"    [-] Removed index {name} (ZIM no longer in the library)")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
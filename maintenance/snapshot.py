@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+"""
+Incremental, deduplicated snapshots of the Open WebUI data directory (chat DB, vector
+store, uploads) for `manage_vectordb.sh backup|restore|prune`.
+
+Files are split into content-defined chunks (a rolling sum over a 48-byte window picks
+the cut points, so an insertion only changes the chunks around it, not everything after
+it). Each chunk is stored once under its BLAKE2b-256 digest, compressed with zstd (zlib
+without the zstandard module), by a pool of worker threads that hash, compress and write
+in parallel. A snapshot is a JSON manifest listing each file's chunks:
+
+    <repo>/chunks/ab/abcdef...   one chunk: 1 codec byte + payload
+    <repo>/snapshots/<id>.json   files, dirs and symlinks of one backup
+    <repo>/lock                  held by backup and prune
+
+Files whose size and mtime match the previous snapshot are not read at all. SQLite
+databases (webui.db, chroma.sqlite3) are copied with SQLite's online backup API, so the
+snapshot is consistent while Open WebUI keeps writing; their -wal/-shm files are skipped.
+Restore writes chunks at their offsets from the same thread pool and verifies every chunk
+against its digest; anything in the target the snapshot does not list (stale -wal/-shm
+included) is deleted first. Prune applies a keep-last/daily/weekly/monthly policy, then deletes
+chunks no remaining snapshot references.
+
+numpy (optional) enables content-defined chunking; without it files are cut into
+fixed-size blocks, which still deduplicates unchanged files and in-place edits.
+
+Usage:
+    python3 maintenance/snapshot.py backup [--source DIR] [--repo DIR] [--jobs 8]
+    python3 maintenance/snapshot.py list
+    python3 maintenance/snapshot.py restore latest /tmp/openwebui_restore
+    python3 maintenance/snapshot.py prune [--keep-last 5 --keep-daily 7 --keep-weekly 4 --keep-monthly 6] [--dry-run]
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # fixed-size chunks
+    np = None
+
+try:
+    import zstandard
+except ImportError:  # zlib
+    zstandard = None
+
+CIV_ROOT = os.getenv("CIV_ROOT", "/opt/civilization")
+SOURCE_DIR = os.path.join(CIV_ROOT, "openwebui")
+REPO_DIR = os.path.join(CIV_ROOT, "backups", "vectordb")
+
+# Chunk sizes: cut where the rolling sum's masked bits are zero, between MIN and MAX
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+MASK_BITS = 20            # ~1 MiB past MIN_CHUNK on average
+WINDOW = 48
+READ_SIZE = 4 * 1024 * 1024
+# Fixed per-byte values for the rolling sum; the seed must never change or old chunks stop matching
+GEAR = np.random.default_rng(0x5EED).integers(0, 2**32, 256, dtype=np.uint64).astype(np.uint32) if np else None
+
+JOBS = min(8, os.cpu_count() or 1)
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+RAW, ZLIB, ZSTD = b"\0", b"\1", b"\2"
+MIN_SAVING = 0.03         # store raw unless compression saves at least this fraction
+PROBE_BYTES = 64 * 1024   # compress a sample first; incompressible chunks (vectors, PDFs) skip the full pass
+SQLITE_MAGIC = b"SQLite format 3\0"
+SQLITE_SIDECARS = ("-wal", "-shm", "-journal")
+CHANGED_RETRIES = 2       # re-read a file that changed while it was being chunked
+
+KEEP_LAST = 5
+KEEP_DAILY = 7
+KEEP_WEEKLY = 4
+KEEP_MONTHLY = 6
+
+def _cuts(buf, eof):
+    """End offsets of the chunks in buf, which starts on a chunk boundary. Without eof the
+    tail after the last cut is left for the next read."""
+    length = len(buf)
+    if np is None:
+        cuts = list(range(1 << MASK_BITS, length + 1, 1 << MASK_BITS))
+    else:
+        sums = np.cumsum(GEAR[np.frombuffer(buf, dtype=np.uint8)], dtype=np.uint32)
+        # rolling[k] = sum of the WINDOW bytes ending at k + WINDOW (wraps mod 2^32)
+        rolling = sums[WINDOW:] - sums[:-WINDOW]
+        candidates = np.flatnonzero(((rolling >> 8) & ((1 << MASK_BITS) - 1)) == 0) + WINDOW + 1
+        cuts, start = [], 0
+        while True:
+            i = np.searchsorted(candidates, start + MIN_CHUNK)
+            cut = int(candidates[i]) if i < len(candidates) else None
+            if cut is None or cut > start + MAX_CHUNK:
+                if start + MAX_CHUNK > length:
+                    break
+                cut = start + MAX_CHUNK
+            cuts.append(cut)
+            start = cut
+    if eof and (cuts[-1] if cuts else 0) < length:
+        cuts.append(length)
+    return cuts
+
+def iter_chunks(f):
+    buf = b""
+    while True:
+        data = f.read(READ_SIZE)
+        buf += data
+        prev = 0
+        for cut in _cuts(buf, not data):
+            yield buf[prev:cut]
+            prev = cut
+        buf = buf[prev:]
+        if not data:
+            return
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+class Repository:
+    def __init__(self, root, level=ZSTD_LEVEL):
+        self.root = root
+        self.chunk_dir = os.path.join(root, "chunks")
+        self.snapshot_dir = os.path.join(root, "snapshots")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.level = level
+        self.local = threading.local()
+        self.known = None
+        self.known_lock = threading.Lock()
+        self.dirty = set()
+
+    def lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        fd = os.open(os.path.join(self.root, "lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise RuntimeError(f"another backup or prune is running on {self.root}")
+        return fd
+
+    def _path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def load_known(self):
+        # One listing instead of a stat per chunk
+        self.known = set()
+        if os.path.isdir(self.chunk_dir):
+            for sub in os.listdir(self.chunk_dir):
+                self.known.update(n for n in os.listdir(os.path.join(self.chunk_dir, sub)) if len(n) == 64)
+        return self.known
+
+    def _compress(self, data):
+        if zstandard is not None:
+            compressor = getattr(self.local, "zstd", None)
+            if compressor is None:
+                # ZstdCompressor objects must not be shared between threads
+                compressor = self.local.zstd = zstandard.ZstdCompressor(level=self.level)
+            return ZSTD, compressor.compress(data)
+        return ZLIB, zlib.compress(data, ZLIB_LEVEL)
+
+    def put(self, digest, data):
+        """Stores a chunk unless the repository has it; returns the bytes written (0 if it did)."""
+        with self.known_lock:
+            if digest in self.known:
+                return 0
+            self.known.add(digest)
+        codec, payload = RAW, data
+        sample = data[len(data) // 2:len(data) // 2 + PROBE_BYTES]
+        if len(data) <= PROBE_BYTES or len(self._compress(sample)[1]) <= len(sample) * (1 - MIN_SAVING):
+            codec, payload = self._compress(data)
+            if len(payload) > len(data) * (1 - MIN_SAVING):
+                codec, payload = RAW, data
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(codec)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        with self.known_lock:
+            self.dirty.add(os.path.dirname(path))
+        return 1 + len(payload)
+
+    def sync(self):
+        """Makes the renames of new chunks durable; call before saving a manifest that uses them."""
+        for path in sorted(self.dirty) + ([self.chunk_dir] if self.dirty else []):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.dirty.clear()
+
+    def get(self, digest):
+        with open(self._path(digest), "rb") as f:
+            blob = f.read()
+        codec, payload = blob[:1], blob[1:]
+        if codec == ZSTD:
+            if zstandard is None:
+                raise RuntimeError("chunk is zstd-compressed; install zstandard (pip install zstandard)")
+            data = zstandard.ZstdDecompressor().decompress(payload)
+        elif codec == ZLIB:
+            data = zlib.decompress(payload)
+        else:
+            data = payload
+        if chunk_hash(data) != digest:
+            raise ValueError(f"chunk {digest} is corrupt")
+        return data
+
+    def snapshots(self):
+        """Snapshot ids, oldest first (ids are timestamps)."""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        return sorted(n[:-5] for n in os.listdir(self.snapshot_dir) if n.endswith(".json"))
+
+    def load(self, snapshot_id):
+        if snapshot_id == "latest":
+            ids = self.snapshots()
+            if not ids:
+                raise FileNotFoundError(f"no snapshots in {self.root}")
+            snapshot_id = ids[-1]
+        with open(os.path.join(self.snapshot_dir, f"{snapshot_id}.json")) as f:
+            return json.load(f)
+
+    def save(self, manifest):
+        # Written last and atomically: a crash mid-backup leaves only unreferenced chunks
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = os.path.join(self.snapshot_dir, f"{manifest['id']}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+def _is_sqlite(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+    except OSError:
+        return False
+
+def _stamp(path, st, sqlite):
+    stamp = [st.st_size, st.st_mtime_ns]
+    if sqlite:
+        # Committed pages may sit in the WAL while the main file is untouched
+        try:
+            wal = os.stat(path + "-wal")
+            stamp += [wal.st_size, wal.st_mtime_ns]
+        except OSError:
+            pass
+    return stamp
+
+def _store_stream(repo, f, totals):
+    chunks = []
+    for data in iter_chunks(f):
+        digest = chunk_hash(data)
+        written = repo.put(digest, data)
+        chunks.append([digest, len(data)])
+        with totals["lock"]:
+            totals["read"] += len(data)
+            totals["written"] += written
+            totals["new_chunks"] += 1 if written else 0
+    return chunks
+
+def _snapshot_file(repo, path, rel, st, previous, totals):
+    sqlite = _is_sqlite(path)
+    stamp = _stamp(path, st, sqlite)
+    old = previous.get(rel)
+    if old and old["stamp"] == stamp:
+        with totals["lock"]:
+            totals["unchanged"] += 1
+        return old
+
+    entry = {"path": rel, "mode": st.st_mode & 0o7777, "mtime_ns": st.st_mtime_ns, "stamp": stamp}
+    if sqlite:
+        # Consistent copy of a live database, WAL included
+        tmp = os.path.join(repo.tmp_dir, f"{threading.get_ident()}.sqlite")
+        try:
+            src = sqlite3.connect(path, timeout=30)
+            dst = sqlite3.connect(tmp)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+            with open(tmp, "rb") as f:
+                entry["chunks"] = _store_stream(repo, f, totals)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    else:
+        for attempt in range(CHANGED_RETRIES + 1):
+            with open(path, "rb") as f:
+                entry["chunks"] = _store_stream(repo, f, totals)
+            after = os.stat(path)
+            if (after.st_size, after.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                break
+            if attempt == CHANGED_RETRIES:
+                print(f"    [!] {rel} kept changing while it was read; stored the last read.")
+                entry["stamp"] = None  # never trusted as unchanged next time
+            st = after
+            entry["mtime_ns"] = st.st_mtime_ns
+    entry["size"] = sum(size for _, size in entry["chunks"])
+    with totals["lock"]:
+        totals["changed"] += 1
+    return entry
+
+def _walk(source):
+    files, dirs, links = [], [], []
+    for root, dirnames, filenames in os.walk(source):
+        rel_root = os.path.relpath(root, source)
+        for name in dirnames:
+            path = os.path.join(root, name)
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            if os.path.islink(path):
+                links.append({"path": rel, "target": os.readlink(path)})
+            else:
+                dirs.append({"path": rel, "mode": os.stat(path).st_mode & 0o7777})
+        names = set(filenames)
+        for name in filenames:
+            if any(name.endswith(s) and name[:-len(s)] in names for s in SQLITE_SIDECARS):
+                continue  # covered by the backup-API copy of the database
+            path = os.path.join(root, name)
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            if os.path.islink(path):
+                links.append({"path": rel, "target": os.readlink(path)})
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # deleted since the listing
+            files.append((path, rel, st))
+    return files, dirs, links
+
+def backup(source=SOURCE_DIR, repo_dir=REPO_DIR, jobs=JOBS, level=ZSTD_LEVEL):
+    """Takes one snapshot of `source`; returns its manifest."""
+    repo = Repository(repo_dir, level)
+    lock = repo.lock()
+    try:
+        started = time.time()
+        shutil.rmtree(repo.tmp_dir, ignore_errors=True)
+        os.makedirs(repo.tmp_dir)
+        repo.load_known()
+        ids = repo.snapshots()
+        previous = {f["path"]: f for f in repo.load(ids[-1])["files"]} if ids else {}
+
+        files, dirs, links = _walk(source)
+        totals = {"read": 0, "written": 0, "new_chunks": 0, "unchanged": 0, "changed": 0, "lock": threading.Lock()}
+        # Big files first so one large database does not start last and finish alone
+        files.sort(key=lambda f: -f[2].st_size)
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            entries = list(pool.map(lambda f: _snapshot_file(repo, f[0], f[1], f[2], previous, totals), files))
+
+        snapshot_id = time.strftime("%Y%m%d_%H%M%S", time.localtime(started))
+        if snapshot_id in ids:
+            snapshot_id += f"_{int(started * 1000) % 1000:03d}"
+        manifest = {
+            "id": snapshot_id,
+            "time": started,
+            "source": os.path.abspath(source),
+            "files": sorted(entries, key=lambda e: e["path"]),
+            "dirs": dirs,
+            "links": links,
+            "stats": {k: v for k, v in totals.items() if k != "lock"},
+        }
+        manifest["stats"]["size"] = sum(e["size"] for e in entries)
+        manifest["stats"]["seconds"] = round(time.time() - started, 3)
+        # A manifest that survives a power cut must not point at chunks that did not
+        repo.sync()
+        repo.save(manifest)
+        shutil.rmtree(repo.tmp_dir, ignore_errors=True)
+        return manifest
+    finally:
+        os.close(lock)
+
+def _remove_extraneous(target, manifest):
+    """Deletes what the snapshot does not have from `target`; returns how many entries went.
+
+    Restoring over a live directory must not leave a database's old -wal/-shm behind:
+    SQLite would replay that WAL on top of the restored file.
+    """
+    files = {e["path"] for e in manifest["files"]}
+    links = {l["path"] for l in manifest["links"]}
+    dirs = {d["path"] for d in manifest["dirs"]}
+    removed = 0
+    for root, dirnames, filenames in os.walk(target, topdown=False):
+        rel_root = os.path.relpath(root, target)
+        for name in filenames + dirnames:
+            path = os.path.join(root, name)
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            if os.path.islink(path):
+                if rel not in links:
+                    os.remove(path)
+                    removed += 1
+            elif os.path.isdir(path):
+                if rel not in dirs:
+                    shutil.rmtree(path)
+                    removed += 1
+            elif rel not in files:
+                os.remove(path)
+                removed += 1
+    return removed
+
+def restore(snapshot_id, target, repo_dir=REPO_DIR, jobs=JOBS):
+    """Writes a snapshot into `target` (created if needed), removing anything else there; returns its manifest."""
+    repo = Repository(repo_dir)
+    manifest = repo.load(snapshot_id)
+    os.makedirs(target, exist_ok=True)
+    # Backups skip -wal/-shm next to a database, so any found in the target are stale and go here
+    removed = _remove_extraneous(target, manifest)
+    for d in sorted(manifest["dirs"], key=lambda d: d["path"]):
+        os.makedirs(os.path.join(target, d["path"]), exist_ok=True)
+
+    tasks = []
+    for entry in manifest["files"]:
+        path = os.path.join(target, entry["path"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.truncate(entry["size"])
+        offset = 0
+        for digest, size in entry["chunks"]:
+            tasks.append((path, offset, digest))
+            offset += size
+
+    def write(task):
+        path, offset, digest = task
+        data = repo.get(digest)
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        written = sum(pool.map(write, tasks))
+
+    for link in manifest["links"]:
+        path = os.path.join(target, link["path"])
+        if os.path.lexists(path):
+            os.remove(path)
+        os.symlink(link["target"], path)
+    for entry in manifest["files"]:
+        path = os.path.join(target, entry["path"])
+        os.chmod(path, entry["mode"])
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    for d in manifest["dirs"]:
+        os.chmod(os.path.join(target, d["path"]), d["mode"])
+    manifest["stats"]["restored"] = written
+    manifest["stats"]["removed"] = removed
+    return manifest
+
+def select_keep(snapshots, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY,
+                keep_monthly=KEEP_MONTHLY):
+    """Ids to keep from [(id, time)]: the newest keep_last, plus the newest snapshot of each
+    of the most recent keep_daily days, keep_weekly ISO weeks and keep_monthly months."""
+    newest_first = sorted(snapshots, key=lambda s: s[1], reverse=True)
+    keep = {sid for sid, _ in newest_first[:keep_last]}
+    for fmt, count in (("%Y-%m-%d", keep_daily), ("%G-W%V", keep_weekly), ("%Y-%m", keep_monthly)):
+        buckets = set()
+        for sid, t in newest_first:
+            bucket = time.strftime(fmt, time.localtime(t))
+            if bucket not in buckets and len(buckets) < count:
+                buckets.add(bucket)
+                keep.add(sid)
+    return keep
+
+def prune(repo_dir=REPO_DIR, dry_run=False, **policy):
+    """Drops snapshots outside the retention policy and the chunks only they used.
+    Returns (removed snapshot ids, chunks deleted, bytes freed)."""
+    repo = Repository(repo_dir)
+    lock = repo.lock()
+    try:
+        manifests = {sid: repo.load(sid) for sid in repo.snapshots()}
+        keep = select_keep([(sid, m["time"]) for sid, m in manifests.items()], **policy)
+        removed = sorted(set(manifests) - keep)
+        referenced = {digest for sid in keep for entry in manifests[sid]["files"] for digest, _ in entry["chunks"]}
+        garbage = repo.load_known() - referenced
+        freed = 0
+        for digest in garbage:
+            path = repo._path(digest)
+            freed += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+        if not dry_run:
+            for sid in removed:
+                os.remove(os.path.join(repo.snapshot_dir, f"{sid}.json"))
+        return removed, len(garbage), freed
+    finally:
+        os.close(lock)
+
+def _human(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Deduplicated snapshots of the Open WebUI data directory")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("backup")
+    p.add_argument("--source", default=SOURCE_DIR)
+    p.add_argument("--repo", default=REPO_DIR)
+    p.add_argument("--jobs", type=int, default=JOBS)
+    p.add_argument("--level", type=int, default=ZSTD_LEVEL, help="zstd compression level")
+    p = sub.add_parser("list")
+    p.add_argument("--repo", default=REPO_DIR)
+    p = sub.add_parser("restore")
+    p.add_argument("snapshot", help="Snapshot id or 'latest'")
+    p.add_argument("target", help="Directory to restore into (stop Open WebUI before restoring over its data)")
+    p.add_argument("--repo", default=REPO_DIR)
+    p.add_argument("--jobs", type=int, default=JOBS)
+    p.add_argument("--force", action="store_true", help="Restore into a non-empty directory, deleting what the snapshot does not have")
+    p = sub.add_parser("prune")
+    p.add_argument("--repo", default=REPO_DIR)
+    p.add_argument("--keep-last", type=int, default=KEEP_LAST)
+    p.add_argument("--keep-daily", type=int, default=KEEP_DAILY)
+    p.add_argument("--keep-weekly", type=int, default=KEEP_WEEKLY)
+    p.add_argument("--keep-monthly", type=int, default=KEEP_MONTHLY)
+    p.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        if args.cmd == "backup":
+            if not os.path.isdir(args.source):
+                print(f"[!] {args.source} does not exist.")
+                sys.exit(1)
+            if np is None:
+                print("    [!] numpy not installed: fixed-size chunks (pip install numpy for better dedup).")
+            print(f"[*] Snapshot of {args.source} -> {args.repo} ({args.jobs} threads, "
+                  f"{'zstd' if zstandard else 'zlib'})...")
+            manifest = backup(args.source, args.repo, args.jobs, args.level)
+            s = manifest["stats"]
+            print(f"    [OK] Snapshot {manifest['id']}: {len(manifest['files'])} files, {_human(s['size'])}; "
+                  f"{s['unchanged']} unchanged, {s['changed']} read ({_human(s['read'])}), "
+                  f"{s['new_chunks']} new chunks, {_human(s['written'])} written in {s['seconds']:.1f}s.")
+
+        elif args.cmd == "list":
+            repo = Repository(args.repo)
+            for sid in repo.snapshots():
+                s = repo.load(sid)["stats"]
+                print(f"    {sid:<22} {_human(s['size']):>10}  +{_human(s['written']):>10} new  {s['changed']:>6} files changed")
+            used = sum(os.path.getsize(repo._path(d)) for d in repo.load_known())
+            print(f"[OK] {len(repo.snapshots())} snapshots, {len(repo.known)} chunks, {_human(used)} on disk.")
+
+        elif args.cmd == "restore":
+            if os.path.isdir(args.target) and os.listdir(args.target) and not args.force:
+                print(f"[!] {args.target} is not empty (use --force to restore into it).")
+                sys.exit(1)
+            manifest = restore(args.snapshot, args.target, args.repo, args.jobs)
+            print(f"[OK] Restored snapshot {manifest['id']} ({len(manifest['files'])} files, "
+                  f"{_human(manifest['stats']['restored'])}) to {args.target}; "
+                  f"removed {manifest['stats']['removed']} entries not in the snapshot.")
+
+        elif args.cmd == "prune":
+            removed, chunks, freed = prune(args.repo, args.dry_run, keep_last=args.keep_last,
+                                           keep_daily=args.keep_daily, keep_weekly=args.keep_weekly,
+                                           keep_monthly=args.keep_monthly)
+            verb = "Would remove" if args.dry_run else "Removed"
+            for sid in removed:
+                print(f"    [-] {sid}")
+            print(f"[OK] {verb} {len(removed)} snapshots and {chunks} chunks ({_human(freed)}).")
+    except (RuntimeError, FileNotFoundError, ValueError) as e:
+        print(f"[!] {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -5,29 +5,40 @@ set -e
 
 echo "=== Content Update Routine ==="
 
-# 1. Batch Move (Bypassing interactive civ_ingest.sh for mass update)
-echo "[*] Moving files from Incoming to Library..."
+# 1. Batch Ingest (names and categories come from each ZIM's own metadata)
+echo "[*] Ingesting files from Incoming into the Library..."
 if [ -n "$(ls -A /opt/civilization/incoming/*.zim 2>/dev/null)" ]; then
-    mkdir -p /opt/civilization/library/zims
-    mv /opt/civilization/incoming/*.zim /opt/civilization/library/zims/
-    echo "    [OK] ZIM files moved."
+    python3 "$(dirname "$0")/zim_ingest.py" batch || echo "    [!] Some files were rejected (see incoming/rejected/) or could not be decoded (see above)."
 else
     echo "    [!] No ZIM files found in incoming/."
 fi
 
-# 2. Reload Services if needed
+# 2. Publish to Kiwix (library.xml swap, no container restart)
 echo ""
-echo "[*] Restarting affected services..."
-echo "    Restarting Kiwix (civ_library) to load new ZIMs..."
-docker restart civ_library
+echo "[*] Updating the Kiwix library..."
+python3 "$(dirname "$0")/kiwix_library.py" sync
 
-# 3. Check Status
+# 3. Refresh semantic indexes of books that already have one (only changed passages are embedded)
+if [ -d /opt/civilization/index/semantic ]; then
+    echo ""
+    echo "[*] Updating semantic indexes..."
+    python3 "$(dirname "$0")/semantic_index.py" build --indexed || echo "    [!] Index update incomplete; the next run resumes it."
+fi
+
+# 3b. Pick up new or changed PDFs in the PDF library index, if one was built
+if [ -d /opt/civilization/index/semantic/pdf_library ]; then
+    echo ""
+    echo "[*] Updating the PDF library index..."
+    python3 "$(dirname "$0")/pdf_ingest.py" || echo "    [!] PDF ingest incomplete; the next run resumes it."
+fi
+
+# 4. Check Status
 echo "[*] Verifying Service Health..."
-sleep 5
+sleep 2
 if curl -s -o /dev/null -w "%{http_code}" http://localhost:8080 | grep -q "200\|301\|302"; then
-    echo "    [OK] Kiwix is back online."
+    echo "    [OK] Kiwix is online."
 else
-    echo "    [FAIL] Kiwix did not respond after restart."
+    echo "    [FAIL] Kiwix did not respond."
 fi
 
 echo "=== Update Complete ==="
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Unattended ZIM ingestion: incoming/ -> library/zims/<category>/<canonical name>.
+
+Everything needed to file a ZIM comes from the archive itself. The 80-byte header
+gives the pointer tables; a binary search of the URL pointer list finds the
+M/Title, M/Language, M/Date, M/Name, M/Flavour and M/Tags entries, and their blobs
+are read from the front of their cluster. That is a few KB of seeks per file, no
+matter how large the archive is.
+
+The canonical name follows ORGANIZATION_MANUAL.md ([Source]_[Language]_[Topic]_[Date].zim)
+and the category comes from the `_category:` tag Kiwix embeds, or the name.
+Files are structurally validated, then moved without ever clobbering: a hardlink
+to the destination plus unlink of the source, or a copy to a temp file in the
+destination directory plus link when incoming/ is on another filesystem.
+
+Files still being written (shorter than the header says) are left alone, and so are
+files this host cannot decode (zstd metadata without zstandard or libzim). Invalid
+files, duplicates and name conflicts go to incoming/rejected/.
+
+Usage:
+    python3 maintenance/zim_ingest.py batch [--jobs 4] [--dry-run]
+    python3 maintenance/zim_ingest.py watch [--on-ingest "python3 maintenance/kiwix_library.py sync"]
+    python3 maintenance/zim_ingest.py info FILE.zim
+"""
+import ctypes
+import errno
+import hashlib
+import lzma
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import checksum_cache
+import mirror_catalog
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from libzim.reader import Archive
+except ImportError:
+    Archive = None
+
+CIV_ROOT = os.getenv("CIV_ROOT", "/opt/civilization")
+INCOMING_DIR = os.path.join(CIV_ROOT, "incoming")
+LIBRARY_DIR = os.path.join(CIV_ROOT, "library", "zims")
+REJECTED = "rejected"
+DEFAULT_JOBS = 4
+POLL_INTERVAL = 5  # seconds, when inotify is unavailable
+
+ZIM_MAGIC = 72173914
+HEADER = struct.Struct("<IHH16sIIQQQQIIQ")
+DIRENT_READ = 256  # metadata URLs are short; longer ones only need their prefix compared
+BLOB_READ = 64 * 1024
+METADATA_KEYS = ("Title", "Description", "Language", "Date", "Name", "Flavour", "Tags", "Creator", "Publisher")
+
+# Kiwix `_category:` tag (or mirror directory) -> library subfolder
+CATEGORY_MAP = {
+    "wikipedia": "encyclopedia", "wikimed": "encyclopedia", "wikivoyage": "encyclopedia",
+    "wiktionary": "encyclopedia", "wikiquote": "encyclopedia", "wikisource": "encyclopedia",
+    "wikinews": "encyclopedia", "wikiversity": "encyclopedia", "vikidia": "encyclopedia",
+    "stack_exchange": "tech", "devdocs": "tech", "ifixit": "tech", "freecodecamp": "tech",
+    "gutenberg": "books", "wikibooks": "books", "libretexts": "books",
+}
+# Fallback when a ZIM carries no category tag: first match on the canonical name wins
+CATEGORY_RULES = [
+    ("encyclopedia", re.compile(r"^(wiki(pedia|med|voyage|quote|source|news|versity)|wiktionary|britannica|vikidia)")),
+    ("tech", re.compile(r"stackexchange|stackoverflow|superuser|serverfault|askubuntu|archlinux|devdocs|ifixit|freecodecamp|docs")),
+    ("books", re.compile(r"^(gutenberg|wikibooks|libretexts|openstax)")),
+]
+# ZIM Language is ISO 639-3; file names use the two-letter code where one exists
+LANG_639_1 = {
+    "eng": "en", "fra": "fr", "deu": "de", "spa": "es", "ita": "it", "por": "pt", "rus": "ru",
+    "zho": "zh", "jpn": "ja", "ara": "ar", "hin": "hi", "nld": "nl", "pol": "pl", "tur": "tr",
+}
+
+class ZimError(Exception):
+    pass
+
+class Incomplete(ZimError):
+    """The file is shorter than its header says: still being copied or downloaded."""
+
+class MissingDecoder(ZimError):
+    """The file needs a decompressor this host lacks (zstandard or libzim): not the file's fault."""
+
+def _read(f, offset, length):
+    return os.pread(f.fileno(), length, offset)
+
+def read_header(f, size):
+    raw = _read(f, 0, HEADER.size)
+    if len(raw) < HEADER.size:
+        raise Incomplete("shorter than a ZIM header")
+    (magic, major, minor, uuid, entries, clusters, url_ptr, title_ptr, cluster_ptr,
+     mime_list, main_page, layout_page, checksum_pos) = HEADER.unpack(raw)
+    if magic != ZIM_MAGIC:
+        raise ZimError("not a ZIM file (bad magic number)")
+    if major not in (5, 6):
+        raise ZimError(f"unsupported ZIM version {major}.{minor}")
+    if checksum_pos + 16 > size:
+        raise Incomplete(f"{size} of {checksum_pos + 16} bytes present")
+    for name, pos, length in (("URL pointer list", url_ptr, 8 * entries),
+                              # 6.1+ files drop the title list in favour of an X/ entry
+                              ("title pointer list", title_ptr if title_ptr != 2 ** 64 - 1 else url_ptr, 4 * entries),
+                              ("cluster pointer list", cluster_ptr, 8 * clusters),
+                              ("MIME type list", mime_list, 1)):
+        if pos < HEADER.size or pos + length > checksum_pos:
+            raise ZimError(f"{name} outside the file ({pos})")
+    return {"version": f"{major}.{minor}", "uuid": uuid.hex(), "entries": entries,
+            "clusters": clusters, "url_ptr": url_ptr, "cluster_ptr": cluster_ptr,
+            "checksum_pos": checksum_pos}
+
+def _dirent(f, offset):
+    raw = _read(f, offset, DIRENT_READ)
+    if len(raw) < 8:
+        raise ZimError(f"directory entry at {offset} truncated")
+    mime, _, namespace = struct.unpack_from("<HBc", raw)
+    if mime == 0xFFFF:
+        cluster = blob = None
+        pos = 12
+    elif mime >= 0xFFFD:
+        cluster = blob = None
+        pos = 8
+    else:
+        cluster, blob = struct.unpack_from("<II", raw, 8)
+        pos = 16
+    url = raw[pos:raw.find(b"\0", pos)] if b"\0" in raw[pos:] else raw[pos:]
+    return namespace + url, cluster, blob
+
+def _find(f, header, key):
+    # URL pointer list is sorted by namespace + url
+    lo, hi = 0, header["entries"]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        (offset,) = struct.unpack("<Q", _read(f, header["url_ptr"] + 8 * mid, 8))
+        found, cluster, blob = _dirent(f, offset)
+        if found == key:
+            return cluster, blob
+        if found < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return None, None
+
+def _blob(f, header, cluster, blob):
+    if cluster >= header["clusters"]:
+        raise ZimError(f"cluster {cluster} out of range")
+    start, end = struct.unpack("<QQ", _read(f, header["cluster_ptr"] + 8 * cluster, 16))
+    if cluster == header["clusters"] - 1:
+        end = header["checksum_pos"]
+    info = _read(f, start, 1)[0]
+    compression, width = info & 0x0F, (8 if info & 0x10 else 4)
+    fmt = "<Q" if width == 8 else "<I"
+
+    if compression in (0, 1):
+        base = start + 1
+        first, second = (struct.unpack_from(fmt, _read(f, base + width * blob, width))[0],
+                         struct.unpack_from(fmt, _read(f, base + width * (blob + 1), width))[0])
+        return _read(f, base + first, second - first)
+
+    # Compressed: decompress only as far as the blob's end
+    if compression == 4:
+        decompressor = lzma.LZMADecompressor()
+    elif compression == 5:
+        if zstandard is None:
+            raise MissingDecoder("zstd-compressed metadata, and neither zstandard nor libzim is installed")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        raise ZimError(f"cluster compression {compression} not supported here")
+    data = b""
+    pos = start + 1
+    needed = width * (blob + 2)
+    while pos < end:
+        chunk = _read(f, pos, min(BLOB_READ, end - pos))
+        if not chunk:
+            break
+        pos += len(chunk)
+        data += decompressor.decompress(chunk)
+        if len(data) >= needed:
+            first = struct.unpack_from(fmt, data, width * blob)[0]
+            second = struct.unpack_from(fmt, data, width * (blob + 1))[0]
+            needed = max(needed, second)
+            if len(data) >= second:
+                return data[first:second]
+    raise ZimError(f"cluster {cluster} truncated")
+
+def _metadata_libzim(path):
+    archive = Archive(path)
+    meta = {}
+    for key in METADATA_KEYS:
+        try:
+            meta[key] = bytes(archive.get_metadata(key)).decode("utf-8", "replace")
+        except (KeyError, RuntimeError):
+            pass
+    return meta
+
+def read_zim(path):
+    """Header fields plus the metadata entries; raises ZimError / Incomplete / MissingDecoder."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = read_header(f, size)
+        meta = {}
+        for key in METADATA_KEYS:
+            cluster, blob = _find(f, header, b"M" + key.encode())
+            if cluster is None:
+                continue
+            try:
+                meta[key] = _blob(f, header, cluster, blob).decode("utf-8", "replace").strip()
+            except MissingDecoder:
+                # zstd metadata cluster without the zstandard module: let libzim read it
+                if Archive is None:
+                    raise
+                meta = _metadata_libzim(path)
+                break
+    header["size"] = size
+    header["metadata"] = meta
+    return header
+
+def verify_md5(path, checksum_pos):
+    """Full-file check against the MD5 stored in the last 16 bytes."""
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        remaining = checksum_pos
+        while remaining:
+            chunk = f.read(min(checksum_cache.READ_CHUNK, remaining))
+            if not chunk:
+                return False
+            h.update(chunk)
+            remaining -= len(chunk)
+        return h.digest() == f.read(16)
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9.\-]+", "_", (text or "").lower()).strip("_")
+
+def canonical_name(meta, filename):
+    """[Source]_[Language]_[Topic]_[Date].zim from the metadata, filename as fallback."""
+    book, _, file_lang, _, file_date = mirror_catalog.parse_name(filename)
+    name = _slug(meta.get("Name")) or _slug(book)
+    flavour = _slug(meta.get("Flavour"))
+    if flavour and not name.endswith("_" + flavour):
+        name = f"{name}_{flavour}"
+
+    if not re.match(r"^[^_]+_[a-z]{2,3}(-[a-z]+)?_", name):
+        # Not Kiwix style (e.g. a home-made ZIM): add language and topic
+        lang = (meta.get("Language") or "").split(",")[0].strip().lower()
+        lang = LANG_639_1.get(lang, lang) or file_lang or "mul"
+        name = f"{name.split('_')[0]}_{lang}_{'_'.join(name.split('_')[1:]) or 'all'}"
+
+    m = re.match(r"(\d{4})-(\d{2})", meta.get("Date") or "")
+    date = f"{m.group(1)}-{m.group(2)}" if m else file_date
+    if not date:
+        raise ZimError("no Date metadata and no date in the file name")
+    return f"{name}_{date}.zim"
+
+def category_for(meta, name):
+    for tag in (meta.get("Tags") or "").split(";"):
+        if tag.startswith("_category:"):
+            category = CATEGORY_MAP.get(tag.split(":", 1)[1].strip())
+            if category:
+                return category
+    for category, pattern in CATEGORY_RULES:
+        if pattern.search(name):
+            return category
+    return "other"
+
+def _zim_uuid(path):
+    try:
+        with open(path, "rb") as f:
+            return HEADER.unpack(_read(f, 0, HEADER.size))[3].hex()
+    except (OSError, struct.error):
+        return None
+
+def move_into_place(src, dest, replace=False):
+    """Move without clobbering (unless `replace`); atomic on the destination side."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    digest = checksum_cache.lookup(src)
+    try:
+        if replace:
+            os.replace(src, dest)
+        else:
+            os.link(src, dest)  # fails if dest exists
+            os.unlink(src)
+    except OSError as e:
+        if e.errno != errno.EXDEV:  # incoming/ on another filesystem: copy instead
+            raise
+        tmp = os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.ingest")
+        shutil.copyfile(src, tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        try:
+            if replace:
+                os.replace(tmp, dest)
+            else:
+                os.link(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        os.unlink(src)
+    os.chmod(dest, 0o644)
+    checksum_cache.forget(src)
+    if digest:
+        checksum_cache.record(dest, digest)
+
+def _reject(path, incoming, reason, dry_run):
+    print(f"    [!] {os.path.basename(path)}: {reason}")
+    if not dry_run:
+        rejected = os.path.join(incoming, REJECTED)
+        try:
+            os.makedirs(rejected, exist_ok=True)
+            os.replace(path, os.path.join(rejected, os.path.basename(path)))
+        except OSError as e:
+            print(f"    [!] {os.path.basename(path)}: could not move to {REJECTED}/ ({e}), left in place")
+    return "rejected"
+
+def ingest(path, incoming=INCOMING_DIR, library=LIBRARY_DIR, check_md5=False, replace=False, dry_run=False):
+    """File one ZIM. Returns 'ingested', 'waiting' (still being written), 'undecodable' or 'rejected'."""
+    filename = os.path.basename(path)
+    try:
+        zim = read_zim(path)
+        if check_md5 and not verify_md5(path, zim["checksum_pos"]):
+            raise ZimError("MD5 checksum mismatch")
+        name = canonical_name(zim["metadata"], filename)
+    except Incomplete as e:
+        print(f"    [*] {filename}: incomplete ({e}), leaving it for now")
+        return "waiting"
+    except MissingDecoder as e:
+        print(f"    [!] {filename}: {e}; leaving it in place")
+        return "undecodable"
+    except (ZimError, OSError, struct.error) as e:
+        return _reject(path, incoming, str(e), dry_run)
+
+    category = category_for(zim["metadata"], name)
+    dest = os.path.join(library, category, name)
+    if os.path.exists(dest) and not replace:
+        if _zim_uuid(dest) == zim["uuid"]:
+            return _reject(path, incoming, f"already in the library as {category}/{name}", dry_run)
+        return _reject(path, incoming, f"{category}/{name} exists with different content (use --replace)", dry_run)
+
+    title = zim["metadata"].get("Title", "")
+    if dry_run:
+        print(f"    [DRY] {filename} -> {category}/{name}  ({title})")
+        return "ingested"
+    try:
+        move_into_place(path, dest, replace)
+    except FileExistsError:
+        return _reject(path, incoming, f"{category}/{name} appeared while ingesting", dry_run)
+    except OSError as e:
+        # EPERM/ENOTSUP on the hardlink, ENOSPC mid-copy, EACCES: this file fails, the batch goes on
+        return _reject(path, incoming, f"could not move to {category}/{name}: {e}", dry_run)
+    print(f"    [OK] {filename} -> {category}/{name}  ({title})")
+    return "ingested"
+
+def pending(incoming=INCOMING_DIR):
+    return sorted(os.path.join(incoming, n) for n in os.listdir(incoming)
+                  if n.endswith(".zim") and os.path.isfile(os.path.join(incoming, n)))
+
+def batch(incoming=INCOMING_DIR, library=LIBRARY_DIR, jobs=DEFAULT_JOBS, **options):
+    """Ingest everything in `incoming`, `jobs` files at a time. Returns {status: count}."""
+    files = pending(incoming)
+    counts = {"ingested": 0, "waiting": 0, "undecodable": 0, "rejected": 0}
+    if not files:
+        return counts
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for status in pool.map(lambda p: ingest(p, incoming, library, **options), files):
+            counts[status] += 1
+    return counts
+
+def _inotify(directory):
+    """Generator of file names closed-after-write or moved into `directory`; None if unsupported."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    IN_CLOSE_WRITE, IN_MOVED_TO = 0x08, 0x80
+    if libc.inotify_add_watch(fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+
+    def events():
+        while True:
+            data = os.read(fd, 64 * 1024)
+            pos = 0
+            while pos < len(data):
+                _, _, _, length = struct.unpack_from("iIII", data, pos)
+                name = data[pos + 16:pos + 16 + length].rstrip(b"\0").decode(errors="replace")
+                pos += 16 + length
+                yield name
+    return events()
+
+def _polling(directory):
+    # Fallback: report a file once its size has been stable for one interval
+    sizes = {}
+    while True:
+        time.sleep(POLL_INTERVAL)
+        current = {}
+        for name in os.listdir(directory):
+            try:
+                current[name] = os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                continue
+            if sizes.get(name) == current[name]:
+                yield name
+        sizes = current
+
+def watch(incoming=INCOMING_DIR, library=LIBRARY_DIR, jobs=DEFAULT_JOBS, on_ingest=None, **options):
+    """Ingest whatever is there, then every ZIM that lands in `incoming` afterwards."""
+    os.makedirs(incoming, exist_ok=True)
+    events = _inotify(incoming)
+    if events is None:
+        print(f"[!] inotify unavailable, polling every {POLL_INTERVAL}s.")
+        events = _polling(incoming)
+    print(f"[*] Watching {incoming} (Ctrl+C to stop)...")
+
+    busy = set()
+    lock = threading.Lock()
+
+    def handle(path):
+        try:
+            if ingest(path, incoming, library, **options) == "ingested" and on_ingest:
+                subprocess.run(on_ingest, shell=True)
+        finally:
+            with lock:
+                busy.discard(path)
+
+    def submit(path):
+        with lock:
+            if path in busy:
+                return
+            busy.add(path)
+        pool.submit(handle, path)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for path in pending(incoming):
+            submit(path)
+        try:
+            for name in events:
+                path = os.path.join(incoming, name)
+                if name.endswith(".zim") and os.path.isfile(path):
+                    submit(path)
+        except KeyboardInterrupt:
+            print("\n[*] Stopping watcher.")
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Ingest ZIM files from incoming/ using their own metadata")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for cmd in ("batch", "watch"):
+        p = sub.add_parser(cmd)
+        p.add_argument("--incoming", default=INCOMING_DIR)
+        p.add_argument("--library", default=LIBRARY_DIR)
+        p.add_argument("--jobs", type=int, default=DEFAULT_JOBS)
+        p.add_argument("--md5", action="store_true", help="Also verify the embedded MD5 (reads the whole file)")
+        p.add_argument("--replace", action="store_true", help="Overwrite a library file with the same name")
+    sub.choices["batch"].add_argument("--dry-run", action="store_true")
+    sub.choices["watch"].add_argument("--on-ingest", metavar="CMD", help="Shell command run after each ingested file")
+    p = sub.add_parser("info")
+    p.add_argument("file")
+    args = parser.parse_args()
+
+    if args.cmd == "info":
+        try:
+            zim = read_zim(args.file)
+        except MissingDecoder as e:
+            print(f"[!] {args.file}: {e} (pip install -r requirements.txt)")
+            sys.exit(1)
+        except ZimError as e:
+            print(f"[!] {args.file}: {e}")
+            sys.exit(1)
+        name = canonical_name(zim["metadata"], os.path.basename(args.file))
+        print(f"Version:  {zim['version']}  UUID: {zim['uuid']}  Entries: {zim['entries']}")
+        for key, value in zim["metadata"].items():
+            print(f"{key + ':':<10}{value}")
+        print(f"Target:   {category_for(zim['metadata'], name)}/{name}")
+        return
+
+    options = {"check_md5": args.md5, "replace": args.replace}
+    if args.cmd == "watch":
+        watch(args.incoming, args.library, args.jobs, args.on_ingest, **options)
+        return
+
+    if not os.path.isdir(args.incoming):
+        print(f"[!] {args.incoming} does not exist.")
+        sys.exit(1)
+    print(f"=== Ingesting ZIMs from {args.incoming} ===")
+    counts = batch(args.incoming, args.library, args.jobs, dry_run=args.dry_run, **options)
+    print(f"[*] {counts['ingested']} ingested, {counts['waiting']} still being written, "
+          f"{counts['rejected']} moved to {os.path.join(args.incoming, REJECTED)}")
+    if counts["undecodable"]:
+        print(f"[!] {counts['undecodable']} left in {args.incoming}: install zstandard (pip install -r requirements.txt)")
+    sys.exit(1 if counts["rejected"] or counts["undecodable"] else 0)
+
+if __name__ == "__main__":
+    main()
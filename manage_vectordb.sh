@@ -4,11 +4,12 @@ set -e
 DATA_DIR="/opt/civilization/openwebui"
 BACKUP_DIR="/opt/civilization/backups/vectordb"
 CONTAINER_NAME="civ_webui"
+SNAPSHOT="python3 $(dirname "$0")/maintenance/snapshot.py"
 
 COMMAND=$1
 
 function show_usage {
-    echo "Usage: $0 {status|backup|prune}"
+    echo "Usage: $0 {status|backup|list|restore <snapshot|latest> <target>|prune [--dry-run]}"
     exit 1
 }
 
@@ -28,20 +29,29 @@ if [ "$COMMAND" == "status" ]; then
 
 elif [ "$COMMAND" == "backup" ]; then
     echo "=== Vector DB Backup ==="
-    mkdir -p "$BACKUP_DIR"
-    TIMESTAMP=$(date +%Y%m%d_%H%M%S)
-    BACKUP_FILE="$BACKUP_DIR/openwebui_data_$TIMESTAMP.tar.gz"
-    
-    echo "[*] Creating backup at $BACKUP_FILE..."
-    # Warning: Ideally stick to hot backup or stop service. For simplicity, tar implementation.
-    tar -czf "$BACKUP_FILE" -C "/opt/civilization" "openwebui"
-    
-    echo "    [OK] Backup created."
-    ls -lh "$BACKUP_FILE"
+    # Incremental and deduplicated: only changed files are read, only new chunks are written.
+    # Databases are copied with SQLite's backup API, so the service can keep running.
+    $SNAPSHOT backup --source "$DATA_DIR" --repo "$BACKUP_DIR"
+
+elif [ "$COMMAND" == "list" ]; then
+    echo "=== Vector DB Snapshots ==="
+    $SNAPSHOT list --repo "$BACKUP_DIR"
+
+elif [ "$COMMAND" == "restore" ]; then
+    echo "=== Vector DB Restore ==="
+    if [ -z "$2" ] || [ -z "$3" ]; then
+        show_usage
+    fi
+    if [ "$(realpath -m "$3")" == "$(realpath -m "$DATA_DIR")" ] && docker ps --format '{{.Names}}' | grep -q "^$CONTAINER_NAME$"; then
+        echo "[!] $CONTAINER_NAME is running. Stop it before restoring over its data: docker stop $CONTAINER_NAME"
+        exit 1
+    fi
+    $SNAPSHOT restore "$2" "$3" --repo "$BACKUP_DIR" "${@:4}"
 
 elif [ "$COMMAND" == "prune" ]; then
     echo "=== Vector DB Prune ==="
-    echo "[!] Not implemented safely yet. managing deletions via Open WebUI interface is recommended."
+    # Keeps the last 5 snapshots plus one per day (7), week (4) and month (6); see snapshot.py prune --help
+    $SNAPSHOT prune --repo "$BACKUP_DIR" "${@:2}"
 
 else
     show_usage
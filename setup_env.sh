@@ -98,5 +98,21 @@ else
     echo "    [OK] All directories exist."
 fi
 
+# 5. Kiwix library (kiwix-serve starts from library.xml, see docker-compose.yml)
+echo "[*] Writing Kiwix library.xml..."
+# Kiwix ZIMs store their metadata zstd-compressed; without a decoder no book can be listed
+if python3 -c "import zstandard" &> /dev/null || python3 -c "import libzim.reader" &> /dev/null; then
+    echo "    [OK] zstd decoder found."
+else
+    echo "    [ERROR] Python module 'zstandard' not found. Run: pip install -r requirements.txt"
+    exit 1
+fi
+if [ -d "$CIV_ROOT/library/zims" ]; then
+    CIV_ROOT="$CIV_ROOT" python3 "$(dirname "$0")/maintenance/kiwix_library.py" sync \
+        --library "$CIV_ROOT/library/zims" | sed 's/^/    /'
+else
+    echo "    [WARN] $CIV_ROOT/library/zims missing, skipping."
+fi
+
 echo ""
 echo "=== Setup Complete ==="
@@ -0,0 +1,474 @@
+#!/bin/bash
+set -e
+
+TEST_DIR="./test_data/downloader"
+PORT="${PORT:-18765}"
+URL="http://127.0.0.1:$PORT/test.zim"
+export CIV_CHECKSUM_DB="$TEST_DIR/checksums.db"
+
+echo "=== Testing Ranged Downloader ==="
+
+rm -rf "$TEST_DIR"
+mkdir -p "$TEST_DIR/srv" "$TEST_DIR/out"
+
+# 20 MB of random data to serve
+head -c 20971520 /dev/urandom > "$TEST_DIR/srv/test.zim"
+EXPECTED=$(sha256sum "$TEST_DIR/srv/test.zim" | cut -d' ' -f1)
+
+# Minimal range-capable server. Every 5th ranged response is cut off halfway
+# to exercise segment retries; bytes sent are logged for the resume check.
+python3 - "$TEST_DIR/srv" "$PORT" <<'EOF' &
+import os, sys, threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+root, port = sys.argv[1], int(sys.argv[2])
+count = {"n": 0}
+lock = threading.Lock()
+
+class Handler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, directory=root, **kw)
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, code, length, size):
+        self.send_response(code)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"%d"' % int(os.path.getmtime(self.translate_path(self.path))))
+        if code == 206:
+            self.send_header("Content-Range", f"bytes {self.start}-{self.end}/{size}")
+        self.end_headers()
+
+    def do_HEAD(self):
+        size = os.path.getsize(self.translate_path(self.path))
+        self._headers(200, size, size)
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        size = os.path.getsize(path)
+        rng = self.headers.get("Range")
+        if not rng:
+            self._headers(200, size, size)
+            self.start, self.end = 0, size - 1
+        else:
+            start, end = rng.split("=")[1].split("-")
+            self.start, self.end = int(start), min(int(end), size - 1)
+            self._headers(206, self.end - self.start + 1, size)
+        with lock:
+            count["n"] += 1
+            drop = rng is not None and count["n"] % 5 == 0
+        length = self.end - self.start + 1
+        with open(path, "rb") as f:
+            f.seek(self.start)
+            data = f.read(length // 2 if drop else length)
+        self.wfile.write(data)
+        with open(os.path.join(root, "sent.log"), "a") as log:
+            log.write(f"{len(data)}\n")
+        if drop:
+            self.close_connection = True
+
+ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+EOF
+SERVER_PID=$!
+trap 'kill $SERVER_PID 2>/dev/null || true' EXIT
+sleep 1
+
+# 1. Full download over several connections
+echo "[*] Downloading with 4 connections, 1 MB segments..."
+OUTPUT=$(python3 maintenance/range_download.py "$URL" "$TEST_DIR/out/test.zim" -c 4 --segment-mb 1)
+
+if [ "$(sha256sum "$TEST_DIR/out/test.zim" | cut -d' ' -f1)" == "$EXPECTED" ]; then
+    echo "    [PASS] Checksum matches (with dropped segments retried)."
+else
+    echo "    [FAIL] Checksum mismatch."
+    exit 1
+fi
+
+if echo "$OUTPUT" | grep -q "sha256 $EXPECTED"; then
+    echo "    [PASS] SHA-256 computed during download."
+else
+    echo "    [FAIL] Streamed SHA-256 wrong or missing."
+    exit 1
+fi
+
+if [ ! -e "$TEST_DIR/out/test.zim.part" ] && [ ! -e "$TEST_DIR/out/test.zim.part.json" ]; then
+    echo "    [PASS] Part file and journal cleaned up."
+else
+    echo "    [FAIL] Leftover .part / journal."
+    exit 1
+fi
+
+# 2. Resume: pretend a crash after the first 12 segments
+echo ""
+echo "[*] Testing resume from journal..."
+python3 - "$URL" "$TEST_DIR/out/test.zim" <<'EOF'
+import sys
+sys.path.insert(0, "maintenance")
+import range_download
+
+url, dest = sys.argv[1], sys.argv[2]
+info = range_download.probe(url)
+info["segment_size"] = 1048576
+part = dest + ".part"
+with open(dest, "rb") as src, open(part, "wb") as out:
+    out.write(src.read(12 * 1048576))
+    out.truncate(info["size"])
+journal = range_download._Journal(part + ".json", info)
+journal.done = set(range(12))
+journal.save()
+EOF
+rm "$TEST_DIR/out/test.zim" "$TEST_DIR/srv/sent.log"
+
+python3 maintenance/range_download.py "$URL" "$TEST_DIR/out/test.zim" -c 4 --segment-mb 1 > /dev/null
+SENT=$(awk '{s+=$1} END {print s}' "$TEST_DIR/srv/sent.log")
+
+if [ "$(sha256sum "$TEST_DIR/out/test.zim" | cut -d' ' -f1)" == "$EXPECTED" ]; then
+    echo "    [PASS] Resumed file checksum matches."
+else
+    echo "    [FAIL] Resumed file corrupt."
+    exit 1
+fi
+
+# 8 MB remaining, plus the halves of dropped responses
+if [ "$SENT" -lt 12582912 ]; then
+    echo "    [PASS] Only missing segments re-fetched ($SENT bytes)."
+else
+    echo "    [FAIL] Re-downloaded too much ($SENT bytes)."
+    exit 1
+fi
+
+# A journal whose .part is gone (deleted by hand or by a cleanup) must not be trusted
+python3 - "$URL" "$TEST_DIR/out/orphan.zim" <<'EOF'
+import sys
+sys.path.insert(0, "maintenance")
+import range_download
+
+url, dest = sys.argv[1], sys.argv[2]
+info = range_download.probe(url)
+info["segment_size"] = 1048576
+journal = range_download._Journal(dest + ".part.json", info)
+journal.done = set(range(12))
+journal.save()
+EOF
+python3 maintenance/range_download.py "$URL" "$TEST_DIR/out/orphan.zim" -c 4 --segment-mb 1 > /dev/null
+if [ "$(sha256sum "$TEST_DIR/out/orphan.zim" | cut -d' ' -f1)" == "$EXPECTED" ]; then
+    echo "    [PASS] Journal without its .part ignored; file fetched in full."
+else
+    echo "    [FAIL] Trusted a journal whose .part was missing (zero-filled segments)."
+    exit 1
+fi
+rm -f "$TEST_DIR/out/orphan.zim"
+
+# 3. Checksum cache: hit for the downloaded file, miss once it changes
+echo ""
+echo "[*] Testing checksum cache..."
+if python3 -c "
+import sys; sys.path.insert(0, 'maintenance')
+import checksum_cache
+sys.exit(0 if checksum_cache.lookup('$TEST_DIR/out/test.zim') == '$EXPECTED' else 1)"; then
+    echo "    [PASS] Download recorded its digest."
+else
+    echo "    [FAIL] Digest not cached."
+    exit 1
+fi
+
+python3 maintenance/checksum_cache.py "$TEST_DIR/out/test.zim" --verify "$EXPECTED" > /dev/null
+echo "x" >> "$TEST_DIR/out/test.zim"
+if ! python3 maintenance/checksum_cache.py "$TEST_DIR/out/test.zim" --verify "$EXPECTED" > /dev/null; then
+    echo "    [PASS] Modified file re-hashed (stale entry ignored)."
+else
+    echo "    [FAIL] Stale cache entry used."
+    exit 1
+fi
+
+# 4. Scheduler: 3 files, 2 at a time, 8 MB/s total cap
+echo ""
+echo "[*] Testing download scheduler..."
+for n in a b c; do head -c 4194304 /dev/urandom > "$TEST_DIR/srv/$n.zim"; done
+mkdir -p "$TEST_DIR/sched"
+START=$(date +%s%N)
+python3 maintenance/download_scheduler.py --dir "$TEST_DIR/sched" --jobs 2 --bwlimit 8 --reserve-gb 0 -c 2 \
+    "http://127.0.0.1:$PORT/a.zim" "http://127.0.0.1:$PORT/b.zim" "http://127.0.0.1:$PORT/c.zim" > /dev/null
+ELAPSED_MS=$(( ($(date +%s%N) - START) / 1000000 ))
+
+for n in a b c; do
+    if ! cmp -s "$TEST_DIR/srv/$n.zim" "$TEST_DIR/sched/$n.zim"; then
+        echo "    [FAIL] $n.zim differs."
+        exit 1
+    fi
+done
+echo "    [PASS] All scheduled files match."
+
+# 12 MB at 8 MB/s (minus the initial 1 s burst) cannot finish in under ~0.4 s
+if [ "$ELAPSED_MS" -gt 400 ]; then
+    echo "    [PASS] Bandwidth cap respected (${ELAPSED_MS} ms)."
+else
+    echo "    [FAIL] Finished too fast for the cap (${ELAPSED_MS} ms)."
+    exit 1
+fi
+
+if [ "$(python3 -c "import json; print(len(json.load(open('$TEST_DIR/sched/.reservations.json'))))")" == "0" ]; then
+    echo "    [PASS] Disk reservations released."
+else
+    echo "    [FAIL] Reservations left behind."
+    exit 1
+fi
+
+# A file that cannot fit under the free-space margin is skipped, not started
+if ! python3 maintenance/download_scheduler.py --dir "$TEST_DIR/sched" --reserve-gb 1000000 \
+    "http://127.0.0.1:$PORT/a.zim" 2>&1 | grep -q "skipped"; then
+    echo "    [FAIL] Oversized download was not refused."
+    exit 1
+fi
+echo "    [PASS] Download refused when disk budget is exhausted."
+
+# 5. Delta sync: v2 = v1 with an insertion (shifts everything after it), an edit and an append
+echo ""
+echo "[*] Testing delta sync..."
+mkdir -p "$TEST_DIR/delta"
+python3 - "$TEST_DIR" <<'EOF'
+import os, sys
+d = sys.argv[1]
+v1 = os.urandom(16 * 1048576)
+v2 = v1[:3000000] + os.urandom(1000) + v1[3000000:9000000] + os.urandom(100000) + v1[9100000:] + os.urandom(1048576)
+open(f"{d}/delta/book_en_all_2025-01.zim", "wb").write(v1)
+open(f"{d}/srv/book_en_all_2025-02.zim", "wb").write(v2)
+EOF
+python3 maintenance/delta_sync.py make "$TEST_DIR/srv/book_en_all_2025-02.zim" > /dev/null
+V2_SHA=$(sha256sum "$TEST_DIR/srv/book_en_all_2025-02.zim" | cut -d' ' -f1)
+rm -f "$TEST_DIR/srv/sent.log"
+
+python3 maintenance/delta_sync.py sync "http://127.0.0.1:$PORT/book_en_all_2025-02.zim" \
+    "$TEST_DIR/delta/book_en_all_2025-01.zim" "$TEST_DIR/delta/book_en_all_2025-02.zim" --sha256 "$V2_SHA" -c 4
+SENT=$(awk '{s+=$1} END {print s}' "$TEST_DIR/srv/sent.log")
+
+if [ "$(sha256sum "$TEST_DIR/delta/book_en_all_2025-02.zim" | cut -d' ' -f1)" == "$V2_SHA" ]; then
+    echo "    [PASS] Delta result matches the published SHA-256."
+else
+    echo "    [FAIL] Delta result differs."
+    exit 1
+fi
+
+# ~1.2 MB changed out of 17 MB: control file plus changed blocks stays well under 4 MB
+if [ "$SENT" -lt 4194304 ]; then
+    echo "    [PASS] Only changed ranges fetched ($SENT bytes)."
+else
+    echo "    [FAIL] Fetched too much ($SENT bytes)."
+    exit 1
+fi
+
+if python3 maintenance/delta_sync.py sync "http://127.0.0.1:$PORT/book_en_all_2025-02.zim" \
+    "$TEST_DIR/delta/book_en_all_2025-01.zim" "$TEST_DIR/delta/bad.zim" --sha256 "$EXPECTED" > /dev/null 2>&1; then
+    echo "    [FAIL] Wrong SHA-256 accepted."
+    exit 1
+fi
+if [ ! -e "$TEST_DIR/delta/bad.zim" ] && [ ! -e "$TEST_DIR/delta/bad.zim.part" ]; then
+    echo "    [PASS] SHA-256 mismatch rejected and removed."
+else
+    echo "    [FAIL] Unverified result left on disk."
+    exit 1
+fi
+
+# 6. ZIM ingest: naming and category from metadata, duplicate/clash rejection, cross-device moves
+echo ""
+echo "[*] Testing ZIM ingest..."
+ZIMS="$TEST_DIR/zims"
+mkdir -p "$ZIMS/incoming" "$ZIMS/library"
+
+# Minimal ZIM writer: metadata plus one article in a single cluster, stored or zstd
+cat > "$TEST_DIR/zimfix.py" <<'EOF'
+import hashlib, os, struct, sys
+
+def write_zim(path, meta, uuid=None, zstd=False):
+    items = sorted([(b"M" + k.encode(), v.encode()) for k, v in meta.items()] + [(b"CMain", b"<p>Main</p>")])
+    offsets = [4 * (len(items) + 1)]
+    for _, blob in items:
+        offsets.append(offsets[-1] + len(blob))
+    data = b"".join(struct.pack("<I", o) for o in offsets) + b"".join(blob for _, blob in items)
+    if zstd:
+        try:
+            import zstandard
+            data = zstandard.ZstdCompressor().compress(data)
+        except ImportError:
+            pass  # only read where no decoder is available
+    cluster = bytes([5 if zstd else 1]) + data
+    mime = b"text/html\0text/plain\0\0"
+    dirents = [struct.pack("<HBcIII", 0 if key[:1] == b"C" else 1, 0, key[:1], 0, 0, i) + key[1:] + b"\0\0"
+               for i, (key, _) in enumerate(items)]
+    n = len(items)
+    url_ptr = 80 + len(mime)
+    title_ptr = url_ptr + 8 * n
+    cluster_ptr = title_ptr + 4 * n
+    pos, ptrs = cluster_ptr + 8, []
+    for d in dirents:
+        ptrs.append(pos)
+        pos += len(d)
+    body = struct.pack("<IHH16sIIQQQQIIQ", 72173914, 6, 1, uuid or os.urandom(16), n, 1, url_ptr, title_ptr,
+                       cluster_ptr, 80, 0xFFFFFFFF, 0xFFFFFFFF, pos + len(cluster))
+    body += mime + b"".join(struct.pack("<Q", p) for p in ptrs) + b"".join(struct.pack("<I", i) for i in range(n))
+    body += struct.pack("<Q", pos) + b"".join(dirents) + cluster
+    with open(path, "wb") as f:
+        f.write(body + hashlib.md5(body).digest())
+
+MEDICINE = {"Name": "wikipedia_en_medicine", "Flavour": "maxi", "Date": "2024-05-01", "Language": "eng",
+            "Title": "Medicine", "Tags": "_category:wikipedia;_pictures:yes"}
+EOF
+
+# Runs a maintenance script as if neither zstandard nor libzim were installed
+cat > "$TEST_DIR/nodecoder.py" <<'EOF'
+import runpy, sys
+sys.modules.update(dict.fromkeys(["zstandard", "libzim", "libzim.reader"]))
+sys.path.insert(0, "maintenance")
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+EOF
+FIXTURE="env PYTHONPATH=$TEST_DIR:maintenance python3 -"
+
+$FIXTURE "$ZIMS/incoming" <<'EOF'
+import sys
+from zimfix import write_zim, MEDICINE
+write_zim(f"{sys.argv[1]}/download1.zim", MEDICINE, uuid=b"m" * 16)
+write_zim(f"{sys.argv[1]}/pump notes.zim", {"Name": "pumpnotes", "Date": "2024-03-15", "Language": "eng"})
+EOF
+INGEST="python3 maintenance/zim_ingest.py batch --incoming $ZIMS/incoming --library $ZIMS/library"
+if $INGEST > "$ZIMS/batch1.log" 2>&1 \
+    && [ -f "$ZIMS/library/encyclopedia/wikipedia_en_medicine_maxi_2024-05.zim" ] \
+    && [ -f "$ZIMS/library/other/pumpnotes_en_all_2024-03.zim" ] && [ -z "$(ls "$ZIMS/incoming")" ]; then
+    echo "    [PASS] Names and categories taken from ZIM metadata."
+else
+    echo "    [FAIL] Batch ingest misfiled: $(cat "$ZIMS/batch1.log")"
+    exit 1
+fi
+
+$FIXTURE "$ZIMS/incoming" <<'EOF'
+import sys
+from zimfix import write_zim, MEDICINE
+write_zim(f"{sys.argv[1]}/again.zim", MEDICINE, uuid=b"m" * 16)
+write_zim(f"{sys.argv[1]}/rebuilt.zim", MEDICINE)
+EOF
+if ! $INGEST > "$ZIMS/batch2.log" 2>&1 && grep -q "again.zim: already in the library" "$ZIMS/batch2.log" \
+    && grep -q "rebuilt.zim: .* exists with different content" "$ZIMS/batch2.log" \
+    && [ -f "$ZIMS/incoming/rejected/again.zim" ] && [ -f "$ZIMS/incoming/rejected/rebuilt.zim" ]; then
+    echo "    [PASS] Duplicate and name clash rejected, library untouched."
+else
+    echo "    [FAIL] Duplicate/clash handling: $(cat "$ZIMS/batch2.log")"
+    exit 1
+fi
+
+# incoming/ on another filesystem: hardlinks fail with EXDEV, the file is copied instead
+if $FIXTURE "$ZIMS" > /dev/null <<'EOF'
+import errno, filecmp, os, shutil, sys
+import zim_ingest
+from zimfix import write_zim
+
+zims = sys.argv[1]
+src = f"{zims}/incoming/field_guide.zim"
+write_zim(src, {"Name": "fieldguide", "Date": "2024-06-01", "Language": "eng"})
+shutil.copyfile(src, f"{zims}/expected.zim")
+link = os.link
+
+def cross_device(a, b):
+    if os.path.dirname(os.path.abspath(a)) == os.path.abspath(f"{zims}/incoming"):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    return link(a, b)
+
+os.link = cross_device
+dest = f"{zims}/library/other/fieldguide_en_all_2024-06.zim"
+ok = (zim_ingest.ingest(src, f"{zims}/incoming", f"{zims}/library") == "ingested"
+      and not os.path.exists(src) and filecmp.cmp(dest, f"{zims}/expected.zim", shallow=False)
+      and not [n for n in os.listdir(os.path.dirname(dest)) if n.endswith(".ingest")])
+sys.exit(0 if ok else 1)
+EOF
+then
+    echo "    [PASS] Cross-device move copied the file and cleaned up."
+else
+    echo "    [FAIL] EXDEV fallback did not file the ZIM."
+    exit 1
+fi
+
+# A standard zstd ZIM on a host without a decoder is not the file's fault: leave it, fail the run
+$FIXTURE "$ZIMS/incoming" <<'EOF'
+import sys
+from zimfix import write_zim
+write_zim(f"{sys.argv[1]}/zstd_book.zim", {"Name": "zstdbook", "Date": "2024-07-01", "Language": "eng"}, zstd=True)
+EOF
+if ! python3 "$TEST_DIR/nodecoder.py" maintenance/zim_ingest.py batch --incoming "$ZIMS/incoming" \
+    --library "$ZIMS/library" > "$ZIMS/batch3.log" 2>&1 \
+    && [ -f "$ZIMS/incoming/zstd_book.zim" ] && [ ! -e "$ZIMS/incoming/rejected/zstd_book.zim" ]; then
+    echo "    [PASS] Missing zstd decoder leaves the file in incoming/ and exits non-zero."
+else
+    echo "    [FAIL] Missing decoder handling: $(cat "$ZIMS/batch3.log")"
+    exit 1
+fi
+rm -f "$ZIMS/incoming/zstd_book.zim"
+
+# 7. Kiwix library.xml: newest version only, drain then retire, unreadable files
+echo ""
+echo "[*] Testing Kiwix library sync..."
+KIWIX="$TEST_DIR/kiwix"
+mkdir -p "$KIWIX/zims/encyclopedia" "$KIWIX/zims/other"
+$FIXTURE "$KIWIX/zims" <<'EOF'
+import sys
+from zimfix import write_zim, MEDICINE
+write_zim(f"{sys.argv[1]}/encyclopedia/wikipedia_en_medicine_maxi_2024-05.zim", MEDICINE)
+write_zim(f"{sys.argv[1]}/encyclopedia/wikipedia_en_medicine_maxi_2024-08.zim", dict(MEDICINE, Date="2024-08-01"))
+write_zim(f"{sys.argv[1]}/other/pumpnotes_en_all_2024-03.zim", {"Name": "pumpnotes", "Date": "2024-03-15"})
+EOF
+LIBRARY="env CIV_ROOT=$KIWIX python3 maintenance/kiwix_library.py"
+books() {
+    python3 -c "import sys, xml.etree.ElementTree as ET; \
+        print(' '.join(sorted(b.get('path') for b in ET.parse(sys.argv[1]).getroot().iter('book'))))" \
+        "$KIWIX/zims/library.xml"
+}
+LIVE="encyclopedia/wikipedia_en_medicine_maxi_2024-08.zim other/pumpnotes_en_all_2024-03.zim"
+
+$LIBRARY sync --library "$KIWIX/zims" > "$KIWIX/sync1.log" 2>&1
+if [ "$(books)" == "$LIVE" ]; then
+    echo "    [PASS] Only the newest version of each book is listed."
+else
+    echo "    [FAIL] library.xml lists: $(books)"
+    exit 1
+fi
+
+OLD="encyclopedia/wikipedia_en_medicine_maxi_2024-05.zim"
+if [ -f "$KIWIX/zims/$OLD" ] && $LIBRARY list --library "$KIWIX/zims" | grep -q "\[DRAINING\] $OLD"; then
+    $LIBRARY sync --library "$KIWIX/zims" --drain 0 > "$KIWIX/sync2.log" 2>&1
+fi
+if [ ! -e "$KIWIX/zims/$OLD" ] && [ -f "$KIWIX/retired/$OLD" ] && [ "$(books)" == "$LIVE" ]; then
+    echo "    [PASS] Superseded version drained, then moved to retired/."
+else
+    echo "    [FAIL] Drain/retire: $(cat "$KIWIX/sync2.log" 2>/dev/null)"
+    exit 1
+fi
+
+# A listed archive that can no longer be read keeps its entry
+python3 -c "import sys; f = open(sys.argv[1], 'r+b'); f.write(b'XXXX')" "$KIWIX/zims/other/pumpnotes_en_all_2024-03.zim"
+$LIBRARY sync --library "$KIWIX/zims" > "$KIWIX/sync3.log" 2>&1
+if [ "$(books)" == "$LIVE" ] && grep -q "keeping its last good record" "$KIWIX/sync3.log"; then
+    echo "    [PASS] Unreadable listed archive keeps its last good entry."
+else
+    echo "    [FAIL] Unreadable archive dropped: $(books)"
+    exit 1
+fi
+
+# No zstd decoder on this host: abort without touching library.xml
+$FIXTURE "$KIWIX/zims" <<'EOF'
+import sys
+from zimfix import write_zim
+write_zim(f"{sys.argv[1]}/other/zstdbook_en_all_2024-07.zim", {"Name": "zstdbook", "Date": "2024-07-01"}, zstd=True)
+EOF
+cp "$KIWIX/zims/library.xml" "$KIWIX/library.before"
+if ! env CIV_ROOT="$KIWIX" python3 "$TEST_DIR/nodecoder.py" maintenance/kiwix_library.py sync \
+    --library "$KIWIX/zims" > "$KIWIX/sync4.log" 2>&1 && cmp -s "$KIWIX/zims/library.xml" "$KIWIX/library.before"; then
+    echo "    [PASS] Missing zstd decoder aborts the sync and leaves library.xml as it was."
+else
+    echo "    [FAIL] Sync without a decoder: $(cat "$KIWIX/sync4.log")"
+    exit 1
+fi
+
+echo ""
+echo "=== All Tests Passed ==="
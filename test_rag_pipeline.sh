@@ -27,5 +27,344 @@ else
     echo "    [WARN] nvidia-smi not found."
 fi
 
+# 4. Semantic passage index (offline: generated ZIMs + stand-in embedder)
+echo "[*] Semantic index build/resume/incremental check:"
+if python3 -c "import numpy, libzim" 2>/dev/null; then
+    TEST_DIR="./test_data/semantic"
+    PORT="${EMBED_PORT:-11499}"
+    rm -rf "$TEST_DIR"
+    mkdir -p "$TEST_DIR/zims" "$TEST_DIR/index"
+
+    # 121 articles; the second version edits one article and adds one
+    python3 - "$TEST_DIR" > /dev/null <<'EOF'
+import sys
+from libzim.writer import Creator, Item, StringProvider, Hint
+
+TOPICS = ["solar panel wiring", "bread baking", "radio antenna tuning", "wound dressing",
+          "battery storage", "seed saving", "knot tying", "soap making"]
+
+class Page(Item):
+    def __init__(self, path, title, html):
+        super().__init__()
+        self.path, self.title, self.html = path, title, html
+    def get_path(self): return self.path
+    def get_title(self): return self.title
+    def get_mimetype(self): return "text/html"
+    def get_contentprovider(self): return StringProvider(self.html)
+    def get_hints(self): return {Hint.FRONT_ARTICLE: True}
+
+def page(i, topic):
+    body = " ".join(f"<p>Part {j} of guide {i} covers {topic} step {j} in detail for a small homestead.</p>"
+                    for j in range(12))
+    return f"<html><body><h1>{topic.title()} {i}</h1>{body}</body></html>"
+
+def make(path, date, edited):
+    pages = [(f"A/Guide_{i}", f"Guide {i}", page(i, TOPICS[i % len(TOPICS)])) for i in range(120)]
+    pages.append(("A/Iron_in_water", "Iron in drinking water",
+                  "<html><body><p>Water with dissolved iron tastes metallic and stains laundry orange.</p>"
+                  "<p>An oxidising filter or aeration removes the metallic taste.</p></body></html>"))
+    if edited:
+        pages[5] = (pages[5][0], pages[5][1], page(5, "rainwater harvesting"))
+        pages.append(("A/Charcoal", "Charcoal making", "<html><body><p>Charcoal is made by heating wood "
+                      "without oxygen in a sealed kiln for many hours.</p></body></html>"))
+    with Creator(path).config_indexing(False, "eng") as c:
+        c.set_mainpath("A/Guide_0")
+        for p in pages:
+            c.add_item(Page(*p))
+        for k, v in {"Title": "Homestead", "Language": "eng", "Date": date, "Name": "homestead_en_all",
+                     "Creator": "test", "Publisher": "test", "Description": "test"}.items():
+            c.add_metadata(k, v)
+
+make(f"{sys.argv[1]}/zims/homestead_en_all_2025-01.zim", "2025-01-01", False)
+make(f"{sys.argv[1]}/homestead_en_all_2025-02.zim", "2025-02-01", True)
+EOF
+
+    BUILD="python3 maintenance/semantic_index.py build --book homestead_en_all --library $TEST_DIR/zims \
+        --index-dir $TEST_DIR/index --embed-url http://127.0.0.1:$PORT --batch 16 --flush 100"
+    META="$TEST_DIR/index/homestead_en_all_2025-01/meta.json"
+    inputs() { curl -s "http://127.0.0.1:$PORT/stats" | python3 -c "import json,sys; print(json.load(sys.stdin)['inputs'])"; }
+
+    # Interrupted build: the embedder starts failing after 10 batches
+    python3 benchmarks/fake_ollama.py --port "$PORT" --fail-after 10 > /dev/null &
+    EMBED_PID=$!
+    sleep 1
+    $BUILD > "$TEST_DIR/build1.log" 2>&1 || true
+    kill $EMBED_PID; wait $EMBED_PID 2>/dev/null || true
+    PARTIAL=$(python3 -c "import json; m=json.load(open('$META')); print(-1 if m['complete'] else m['count'])")
+
+    python3 benchmarks/fake_ollama.py --port "$PORT" > /dev/null &
+    EMBED_PID=$!
+    trap "kill $EMBED_PID 2>/dev/null" EXIT
+    sleep 1
+    $BUILD > "$TEST_DIR/build2.log" 2>&1
+    RESUMED=$(inputs)
+    TOTAL=$(python3 -c "import json; print(json.load(open('$META'))['count'])")
+    if [ "$PARTIAL" -gt 0 ] && [ $((PARTIAL + RESUMED)) -eq "$TOTAL" ]; then
+        echo "    [PASS] Resumed after $PARTIAL of $TOTAL passages without re-embedding them."
+    else
+        echo "    [FAIL] Resume: $PARTIAL before the failure + $RESUMED after != $TOTAL."
+        exit 1
+    fi
+
+    if python3 maintenance/semantic_index.py query homestead_en_all_2025-01 "my water tastes metallic" \
+        --index-dir "$TEST_DIR/index" --embed-url "http://127.0.0.1:$PORT" --top 1 | grep -c "Iron in drinking water" > /dev/null; then
+        echo "    [PASS] 'my water tastes metallic' finds 'Iron in drinking water'."
+    else
+        echo "    [FAIL] Semantic query missed the expected article."
+        exit 1
+    fi
+
+    # New version of the book: only the edited and added passages are embedded
+    mv "$TEST_DIR/homestead_en_all_2025-02.zim" "$TEST_DIR/zims/"
+    BEFORE=$(inputs)
+    $BUILD > "$TEST_DIR/build3.log" 2>&1
+    NEW=$(( $(inputs) - BEFORE ))
+    if [ "$NEW" -gt 0 ] && [ "$NEW" -lt 10 ] && [ -f "$TEST_DIR/index/homestead_en_all_2025-02/meta.json" ]; then
+        echo "    [PASS] New version embedded only its $NEW changed passages."
+    else
+        echo "    [FAIL] New version embedded $NEW passages."
+        exit 1
+    fi
+
+    # The tool answers from the index in "semantic" mode
+    python3 - "$TEST_DIR/index" "$PORT" <<'EOF'
+import asyncio, sys
+sys.path.insert(0, ".")
+import kiwix_tool
+
+tools = kiwix_tool.Tools()
+tools.valves.retrieval = "semantic"
+tools.valves.index_dir = sys.argv[1]
+tools.valves.embed_url = f"http://127.0.0.1:{sys.argv[2]}"
+
+async def run():
+    try:
+        return await tools._retrieve_passages("how is charcoal made", "general", "homestead_en_all_2025-02", {})
+    finally:
+        await kiwix_tool._close_sessions()
+
+passages = asyncio.run(run())
+if passages and "kiln" in passages[0][-1]:
+    print("    [PASS] kiwix_tool semantic retrieval returns the indexed passage.")
+else:
+    print(f"    [FAIL] kiwix_tool semantic retrieval returned {passages[:1]}")
+    sys.exit(1)
+EOF
+else
+    echo "    [SKIP] needs numpy and libzim (pip install numpy libzim)."
+fi
+
+# 5. Vector DB snapshots (manage_vectordb.sh backup/restore/prune engine)
+echo "[*] Vector DB snapshot backup/restore check:"
+TEST_DIR="./test_data/snapshot"
+rm -rf "$TEST_DIR"
+mkdir -p "$TEST_DIR/src/vector_db/seg" "$TEST_DIR/src/uploads"
+python3 - "$TEST_DIR/src" <<'EOF'
+import os, random, sqlite3, sys
+rng = random.Random(7)
+src = sys.argv[1]
+with open(f"{src}/vector_db/seg/data_level0.bin", "wb") as f:
+    f.write(rng.randbytes(12 * 1024 * 1024))
+with open(f"{src}/uploads/manual.txt", "w") as f:
+    f.write("Boil water for one minute. " * 20000)
+db = sqlite3.connect(f"{src}/webui.db")
+db.execute("PRAGMA journal_mode=WAL")
+db.execute("CREATE TABLE chat (id INTEGER PRIMARY KEY, body TEXT)")
+db.executemany("INSERT INTO chat (body) VALUES (?)", [(f"message {i}",) for i in range(5000)])
+db.commit()
+EOF
+SNAP="python3 maintenance/snapshot.py"
+REPO="$TEST_DIR/repo"
+$SNAP backup --source "$TEST_DIR/src" --repo "$REPO" > /dev/null
+
+# 4 KB inserted 1 MB into the 12 MB segment: only the chunks around it are new
+python3 - "$TEST_DIR/src/vector_db/seg/data_level0.bin" <<'EOF'
+import sys
+path = sys.argv[1]
+data = open(path, "rb").read()
+open(path, "wb").write(data[:1 << 20] + b"x" * 4096 + data[1 << 20:])
+EOF
+OUT=$($SNAP backup --source "$TEST_DIR/src" --repo "$REPO")
+WRITTEN=$(ls -t "$REPO"/snapshots/*.json | head -1 | xargs python3 -c "import json,sys; print(json.load(open(sys.argv[1]))['stats']['written'])")
+if echo "$OUT" | grep -q "2 unchanged" && [ "$WRITTEN" -lt $((6 * 1024 * 1024)) ]; then
+    echo "    [PASS] Second snapshot skipped unchanged files and wrote $WRITTEN bytes for a 12 MB file."
+else
+    echo "    [FAIL] Second snapshot: $OUT"
+    exit 1
+fi
+
+$SNAP restore latest "$TEST_DIR/restored" --repo "$REPO" > /dev/null
+ROWS=$(python3 -c "import sqlite3; print(sqlite3.connect('$TEST_DIR/restored/webui.db').execute('SELECT COUNT(*) FROM chat').fetchone()[0])")
+if cmp -s "$TEST_DIR/src/vector_db/seg/data_level0.bin" "$TEST_DIR/restored/vector_db/seg/data_level0.bin" \
+    && cmp -s "$TEST_DIR/src/uploads/manual.txt" "$TEST_DIR/restored/uploads/manual.txt" && [ "$ROWS" == "5000" ]; then
+    echo "    [PASS] Restore reproduces the files and the database."
+else
+    echo "    [FAIL] Restored data differs from the source."
+    exit 1
+fi
+
+# Restoring over a live directory: a WAL left by a crashed writer must not be replayed onto the snapshot
+rm -rf "$TEST_DIR/live" && cp -r "$TEST_DIR/restored" "$TEST_DIR/live"
+touch "$TEST_DIR/live/uploads/stray.txt"
+python3 - "$TEST_DIR/live/webui.db" <<'EOF'
+import os, sqlite3, sys
+db = sqlite3.connect(sys.argv[1])
+db.execute("PRAGMA wal_autocheckpoint=0")
+db.executemany("INSERT INTO chat (body) VALUES (?)", [(f"later {i}",) for i in range(100)])
+db.commit()
+os._exit(0)  # no checkpoint on close: the rows stay in webui.db-wal
+EOF
+$SNAP restore latest "$TEST_DIR/live" --repo "$REPO" --force > /dev/null
+ROWS=$(python3 -c "import sqlite3; print(sqlite3.connect('$TEST_DIR/live/webui.db').execute('SELECT COUNT(*) FROM chat').fetchone()[0])")
+if [ "$ROWS" == "5000" ] && [ ! -e "$TEST_DIR/live/uploads/stray.txt" ]; then
+    echo "    [PASS] Restore over a live directory drops its stale WAL and files the snapshot lacks."
+else
+    echo "    [FAIL] Restore over a live directory left $ROWS rows (want 5000) or kept stray files."
+    exit 1
+fi
+
+if $SNAP prune --repo "$REPO" --keep-last 1 --keep-daily 0 --keep-weekly 0 --keep-monthly 0 | grep -q "Removed 1 snapshots" \
+    && [ "$(ls "$REPO"/snapshots/*.json | wc -l)" == "1" ]; then
+    echo "    [PASS] Prune keeps the newest snapshot and drops the rest."
+else
+    echo "    [FAIL] Prune did not apply --keep-last 1."
+    exit 1
+fi
+
+# 6. PDF library ingest (offline: generated PDFs + stand-in embedder)
+echo "[*] PDF batch ingest check:"
+if python3 -c "import numpy" 2>/dev/null && { command -v pdftotext > /dev/null || python3 -c "import pypdf" 2>/dev/null; }; then
+    TEST_DIR="./test_data/pdfs"
+    PORT="${EMBED_PORT:-11499}"
+    rm -rf "$TEST_DIR"
+    mkdir -p "$TEST_DIR/library/manuals"
+
+    # Minimal text PDFs: running header, a hyphenated line break and a page footer on every page
+    python3 - "$TEST_DIR/library/manuals" <<'EOF'
+import sys
+
+def write_pdf(path, pages):
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = " ".join(f"({line}) Tj T*" for line in lines)
+        stream = f"BT /F1 10 Tf 14 TL 50 760 Td {text} ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objs)} 0 R "
+                    "/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = b"%PDF-1.4\n", []
+    for num, obj in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+def manual(topic, fact, pages=5):
+    body = []
+    for p in range(pages):
+        lines = [f"ACME {topic} Service Manual"]
+        lines += [f"Step {p}.{j}: check the {topic} housing for wear and clean the vents." for j in range(25)]
+        lines += [f"The {topic} must be serviced by a qualified tech-", "nician once a year."]
+        if p == 2:
+            lines.append(fact)
+        lines.append(f"Page {p + 1} of {pages}")
+        body.append(lines)
+    return body
+
+out = sys.argv[1]
+write_pdf(f"{out}/manuals_acme_pump_2024.pdf",
+          manual("pump", "To prime the hand pump, pour a cup of water into the top while working the lever."))
+write_pdf(f"{out}/manuals_acme_inverter_2023.pdf",
+          manual("inverter", "If the inverter beeps three times, the battery voltage is below 10.5 volts."))
+for i in range(6):
+    write_pdf(f"{out}/manuals_bulk_device{i}_2024.pdf", manual(f"device{i}", f"Device {i} resets after ten seconds."))
+EOF
+
+    if [ -n "${EMBED_PID:-}" ]; then kill $EMBED_PID 2>/dev/null; wait $EMBED_PID 2>/dev/null || true; fi
+    python3 benchmarks/fake_ollama.py --port "$PORT" > /dev/null &
+    EMBED_PID=$!
+    trap "kill $EMBED_PID 2>/dev/null" EXIT
+    sleep 1
+    INGEST="python3 maintenance/pdf_ingest.py --pdf-dir $TEST_DIR/library --index-dir $TEST_DIR/index \
+        --cache-db $TEST_DIR/cache.db --embed-url http://127.0.0.1:$PORT --batch 16"
+    export CIV_CHECKSUM_DB="$TEST_DIR/checksums.db"
+    inputs() { curl -s "http://127.0.0.1:$PORT/stats" | python3 -c "import json,sys; print(json.load(sys.stdin)['inputs'])"; }
+
+    $INGEST > "$TEST_DIR/ingest1.log" 2>&1
+    if python3 maintenance/semantic_index.py query pdf_library "how do I prime the pump" --index-dir "$TEST_DIR/index" \
+        --embed-url "http://127.0.0.1:$PORT" --top 1 2>/dev/null | grep -c "pump_2024.pdf#page=3" > /dev/null; then
+        echo "    [PASS] 8 PDFs indexed; 'how do I prime the pump' finds page 3 of the pump manual."
+    else
+        echo "    [FAIL] PDF index query missed the pump manual (see $TEST_DIR/ingest1.log)."
+        exit 1
+    fi
+    if python3 -c "import sqlite3, sys; rows = sqlite3.connect(sys.argv[1]).execute('SELECT text FROM chunks'); \
+        sys.exit(any(m in r[0] for r in rows for m in ('ACME pump Service', 'Page 1 of', 'tech-')))" \
+        "$TEST_DIR/index/pdf_library/chunks.db"; then
+        echo "    [PASS] Running headers, page footers and hyphenated line breaks were cleaned."
+    else
+        echo "    [FAIL] Headers, footers or hyphenated breaks survived normalisation."
+        exit 1
+    fi
+
+    BEFORE=$(inputs)
+    $INGEST > "$TEST_DIR/ingest2.log" 2>&1
+    if [ "$(inputs)" == "$BEFORE" ] && grep -q "8 unchanged, 0 to extract" "$TEST_DIR/ingest2.log"; then
+        echo "    [PASS] Re-run with no changes extracted and embedded nothing."
+    else
+        echo "    [FAIL] Re-run redid work: $(head -3 "$TEST_DIR/ingest2.log")"
+        exit 1
+    fi
+
+    python3 - "$TEST_DIR/index" "$PORT" <<'EOF'
+import asyncio, sys
+sys.path.insert(0, ".")
+import kiwix_tool
+
+tools = kiwix_tool.Tools()
+tools.valves.index_dir = sys.argv[1]
+tools.valves.embed_url = f"http://127.0.0.1:{sys.argv[2]}"
+
+async def run():
+    try:
+        return await tools.search_knowledge_base("inverter beeps three times", "pdfs")
+    finally:
+        await kiwix_tool._close_sessions()
+
+answer = asyncio.run(run())
+if "10.5 volts" in answer:
+    print("    [PASS] kiwix_tool context 'pdfs' answers from the PDF index.")
+else:
+    print(f"    [FAIL] kiwix_tool context 'pdfs' returned: {answer[:200]}")
+    sys.exit(1)
+EOF
+
+    # An embedder answering 200 without vectors must fail the run, not hang it
+    python3 benchmarks/fake_ollama.py --port "$((PORT + 1))" --malformed > /dev/null &
+    BAD_PID=$!
+    trap "kill $EMBED_PID $BAD_PID 2>/dev/null" EXIT
+    sleep 1
+    timeout 120 python3 maintenance/pdf_ingest.py --pdf-dir "$TEST_DIR/library" --index-dir "$TEST_DIR/index_bad" \
+        --cache-db "$TEST_DIR/cache_bad.db" --embed-url "http://127.0.0.1:$((PORT + 1))" --batch 4 \
+        > "$TEST_DIR/ingest_bad.log" 2>&1 && STATUS=0 || STATUS=$?
+    kill $BAD_PID 2>/dev/null
+    if [ "$STATUS" -ne 0 ] && [ "$STATUS" -ne 124 ] && grep -q "malformed /api/embed response" "$TEST_DIR/ingest_bad.log" \
+        && ! grep -q "Traceback" "$TEST_DIR/ingest_bad.log"; then
+        echo "    [PASS] Malformed embedder responses fail the ingest cleanly."
+    else
+        echo "    [FAIL] Malformed embedder responses (exit $STATUS): $(tail -3 "$TEST_DIR/ingest_bad.log")"
+        exit 1
+    fi
+    unset CIV_CHECKSUM_DB
+else
+    echo "    [SKIP] needs numpy and pdftotext or pypdf (apt install poppler-utils / pip install pypdf)."
+fi
+
 echo ""
 echo "Diagnostic Complete."
@@ -51,5 +51,70 @@ else
     exit 1
 fi
 
+# 3. Deep ZIM validation: header, pointer tables and the trailing MD5
+# (3 and 4 need binaries built from this tree: ./build_in_docker.sh; older builds have no --version)
+echo ""
+echo "[*] Testing civ_validate on ZIM archives..."
+if $BIN_DIR/civ_validate --version 2>/dev/null | grep -q "^civ_validate [0-9]"; then
+    python3 - "$TEST_DIR" <<'EOF'
+import hashlib, struct, sys
+d = sys.argv[1]
+# Minimal archive: header, MIME list, empty pointer tables, MD5 of everything before it
+body = b"text/html\0\0"
+end = 80 + len(body)
+header = struct.pack("<IHH16sIIQQQQIIQ", 72173914, 6, 1, b"\0" * 16, 0, 0, end, end, end, 80, 0, 0, end)
+data = header + body
+open(f"{d}/good.zim", "wb").write(data + hashlib.md5(data).digest())
+open(f"{d}/truncated.zim", "wb").write(data)
+rotten = bytearray(data)
+rotten[85] ^= 1
+open(f"{d}/rotten.zim", "wb").write(bytes(rotten) + hashlib.md5(data).digest())
+EOF
+
+    OUTPUT=$($BIN_DIR/civ_validate "$TEST_DIR" --cache "$TEST_DIR/validate_cache.json")
+    for CASE in "good.zim valid" "truncated.zim invalid" "rotten.zim invalid"; do
+        set -- $CASE
+        if echo "$OUTPUT" | grep -A 1 "$1" | grep -q "\"$2\""; then
+            echo "    [PASS] $1 is $2."
+        else
+            echo "    [FAIL] $1 should be $2."
+            exit 1
+        fi
+    done
+
+    OUTPUT=$($BIN_DIR/civ_validate "$TEST_DIR" --cache "$TEST_DIR/validate_cache.json")
+    if [ "$(echo "$OUTPUT" | grep -c '"cached": true')" -eq 3 ]; then
+        echo "    [PASS] Unchanged archives served from the cache."
+    else
+        echo "    [FAIL] Cache not used on the second run."
+        exit 1
+    fi
+else
+    echo "    [SKIP] $BIN_DIR/civ_validate is an old build without --cache/ZIM checks; run ./build_in_docker.sh."
+fi
+
+# 4. Dedup actions: duplicates replaced by hardlinks to one copy
+echo ""
+echo "[*] Testing civ_dedup --hardlink..."
+if $BIN_DIR/civ_dedup --version 2>/dev/null | grep -q "^civ_dedup [0-9]"; then
+    mkdir -p "$TEST_DIR/links"
+    head -c 1048576 /dev/urandom > "$TEST_DIR/links/copy1.zim"
+    cp "$TEST_DIR/links/copy1.zim" "$TEST_DIR/links/copy2.zim"
+    # Same size, differs only in the middle: must survive sampling but not the full hash
+    cp "$TEST_DIR/links/copy1.zim" "$TEST_DIR/links/near.zim"
+    printf 'X' | dd of="$TEST_DIR/links/near.zim" bs=1 seek=500000 conv=notrunc 2>/dev/null
+
+    $BIN_DIR/civ_dedup "$TEST_DIR/links" --hardlink --cache "$TEST_DIR/dedup_cache.json" > /dev/null
+    if [ "$(stat -c %i "$TEST_DIR/links/copy1.zim")" == "$(stat -c %i "$TEST_DIR/links/copy2.zim")" ] && \
+       [ "$(stat -c %i "$TEST_DIR/links/copy1.zim")" != "$(stat -c %i "$TEST_DIR/links/near.zim")" ]; then
+        echo "    [PASS] Duplicate hardlinked, near-duplicate left alone."
+    else
+        echo "    [FAIL] Hardlink action wrong."
+        exit 1
+    fi
+else
+    echo "    [SKIP] $BIN_DIR/civ_dedup is an old build without --hardlink/--cache; run ./build_in_docker.sh."
+fi
+
 echo ""
 echo "=== All Tests Passed ==="
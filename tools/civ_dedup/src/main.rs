@@ -1,11 +1,18 @@
+use rayon::prelude::*;
+use serde::{Deserialize, Serialize};
 use sha2::{Digest, Sha256};
 use std::collections::HashMap;
 use std::env;
 use std::fs::{self, File};
 use std::io::{self, Read};
-use std::path::Path;
+use std::os::unix::fs::{FileExt, MetadataExt};
+use std::path::{Path, PathBuf};
 use walkdir::WalkDir;
-use serde::Serialize;
+
+const HASH_BUFFER: usize = 1024 * 1024;
+const EDGE_BYTES: u64 = 64 * 1024; // head and tail sample
+const SAMPLE_BLOCKS: u64 = 8; // evenly spaced blocks in between
+const SAMPLE_BYTES: u64 = 4096;
 
 #[derive(Serialize)]
 struct DuplicateGroup {
@@ -13,10 +20,43 @@ struct DuplicateGroup {
     files: Vec<String>,
 }
 
+// Full hash of a file, reused while size, mtime and inode are unchanged
+#[derive(Serialize, Deserialize, Clone)]
+struct CacheEntry {
+    size: u64,
+    mtime_ns: i64,
+    inode: u64,
+    sha256: String,
+}
+
+#[derive(Clone)]
+struct FileInfo {
+    path: PathBuf,
+    size: u64,
+    mtime_ns: i64,
+    dev: u64,
+    inode: u64,
+}
+
+#[derive(PartialEq)]
+enum Action {
+    Report,
+    Hardlink,
+    Delete,
+}
+
+struct Options {
+    root_dir: String,
+    action: Action,
+    dry_run: bool,
+    jobs: usize,
+    cache_path: Option<PathBuf>,
+}
+
 fn calculate_hash(path: &Path) -> io::Result<String> {
     let mut file = File::open(path)?;
     let mut hasher = Sha256::new();
-    let mut buffer = [0; 8192];
+    let mut buffer = vec![0; HASH_BUFFER];
 
     loop {
         let count = file.read(&mut buffer)?;
@@ -29,40 +69,318 @@ fn calculate_hash(path: &Path) -> io::Result<String> {
     Ok(hex::encode(hasher.finalize()))
 }
 
-fn main() {
+// Cheap fingerprint: head, tail and a few blocks in between. Files that differ
+// almost always differ here; only what still collides gets a full hash.
+fn sample_hash(info: &FileInfo) -> io::Result<String> {
+    let file = File::open(&info.path)?;
+    let mut hasher = Sha256::new();
+    let mut read_at = |offset: u64, len: u64| -> io::Result<()> {
+        let mut buffer = vec![0; len as usize];
+        file.read_exact_at(&mut buffer, offset)?;
+        hasher.update(&buffer);
+        Ok(())
+    };
+
+    if small_enough_to_sample_fully(info.size) {
+        read_at(0, info.size)?;
+    } else {
+        read_at(0, EDGE_BYTES)?;
+        let stride = (info.size - 2 * EDGE_BYTES) / (SAMPLE_BLOCKS + 1);
+        for i in 1..=SAMPLE_BLOCKS {
+            read_at(EDGE_BYTES + i * stride, SAMPLE_BYTES)?;
+        }
+        read_at(info.size - EDGE_BYTES, EDGE_BYTES)?;
+    }
+    Ok(hex::encode(hasher.finalize()))
+}
+
+fn small_enough_to_sample_fully(size: u64) -> bool {
+    size <= 2 * EDGE_BYTES + SAMPLE_BLOCKS * SAMPLE_BYTES
+}
+
+fn file_info(path: &Path) -> io::Result<FileInfo> {
+    let meta = fs::symlink_metadata(path)?;
+    Ok(FileInfo {
+        path: path.to_path_buf(),
+        size: meta.len(),
+        mtime_ns: meta.mtime() * 1_000_000_000 + meta.mtime_nsec(),
+        dev: meta.dev(),
+        inode: meta.ino(),
+    })
+}
+
+fn load_cache(path: &Path) -> HashMap<String, CacheEntry> {
+    fs::read_to_string(path)
+        .ok()
+        .and_then(|text| serde_json::from_str(&text).ok())
+        .unwrap_or_default()
+}
+
+fn save_cache(path: &Path, cache: &HashMap<String, CacheEntry>) -> io::Result<()> {
+    if let Some(parent) = path.parent() {
+        fs::create_dir_all(parent)?;
+    }
+    let tmp = path.with_extension("tmp");
+    fs::write(&tmp, serde_json::to_string(cache).unwrap())?;
+    fs::rename(&tmp, path)
+}
+
+fn full_hash(info: &FileInfo, cache: &HashMap<String, CacheEntry>) -> io::Result<(String, bool)> {
+    let key = info.path.to_string_lossy();
+    if let Some(entry) = cache.get(key.as_ref()) {
+        if entry.size == info.size && entry.mtime_ns == info.mtime_ns && entry.inode == info.inode {
+            return Ok((entry.sha256.clone(), true));
+        }
+    }
+    Ok((calculate_hash(&info.path)?, false))
+}
+
+// Group by key in parallel, dropping errors (reported) and singleton groups
+fn regroup<F>(groups: Vec<Vec<FileInfo>>, key: F) -> Vec<(String, Vec<FileInfo>)>
+where
+    F: Fn(&FileInfo) -> io::Result<String> + Sync,
+{
+    let keyed: Vec<(String, FileInfo)> = groups
+        .into_par_iter()
+        .flatten()
+        .filter_map(|info| match key(&info) {
+            Ok(k) => Some((k, info)),
+            Err(e) => {
+                eprintln!("Error reading {:?}: {}", info.path, e);
+                None
+            }
+        })
+        .collect();
+
+    let mut by_key: HashMap<String, Vec<FileInfo>> = HashMap::new();
+    for (k, info) in keyed {
+        by_key.entry(k).or_default().push(info);
+    }
+    by_key.into_iter().filter(|(_, files)| files.len() > 1).collect()
+}
+
+fn still_unchanged(info: &FileInfo) -> bool {
+    match file_info(&info.path) {
+        Ok(now) => now.size == info.size && now.mtime_ns == info.mtime_ns && now.inode == info.inode,
+        Err(_) => false,
+    }
+}
+
+// Replace every copy but the first with a hardlink to it (or delete it)
+fn apply(files: &mut Vec<FileInfo>, opts: &Options) -> (u64, usize) {
+    files.sort_by(|a, b| a.path.cmp(&b.path));
+    let keeper = files[0].clone();
+    let mut reclaimed = 0;
+    let mut errors = 0;
+
+    for dup in &files[1..] {
+        if dup.dev == keeper.dev && dup.inode == keeper.inode {
+            continue; // already the same file
+        }
+        if !still_unchanged(dup) || !still_unchanged(&keeper) {
+            eprintln!("Skipping {:?}: changed since it was hashed", dup.path);
+            errors += 1;
+            continue;
+        }
+        let verb = if opts.action == Action::Hardlink { "link" } else { "delete" };
+        if opts.dry_run {
+            eprintln!("[dry-run] {} {:?} (same as {:?})", verb, dup.path, keeper.path);
+            reclaimed += dup.size;
+            continue;
+        }
+        let result = match opts.action {
+            Action::Hardlink => {
+                // Link next to the duplicate, then rename over it: never a moment without the file
+                let tmp = dup.path.with_file_name(format!(
+                    ".{}.civ_dedup",
+                    dup.path.file_name().unwrap().to_string_lossy()
+                ));
+                fs::hard_link(&keeper.path, &tmp).and_then(|_| fs::rename(&tmp, &dup.path)).map_err(|e| {
+                    let _ = fs::remove_file(&tmp);
+                    e
+                })
+            }
+            Action::Delete => fs::remove_file(&dup.path),
+            Action::Report => Ok(()),
+        };
+        match result {
+            Ok(()) => {
+                eprintln!("{}: {:?} -> {:?}", verb, dup.path, keeper.path);
+                reclaimed += dup.size;
+            }
+            Err(e) => {
+                eprintln!("Error: could not {} {:?}: {}", verb, dup.path, e);
+                errors += 1;
+            }
+        }
+    }
+    (reclaimed, errors)
+}
+
+fn parse_args() -> Options {
     let args: Vec<String> = env::args().collect();
-    if args.len() < 2 {
-        eprintln!("Usage: civ_dedup <directory>");
+    let usage = "Usage: civ_dedup <directory> [--hardlink | --delete] [--dry-run] [--jobs N] [--cache FILE | --no-cache]";
+    let civ_root = env::var("CIV_ROOT").unwrap_or_else(|_| "/opt/civilization".to_string());
+    let mut opts = Options {
+        root_dir: String::new(),
+        action: Action::Report,
+        dry_run: false,
+        jobs: 0,
+        cache_path: Some(Path::new(&civ_root).join("cache").join("civ_dedup.json")),
+    };
+
+    let mut i = 1;
+    while i < args.len() {
+        match args[i].as_str() {
+            "--hardlink" if opts.action == Action::Report => opts.action = Action::Hardlink,
+            "--delete" if opts.action == Action::Report => opts.action = Action::Delete,
+            "--dry-run" => opts.dry_run = true,
+            "--no-cache" => opts.cache_path = None,
+            "--version" => {
+                // Scripts probe this to tell a current build from one without the flags above
+                println!("civ_dedup {}", env!("CARGO_PKG_VERSION"));
+                std::process::exit(0);
+            }
+            "--jobs" | "--cache" if i + 1 < args.len() => {
+                if args[i] == "--jobs" {
+                    opts.jobs = args[i + 1].parse().unwrap_or_else(|_| {
+                        eprintln!("{}", usage);
+                        std::process::exit(1);
+                    });
+                } else {
+                    opts.cache_path = Some(PathBuf::from(&args[i + 1]));
+                }
+                i += 1;
+            }
+            arg if !arg.starts_with("--") && opts.root_dir.is_empty() => opts.root_dir = arg.to_string(),
+            _ => {
+                eprintln!("{}", usage);
+                std::process::exit(1);
+            }
+        }
+        i += 1;
+    }
+    if opts.root_dir.is_empty() {
+        eprintln!("{}", usage);
         std::process::exit(1);
     }
+    opts
+}
 
-    let root_dir = &args[1];
-    let mut hashes: HashMap<String, Vec<String>> = HashMap::new();
+fn main() {
+    let opts = parse_args();
+    if opts.jobs > 0 {
+        rayon::ThreadPoolBuilder::new().num_threads(opts.jobs).build_global().unwrap();
+    }
+    let cache = opts.cache_path.as_deref().map(load_cache).unwrap_or_default();
 
-    eprintln!("Scanning {}...", root_dir);
+    eprintln!("Scanning {}...", opts.root_dir);
 
-    for entry in WalkDir::new(root_dir).into_iter().filter_map(|e| e.ok()) {
+    // 1. Size buckets: a file with a unique size has no duplicate
+    let mut by_size: HashMap<u64, Vec<FileInfo>> = HashMap::new();
+    let mut scanned = 0;
+    for entry in WalkDir::new(&opts.root_dir).into_iter().filter_map(|e| e.ok()) {
         if !entry.file_type().is_file() {
             continue;
         }
+        match file_info(entry.path()) {
+            Ok(info) => {
+                scanned += 1;
+                by_size.entry(info.size).or_default().push(info);
+            }
+            Err(e) => eprintln!("Error reading {:?}: {}", entry.path(), e),
+        }
+    }
+    let size_groups: Vec<Vec<FileInfo>> = by_size.into_values().filter(|files| files.len() > 1).collect();
+    let candidates: usize = size_groups.iter().map(|g| g.len()).sum();
 
-        let path = entry.path();
-        match calculate_hash(path) {
-            Ok(hash) => {
-                hashes.entry(hash).or_default().push(path.to_string_lossy().into_owned());
+    // 2. Sampled head/middle/tail hash within each size bucket (size is part of the key)
+    let sampled = regroup(size_groups, |info| Ok(format!("{}:{}", info.size, sample_hash(info)?)));
+    let sampled_count: usize = sampled.iter().map(|(_, g)| g.len()).sum();
+
+    // 3. Full hash only for what still collides; small files were already read whole
+    let (exact, needs_full): (Vec<_>, Vec<_>) = sampled
+        .into_iter()
+        .partition(|(_, files)| small_enough_to_sample_fully(files[0].size));
+    let hashed: Vec<(FileInfo, String, bool)> = needs_full
+        .into_par_iter()
+        .flat_map(|(_, files)| files)
+        .filter_map(|info| match full_hash(&info, &cache) {
+            Ok((hash, cached)) => Some((info, hash, cached)),
+            Err(e) => {
+                eprintln!("Error reading {:?}: {}", info.path, e);
+                None
             }
-            Err(e) => eprintln!("Error reading {:?}: {}", path, e),
+        })
+        .collect();
+    let full_count = hashed.len();
+    let from_cache = hashed.iter().filter(|(_, _, cached)| *cached).count();
+
+    if let Some(cache_path) = &opts.cache_path {
+        let mut updated = cache.clone();
+        for (info, hash, _) in &hashed {
+            updated.insert(
+                info.path.to_string_lossy().into_owned(),
+                CacheEntry { size: info.size, mtime_ns: info.mtime_ns, inode: info.inode, sha256: hash.clone() },
+            );
+        }
+        updated.retain(|path, _| Path::new(path).exists());
+        if let Err(e) = save_cache(cache_path, &updated) {
+            eprintln!("Warning: could not write cache {:?}: {}", cache_path, e);
+        }
+    }
+
+    let mut by_hash: HashMap<String, Vec<FileInfo>> = HashMap::new();
+    for (info, hash, _) in hashed {
+        by_hash.entry(hash).or_default().push(info);
+    }
+    // Small files: the sample covered the whole file, so hash it for the report
+    for (_, files) in exact {
+        match calculate_hash(&files[0].path) {
+            Ok(hash) => by_hash.entry(hash).or_default().extend(files),
+            Err(e) => eprintln!("Error reading {:?}: {}", files[0].path, e),
+        }
+    }
+
+    let mut groups: Vec<(String, Vec<FileInfo>)> = by_hash.into_iter().filter(|(_, files)| files.len() > 1).collect();
+    groups.sort_by(|a, b| a.0.cmp(&b.0));
+
+    let mut reclaimed = 0;
+    let mut failures = 0;
+    if opts.action != Action::Report {
+        for (_, files) in groups.iter_mut() {
+            let (bytes, errors) = apply(files, &opts);
+            reclaimed += bytes;
+            failures += errors;
         }
     }
 
-    let duplicates: Vec<DuplicateGroup> = hashes
+    let duplicates: Vec<DuplicateGroup> = groups
         .into_iter()
-        .filter(|(_, paths)| paths.len() > 1)
-        .map(|(hash, files)| DuplicateGroup { hash, files })
+        .map(|(hash, files)| {
+            let mut files: Vec<String> = files.into_iter().map(|f| f.path.to_string_lossy().into_owned()).collect();
+            files.sort();
+            DuplicateGroup { hash, files }
+        })
         .collect();
 
     let json_output = serde_json::to_string_pretty(&duplicates).unwrap();
     println!("{}", json_output);
-    
+
+    eprintln!(
+        "Scanned {} files: {} share a size, {} survive sampling, {} fully hashed ({} from cache).",
+        scanned, candidates, sampled_count, full_count, from_cache
+    );
     eprintln!("Found {} groups of duplicates.", duplicates.len());
+    if opts.action != Action::Report {
+        eprintln!(
+            "{} {:.2} GB{}.",
+            if opts.dry_run { "Would reclaim" } else { "Reclaimed" },
+            reclaimed as f64 / 1024f64.powi(3),
+            if failures > 0 { format!(", {} failures", failures) } else { String::new() }
+        );
+    }
+    if failures > 0 {
+        std::process::exit(1);
+    }
 }
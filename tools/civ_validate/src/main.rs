@@ -1,15 +1,42 @@
+use memmap2::{Advice, Mmap};
+use md5::{Digest, Md5};
+use rayon::prelude::*;
+use serde::{Deserialize, Serialize};
+use std::collections::HashMap;
 use std::env;
-use std::fs::File;
+use std::fs::{self, File};
 use std::io::{self, Read};
-use std::path::Path;
+use std::os::unix::fs::MetadataExt;
+use std::path::{Path, PathBuf};
 use walkdir::WalkDir;
-use serde::Serialize;
 
-#[derive(Serialize)]
+const ZIM_MAGIC: u32 = 72173914;
+const ZIM_HEADER_LEN: u64 = 80;
+const MD5_CHUNK: usize = 64 * 1024 * 1024;
+
+#[derive(Serialize, Clone)]
 struct ValidationResult {
     path: String,
     status: String, // "valid", "invalid", "unknown"
     error: Option<String>,
+    cached: bool,
+}
+
+// One cache entry per file; reused while size, mtime and inode are unchanged
+#[derive(Serialize, Deserialize, Clone)]
+struct CacheEntry {
+    size: u64,
+    mtime_ns: i64,
+    inode: u64,
+    valid: bool,
+    error: Option<String>,
+}
+
+struct Options {
+    root_dir: String,
+    quick: bool,
+    jobs: usize,
+    cache_path: Option<PathBuf>,
 }
 
 fn check_pdf(path: &Path) -> io::Result<bool> {
@@ -19,58 +46,306 @@ fn check_pdf(path: &Path) -> io::Result<bool> {
     Ok(&buffer == b"%PDF-")
 }
 
-fn check_zim(path: &Path) -> io::Result<bool> {
-    let mut file = File::open(path)?;
-    let mut buffer = [0; 4];
-    file.read_exact(&mut buffer)?;
-    // ZIM file magic bytes: 'Z', 'I', 'M', '\x04' (usually)
-    // We'll just check ZIM for now to be safe across versions
-    Ok(&buffer[0..3] == b"ZIM")
+struct ZimHeader {
+    major: u16,
+    entries: u32,
+    clusters: u32,
+    url_ptr: u64,
+    title_ptr: u64,
+    cluster_ptr: u64,
+    mime_list: u64,
+    checksum_pos: u64,
 }
 
-fn main() {
-    let args: Vec<String> = env::args().collect();
-    if args.len() < 2 {
-        eprintln!("Usage: civ_validate <directory>");
-        std::process::exit(1);
-    }
+fn u16_at(b: &[u8], off: usize) -> u16 {
+    u16::from_le_bytes(b[off..off + 2].try_into().unwrap())
+}
 
-    let root_dir = &args[1];
-    let mut results = Vec::new();
+fn u32_at(b: &[u8], off: usize) -> u32 {
+    u32::from_le_bytes(b[off..off + 4].try_into().unwrap())
+}
+
+fn u64_at(b: &[u8], off: usize) -> u64 {
+    u64::from_le_bytes(b[off..off + 8].try_into().unwrap())
+}
+
+fn parse_zim_header(b: &[u8]) -> Result<ZimHeader, String> {
+    if (b.len() as u64) < ZIM_HEADER_LEN {
+        return Err("truncated: shorter than a ZIM header".to_string());
+    }
+    if u32_at(b, 0) != ZIM_MAGIC {
+        return Err("bad magic number".to_string());
+    }
+    let header = ZimHeader {
+        major: u16_at(b, 4),
+        entries: u32_at(b, 24),
+        clusters: u32_at(b, 28),
+        url_ptr: u64_at(b, 32),
+        title_ptr: u64_at(b, 40),
+        cluster_ptr: u64_at(b, 48),
+        mime_list: u64_at(b, 56),
+        checksum_pos: u64_at(b, 72),
+    };
+    if header.major != 5 && header.major != 6 {
+        return Err(format!("unsupported ZIM major version {}", header.major));
+    }
+    Ok(header)
+}
 
-    eprintln!("Validating files in {}...", root_dir);
+// Every table must lie between the header and the trailing checksum
+fn check_zim_tables(h: &ZimHeader, b: &[u8]) -> Result<(), String> {
+    let len = b.len() as u64;
+    if h.checksum_pos.checked_add(16) != Some(len) {
+        return Err(format!(
+            "truncated or padded: checksum at {} but file is {} bytes",
+            h.checksum_pos, len
+        ));
+    }
+    let in_bounds = |pos: u64, size: u64| {
+        pos >= ZIM_HEADER_LEN && pos.checked_add(size).map_or(false, |end| end <= h.checksum_pos)
+    };
+    let entries = h.entries as u64;
+    let clusters = h.clusters as u64;
+    if !in_bounds(h.url_ptr, 8 * entries) {
+        return Err(format!("URL pointer list out of bounds ({})", h.url_ptr));
+    }
+    // ZIM 6.1+ drops the title list and sets the field to all ones
+    if h.title_ptr != u64::MAX && !in_bounds(h.title_ptr, 4 * entries) {
+        return Err(format!("title pointer list out of bounds ({})", h.title_ptr));
+    }
+    if !in_bounds(h.cluster_ptr, 8 * clusters) {
+        return Err(format!("cluster pointer list out of bounds ({})", h.cluster_ptr));
+    }
+    if !in_bounds(h.mime_list, 1) {
+        return Err(format!("MIME type list out of bounds ({})", h.mime_list));
+    }
 
-    for entry in WalkDir::new(root_dir).into_iter().filter_map(|e| e.ok()) {
-        if !entry.file_type().is_file() {
-            continue;
+    for i in 0..entries {
+        let ptr = u64_at(b, (h.url_ptr + 8 * i) as usize);
+        if !in_bounds(ptr, 1) {
+            return Err(format!("directory entry {} points outside the file ({})", i, ptr));
+        }
+    }
+    if h.title_ptr != u64::MAX {
+        for i in 0..entries {
+            let index = u32_at(b, (h.title_ptr + 4 * i) as usize);
+            if index >= h.entries {
+                return Err(format!("title index {} refers to missing entry {}", i, index));
+            }
+        }
+    }
+    let mut previous = 0u64;
+    for i in 0..clusters {
+        let ptr = u64_at(b, (h.cluster_ptr + 8 * i) as usize);
+        if !in_bounds(ptr, 1) || ptr < previous {
+            return Err(format!("cluster {} offset {} out of order or out of bounds", i, ptr));
         }
+        previous = ptr;
+    }
+    Ok(())
+}
 
-        let path = entry.path();
-        let path_str = path.to_string_lossy().to_string();
-        let extension = path.extension().and_then(|s| s.to_str()).unwrap_or("").to_lowercase();
+fn check_zim(path: &Path, quick: bool) -> Result<(), String> {
+    let file = File::open(path).map_err(|e| e.to_string())?;
+    if file.metadata().map_err(|e| e.to_string())?.len() < ZIM_HEADER_LEN {
+        return Err("truncated: shorter than a ZIM header".to_string());
+    }
+    // Read-only map: the pointer tables are sampled in place and the MD5 streams
+    // through the page cache without an extra copy
+    let map = unsafe { Mmap::map(&file) }.map_err(|e| e.to_string())?;
+    let header = parse_zim_header(&map)?;
+    check_zim_tables(&header, &map)?;
+    if quick {
+        return Ok(());
+    }
 
-        let (is_valid, error) = match extension.as_str() {
-            "pdf" => match check_pdf(path) {
-                Ok(valid) => (valid, None),
-                Err(e) => (false, Some(e.to_string())),
-            },
-            "zim" => match check_zim(path) {
+    let _ = map.advise(Advice::Sequential);
+    let end = header.checksum_pos as usize;
+    let mut hasher = Md5::new();
+    for chunk in map[..end].chunks(MD5_CHUNK) {
+        hasher.update(chunk);
+    }
+    if hasher.finalize().as_slice() != &map[end..end + 16] {
+        return Err("MD5 checksum mismatch (corrupted archive)".to_string());
+    }
+    Ok(())
+}
+
+fn cache_key(path: &Path) -> Option<(u64, i64, u64)> {
+    let meta = fs::metadata(path).ok()?;
+    let mtime_ns = meta.mtime() * 1_000_000_000 + meta.mtime_nsec();
+    Some((meta.len(), mtime_ns, meta.ino()))
+}
+
+fn load_cache(path: &Path) -> HashMap<String, CacheEntry> {
+    fs::read_to_string(path)
+        .ok()
+        .and_then(|text| serde_json::from_str(&text).ok())
+        .unwrap_or_default()
+}
+
+fn save_cache(path: &Path, cache: &HashMap<String, CacheEntry>) -> io::Result<()> {
+    if let Some(parent) = path.parent() {
+        fs::create_dir_all(parent)?;
+    }
+    let tmp = path.with_extension("tmp");
+    fs::write(&tmp, serde_json::to_string(cache).unwrap())?;
+    fs::rename(&tmp, path)
+}
+
+fn validate(path: &Path, opts: &Options, cache: &HashMap<String, CacheEntry>) -> Option<(ValidationResult, Option<CacheEntry>)> {
+    let path_str = path.to_string_lossy().to_string();
+    let extension = path.extension().and_then(|s| s.to_str()).unwrap_or("").to_lowercase();
+
+    match extension.as_str() {
+        "pdf" => {
+            let (is_valid, error) = match check_pdf(path) {
                 Ok(valid) => (valid, None),
                 Err(e) => (false, Some(e.to_string())),
-            },
-            _ => (true, Some("Skipped (unknown type)".to_string())), // unknown types are 'valid' but skipped
-        };
-
-        if !is_valid || (extension == "pdf" || extension == "zim") {
-             // Only report if it's a target type or invalid
-             results.push(ValidationResult {
-                 path: path_str,
-                 status: if is_valid { "valid".to_string() } else { "invalid".to_string() },
-                 error,
-             });
+            };
+            Some((
+                ValidationResult {
+                    path: path_str,
+                    status: if is_valid { "valid".to_string() } else { "invalid".to_string() },
+                    error,
+                    cached: false,
+                },
+                None,
+            ))
+        }
+        "zim" => {
+            let key = cache_key(path);
+            if let (Some((size, mtime_ns, inode)), Some(entry)) = (key, cache.get(&path_str)) {
+                if entry.size == size && entry.mtime_ns == mtime_ns && entry.inode == inode {
+                    return Some((
+                        ValidationResult {
+                            path: path_str,
+                            status: if entry.valid { "valid".to_string() } else { "invalid".to_string() },
+                            error: entry.error.clone(),
+                            cached: true,
+                        },
+                        Some(entry.clone()),
+                    ));
+                }
+            }
+
+            let outcome = check_zim(path, opts.quick);
+            let error = outcome.as_ref().err().cloned();
+            // Only full (MD5) results are worth remembering
+            let entry = match (key, opts.quick) {
+                (Some((size, mtime_ns, inode)), false) => Some(CacheEntry {
+                    size,
+                    mtime_ns,
+                    inode,
+                    valid: outcome.is_ok(),
+                    error: error.clone(),
+                }),
+                _ => None,
+            };
+            Some((
+                ValidationResult {
+                    path: path_str,
+                    status: if outcome.is_ok() { "valid".to_string() } else { "invalid".to_string() },
+                    error,
+                    cached: false,
+                },
+                entry,
+            ))
         }
+        _ => None, // unknown types are skipped
     }
+}
+
+fn parse_args() -> Options {
+    let args: Vec<String> = env::args().collect();
+    let usage = "Usage: civ_validate <directory> [--quick] [--jobs N] [--cache FILE | --no-cache]";
+    let civ_root = env::var("CIV_ROOT").unwrap_or_else(|_| "/opt/civilization".to_string());
+    let mut opts = Options {
+        root_dir: String::new(),
+        quick: false,
+        jobs: 0,
+        cache_path: Some(Path::new(&civ_root).join("cache").join("civ_validate.json")),
+    };
+
+    let mut i = 1;
+    while i < args.len() {
+        match args[i].as_str() {
+            "--quick" => opts.quick = true,
+            "--no-cache" => opts.cache_path = None,
+            "--version" => {
+                // Scripts probe this to tell a current build from one without the flags above
+                println!("civ_validate {}", env!("CARGO_PKG_VERSION"));
+                std::process::exit(0);
+            }
+            "--jobs" | "--cache" if i + 1 < args.len() => {
+                if args[i] == "--jobs" {
+                    opts.jobs = args[i + 1].parse().unwrap_or_else(|_| {
+                        eprintln!("{}", usage);
+                        std::process::exit(1);
+                    });
+                } else {
+                    opts.cache_path = Some(PathBuf::from(&args[i + 1]));
+                }
+                i += 1;
+            }
+            arg if !arg.starts_with("--") && opts.root_dir.is_empty() => opts.root_dir = arg.to_string(),
+            _ => {
+                eprintln!("{}", usage);
+                std::process::exit(1);
+            }
+        }
+        i += 1;
+    }
+    if opts.root_dir.is_empty() {
+        eprintln!("{}", usage);
+        std::process::exit(1);
+    }
+    opts
+}
+
+fn main() {
+    let opts = parse_args();
+    if opts.jobs > 0 {
+        rayon::ThreadPoolBuilder::new().num_threads(opts.jobs).build_global().unwrap();
+    }
+    let cache = opts.cache_path.as_deref().map(load_cache).unwrap_or_default();
+
+    eprintln!("Validating files in {}...", opts.root_dir);
+
+    let files: Vec<PathBuf> = WalkDir::new(&opts.root_dir)
+        .into_iter()
+        .filter_map(|e| e.ok())
+        .filter(|e| e.file_type().is_file())
+        .map(|e| e.into_path())
+        .collect();
+
+    // Large archives dominate, so each file is one task across all cores
+    let outcomes: Vec<(ValidationResult, Option<CacheEntry>)> = files
+        .par_iter()
+        .filter_map(|path| validate(path, &opts, &cache))
+        .collect();
+
+    if let Some(cache_path) = &opts.cache_path {
+        let mut updated = cache.clone();
+        for (result, entry) in &outcomes {
+            if let Some(entry) = entry {
+                updated.insert(result.path.clone(), entry.clone());
+            }
+        }
+        // Forget files that no longer exist
+        updated.retain(|path, _| Path::new(path).exists());
+        if let Err(e) = save_cache(cache_path, &updated) {
+            eprintln!("Warning: could not write cache {:?}: {}", cache_path, e);
+        }
+    }
+
+    let mut results: Vec<ValidationResult> = outcomes.into_iter().map(|(result, _)| result).collect();
+    results.sort_by(|a, b| a.path.cmp(&b.path));
+    let reused = results.iter().filter(|r| r.cached).count();
+    let invalid = results.iter().filter(|r| r.status == "invalid").count();
 
     let json_output = serde_json::to_string_pretty(&results).unwrap();
     println!("{}", json_output);
+
+    eprintln!("Checked {} files ({} from cache), {} invalid.", results.len(), reused, invalid);
 }